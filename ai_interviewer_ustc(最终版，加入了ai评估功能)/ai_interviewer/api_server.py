@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+多会话面试服务（ASGI / FastAPI）
+一轮对话 = ASR -> 知识库检索 -> LLM 流式生成 -> 逐句 TTS，全部在一个事件循环里异步执行，
+所有会话共享 LLM / ASR / TTS 的连接池，单进程可以同时进行几十场面试。Streamlit 等前端通过
+modules/service_client.py 作为瘦客户端接入（设置 INTERVIEW_SERVICE_URL）。
+
+启动：
+    uvicorn api_server:app --host 127.0.0.1 --port 8000
+    或 python api_server.py
+
+接口：
+    POST   /sessions                       创建会话 {"persona", "rag": {"domain","k","mode"} | null, "tts"}
+    GET    /sessions/{id}                  会话状态与历史
+    PATCH  /sessions/{id}                  修改会话设置 {"persona"?, "rag"?, "tts"?}，null 表示不变
+    DELETE /sessions/{id}                  结束会话
+    POST   /sessions/{id}/turns            文字输入 {"text", "persona"?, "rag"?, "tts"?}，返回 SSE 事件流；
+                                           可选字段为 null 时沿用会话设置，rag 为 {"enabled": false} 时关闭检索
+    POST   /sessions/{id}/turns/audio      请求体为录音字节（?filename=audio.wav），返回 SSE 事件流
+    POST   /sessions/{id}/cancel           打断进行中的一轮
+    WS     /sessions/{id}/ws               双向：发送 {"type":"turn","text"} 或二进制录音、{"type":"cancel"}；接收事件
+    GET    /healthz                        负载情况
+    GET    /metrics                        Prometheus 文本格式的耗时指标
+
+事件格式见 turn_event_to_dict：{"type", "data", "elapsed"}，音频以 base64 编码。
+会话正忙或已达轮数上限返回 409，服务过载返回 503（带 Retry-After），会话不存在返回 404。
+启用会话持久化（SESSION_STORE_ENABLED）时，被回收或服务重启前的会话仍可用原 ID 访问，从 output/sessions 的日志恢复。
+"""
+
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager, suppress
+from dataclasses import asdict
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from config import SERVICE_HOST, SERVICE_PORT
+from modules.async_runtime import close_loop_resources
+from modules.session_manager import (
+    InvalidRequestError,
+    ServiceOverloadedError,
+    SessionBusyError,
+    SessionManager,
+    SessionNotFoundError,
+    TurnLimitReachedError,
+)
+from modules.tracing import get_tracer
+from modules.turn_pipeline import AUDIO, CONTEXT, DONE, SENTENCE, TurnEvent, TurnHandle
+
+# 空闲会话的回收周期（秒）
+_EVICT_INTERVAL = 60
+
+
+class SessionCreate(BaseModel):
+    persona: Optional[str] = None
+    rag: Optional[Dict[str, Any]] = {}
+    tts: bool = True
+
+
+class SessionUpdate(BaseModel):
+    persona: Optional[str] = None
+    rag: Optional[Dict[str, Any]] = None
+    tts: Optional[bool] = None
+
+
+class TextTurn(BaseModel):
+    text: str
+    persona: Optional[str] = None
+    rag: Optional[Dict[str, Any]] = None
+    tts: Optional[bool] = None
+
+
+def turn_event_to_dict(event: TurnEvent) -> Dict[str, Any]:
+    """把 TurnEvent 转成可 JSON 序列化的字典。"""
+    data = event.data
+    if event.type == CONTEXT:
+        data = [asdict(hit) for hit in data]
+    elif event.type == SENTENCE:
+        data = {"index": data[0], "text": data[1]}
+    elif event.type == AUDIO:
+        index, audio = data
+        data = {"index": index, "audio": base64.b64encode(audio).decode("ascii") if audio else None}
+    elif event.type == DONE:
+        data = asdict(data)
+        data.pop("audio", None)
+    return {"type": event.type, "data": data, "elapsed": event.elapsed}
+
+
+async def _sse(handle: TurnHandle) -> AsyncIterator[str]:
+    try:
+        async for event in handle.events():
+            yield f"data: {json.dumps(turn_event_to_dict(event), ensure_ascii=False)}\n\n"
+    finally:
+        # 客户端断开（候选人离开）时取消本轮，释放 LLM / TTS 资源
+        handle.cancel()
+
+
+def create_app(manager: Optional[SessionManager] = None) -> FastAPI:
+    state: Dict[str, SessionManager] = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # SessionManager 内部的 asyncio 原语需要在服务的事件循环里创建
+        state["manager"] = manager or SessionManager()
+
+        async def evict_loop():
+            while True:
+                await asyncio.sleep(_EVICT_INTERVAL)
+                state["manager"].evict_idle()
+
+        evictor = asyncio.create_task(evict_loop())
+        try:
+            yield
+        finally:
+            evictor.cancel()
+            with suppress(asyncio.CancelledError):
+                await evictor
+            # 关闭绑定在服务事件循环上的 LLM / ASR / TTS 客户端
+            await close_loop_resources()
+
+    app = FastAPI(title="AI Interviewer Service", lifespan=lifespan)
+
+    def sessions() -> SessionManager:
+        return state["manager"]
+
+    @app.exception_handler(SessionNotFoundError)
+    async def _not_found(request: Request, exc: SessionNotFoundError):
+        return JSONResponse({"detail": "会话不存在或已过期"}, status_code=404)
+
+    @app.exception_handler(SessionBusyError)
+    async def _busy(request: Request, exc: SessionBusyError):
+        return JSONResponse({"detail": str(exc)}, status_code=409)
+
+    @app.exception_handler(TurnLimitReachedError)
+    async def _turn_limit(request: Request, exc: TurnLimitReachedError):
+        return JSONResponse({"detail": str(exc)}, status_code=409)
+
+    @app.exception_handler(ServiceOverloadedError)
+    async def _overloaded(request: Request, exc: ServiceOverloadedError):
+        return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+    @app.exception_handler(InvalidRequestError)
+    async def _bad_request(request: Request, exc: InvalidRequestError):
+        return JSONResponse({"detail": str(exc)}, status_code=400)
+
+    @app.post("/sessions")
+    async def create_session(body: SessionCreate):
+        session = sessions().create(body.persona, body.rag, body.tts)
+        return session.snapshot(include_history=False)
+
+    @app.get("/sessions/{session_id}")
+    async def get_session(session_id: str):
+        return sessions().get(session_id).snapshot()
+
+    @app.patch("/sessions/{session_id}")
+    async def update_session(session_id: str, body: SessionUpdate):
+        session = sessions().get(session_id)
+        sessions().configure(session, body.persona, body.rag, body.tts)
+        return session.snapshot(include_history=False)
+
+    @app.delete("/sessions/{session_id}")
+    async def close_session(session_id: str):
+        sessions().close(session_id)
+        return {"closed": session_id}
+
+    @app.post("/sessions/{session_id}/turns")
+    async def text_turn(session_id: str, body: TextTurn):
+        session = sessions().get(session_id)
+        handle = await sessions().start_turn(
+            session, text=body.text, persona=body.persona, rag_options=body.rag, tts_enabled=body.tts
+        )
+        return StreamingResponse(_sse(handle), media_type="text/event-stream")
+
+    @app.post("/sessions/{session_id}/turns/audio")
+    async def audio_turn(session_id: str, request: Request, filename: str = "audio.wav"):
+        session = sessions().get(session_id)
+        audio = await request.body()
+        if not audio:
+            raise InvalidRequestError("录音为空")
+        handle = await sessions().start_turn(session, audio=audio, audio_filename=filename)
+        return StreamingResponse(_sse(handle), media_type="text/event-stream")
+
+    @app.post("/sessions/{session_id}/cancel")
+    async def cancel_turn(session_id: str):
+        return {"cancelled": sessions().cancel(sessions().get(session_id))}
+
+    @app.websocket("/sessions/{session_id}/ws")
+    async def session_socket(websocket: WebSocket, session_id: str):
+        try:
+            session = sessions().get(session_id)
+        except SessionNotFoundError:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+        forwarder: Optional[asyncio.Task] = None
+
+        async def run_turn(payload: Dict[str, Any]):
+            # 排队与推送都在单独的任务里，接收循环随时能收到打断指令
+            try:
+                handle = await sessions().start_turn(
+                    session,
+                    text=payload.get("text"),
+                    audio=payload.get("audio"),
+                    audio_filename=payload.get("filename", "audio.wav"),
+                    persona=payload.get("persona"),
+                    rag_options=payload.get("rag"),
+                    tts_enabled=payload.get("tts"),
+                )
+            except (SessionBusyError, TurnLimitReachedError, ServiceOverloadedError, InvalidRequestError) as e:
+                await websocket.send_json({"type": "error", "data": str(e)})
+                return
+            except Exception as e:
+                # 内部错误也要回一条 error，否则客户端会一直等不到本轮结束
+                print(f"⚠️ 开始本轮失败: {e!r}")
+                await websocket.send_json({"type": "error", "data": "服务内部错误"})
+                return
+            async for event in handle.events():
+                await websocket.send_json(turn_event_to_dict(event))
+
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    payload = {"type": "turn", "audio": message["bytes"]}
+                else:
+                    try:
+                        payload = json.loads(message.get("text") or "{}")
+                    except json.JSONDecodeError:
+                        await websocket.send_json({"type": "error", "data": "消息不是合法的 JSON"})
+                        continue
+                if payload.get("type") == "cancel":
+                    sessions().cancel(session)
+                elif payload.get("type") == "turn":
+                    if forwarder is not None and not forwarder.done():
+                        await websocket.send_json({"type": "error", "data": "上一轮还没有结束"})
+                        continue
+                    forwarder = asyncio.create_task(run_turn(payload))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sessions().cancel(session)
+            if forwarder is not None:
+                forwarder.cancel()
+                with suppress(asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+                    await forwarder
+
+    @app.get("/healthz")
+    async def healthz():
+        return sessions().stats()
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(get_tracer().to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
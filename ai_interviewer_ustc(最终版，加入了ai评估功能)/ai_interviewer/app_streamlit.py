@@ -3,9 +3,12 @@
 AI 面试官 - Streamlit 前端
 方案：专业会客厅 - 浅灰/米白背景、深灰正文、深蓝强调，卡片式对话与留白。
 """
-import asyncio
+import html
 import json
 import sys
+import time
+from collections import deque
+from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
@@ -20,16 +23,39 @@ from config import (
     STEPFUN_API_KEY,
     TEMP_DIR,
     AUDIO_SAMPLE_RATE,
+    STREAM_RENDER_INTERVAL,
+    TTS_SEGMENT_GAP,
+    RAG_RETRIEVAL_MODE,
+    RAG_PREFETCH_ENABLED,
+    TRACING_ENABLED,
+    METRICS_PORT,
+    REPORT_INCREMENTAL_ENABLED,
     init_directories,
 )
-from modules.llm_agent import llm_stream_chat
-from modules.rag_engine import get_retrieved_context
+from modules.history_manager import ConversationMemory
+from modules.llm_agent import llm_stream_events
+from modules.llm_stream import DELTA, ERROR, USAGE, StreamEvent
+from modules.prompt_builder import PromptCacheStats
+from modules.rag_engine import RETRIEVAL_MODES, RetrievalHit, format_hits_for_prompt
+from modules.rag_prefetch import RetrievalPrefetcher
 from modules.audio_processor import (
+    StreamingSpeechPipeline,
     TTS_no_stream,
+    audio_bytes_to_text,
     chunking_tool,
-    transcribe_file,
+    mp3_duration,
 )
-from modules.ai_report import ai_report_stream, _format_history_for_report
+from modules.ai_report import (
+    ai_report_from_evaluations_stream_events,
+    ai_report_stream_events,
+    _format_history_for_report,
+)
+from modules.async_runtime import run_in_background
+from modules.service_client import get_service_client
+from modules.session_store import get_session_store
+from modules.tracing import get_tracer, start_metrics_server
+from modules.turn_evaluator import IncrementalEvaluator
+from modules.turn_pipeline import AUDIO, CONTEXT, DONE, TEXT_DELTA, TRANSCRIPT, WARNING
 
 # -----------------------------------------------------------------------------
 # 1. 页面配置
@@ -122,8 +148,95 @@ st.markdown(
 
 
 def run_async(coro):
-    """在 Streamlit 中运行 async 函数（同步封装）"""
-    return asyncio.run(coro)
+    """
+    在 Streamlit 中运行 async 函数（同步封装）。
+    提交到常驻的后台事件循环，而不是每次 asyncio.run 新建再销毁，
+    ASR 等长连接可以跨多次 rerun 复用。
+    """
+    return run_in_background(coro)
+
+
+def render_stream(events, render, on_delta=None, error_template="{}", on_usage=None):
+    """
+    消费 LLM 事件流：增量存入列表，按 STREAM_RENDER_INTERVAL 节流重绘，结束时拼接一次。
+    render(text) 负责把当前文本画到占位符上；on_delta(delta) 可选，用于边生成边处理增量；
+    on_usage(usage) 可选，收到 token 用量时调用。
+    返回最终文本；出错时返回按 error_template 格式化的错误信息。
+    """
+    parts = []
+    last_render = 0.0
+    for event in events:
+        if event.type == DELTA:
+            parts.append(event.text)
+            if on_delta:
+                on_delta(event.text)
+            now = time.monotonic()
+            if now - last_render >= STREAM_RENDER_INTERVAL:
+                render("".join(parts))
+                last_render = now
+        elif event.type == USAGE:
+            if on_usage:
+                on_usage(event.usage)
+        elif event.type == ERROR:
+            text = error_template.format(event.text)
+            render(text)
+            return text
+    text = "".join(parts)
+    render(text)
+    return text
+
+
+class SegmentPlayer:
+    """
+    把 StreamingSpeechPipeline 合成好的句子逐段放进页面自动播放，首段语音不必等整段回复生成完。
+    Streamlit 没有播放队列，每段是一个独立的 st.audio；按 mp3 时长估计上一段何时播完，到点再放下一段，避免重叠。
+    """
+
+    def __init__(self, speech, container):
+        self.speech = speech
+        self.container = container
+        self.segments = []          # 本轮全部已合成的段，结束后拼接保存供回放
+        self._queue = deque()       # 已合成、还没轮到播放的段
+        self._play_until = 0.0
+        self._played = 0
+
+    def _flush(self, block):
+        while self._queue:
+            wait_for = self._play_until + TTS_SEGMENT_GAP - time.monotonic()
+            if wait_for > 0:
+                if not block:
+                    return
+                time.sleep(wait_for)
+            audio = self._queue.popleft()
+            self._played += 1
+            # 自动播放的 st.audio 以内容哈希作为元素 ID，同一句话（如缓存命中）出现两次会冲突；
+            # 末尾附一个带序号的 ID3v1 标签让每段内容不同，播放器会忽略它
+            tag = b"TAG" + f"segment {self._played}".encode("ascii").ljust(30, b"\0") + b"\0" * 94 + b"\xff"
+            self.container.audio(audio + tag, format="audio/mp3", autoplay=True)
+            self._play_until = time.monotonic() + mp3_duration(audio)
+
+    def _take(self, block):
+        for _, _, audio in self.speech.iter_segments(block=block):
+            self.segments.append(audio)
+            self._queue.append(audio)
+            self._flush(block)
+
+    def pump(self):
+        """生成过程中随每个增量调用：播放已合成好且轮到的段，不阻塞。"""
+        self._take(block=False)
+        self._flush(block=False)
+
+    def drain(self):
+        """生成结束后调用：按顺序放完剩下的段并等最后一段播完，返回本轮完整的 mp3 字节。"""
+        self.speech.finish()
+        self._take(block=True)
+        self._flush(block=True)
+        remaining = self._play_until - time.monotonic()
+        if remaining > 0:
+            # 随后的 st.rerun 会移除这些音频元素，等播完再刷新页面
+            time.sleep(remaining)
+        self.speech.close()
+        return b"".join(self.segments)
 
 
 # -----------------------------------------------------------------------------
@@ -131,6 +244,12 @@ def run_async(coro):
 # -----------------------------------------------------------------------------
 if "history" not in st.session_state:
     st.session_state.history = []
+# 发给 LLM 的历史：滚动摘要 + 最近几轮原文（完整历史仍保存在 history 中，用于展示和报告）
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
+# 对话请求的 prompt token 与前缀缓存命中统计
+if "prompt_cache_stats" not in st.session_state:
+    st.session_state.prompt_cache_stats = PromptCacheStats()
 # 预设系统提示词模板
 PRESET_PROMPTS = {
     "技术面试官（默认）": "你是一位专业、友善的技术面试官。你会根据候选人的回答进行追问，并给予简洁的反馈。每次回复保持简洁，2～4句话为宜。",
@@ -157,13 +276,78 @@ if "rag_domain" not in st.session_state:
     st.session_state.rag_domain = "cs"
 if "rag_top_k" not in st.session_state:
     st.session_state.rag_top_k = 6
+if "rag_mode" not in st.session_state:
+    st.session_state.rag_mode = RAG_RETRIEVAL_MODE
 if "rag_history" not in st.session_state:
     st.session_state.rag_history = []  # 存储每轮 RAG 检索记录
+# 面试官提问后在后台预取检索结果，候选人回答到达时核对复用
+if "rag_prefetcher" not in st.session_state:
+    st.session_state.rag_prefetcher = RetrievalPrefetcher()
 # 面试报告相关状态
 if "ai_report_text" not in st.session_state:
     st.session_state.ai_report_text = ""  # 已生成的报告内容
 if "report_generating" not in st.session_state:
     st.session_state.report_generating = False
+# 逐轮评分：每轮结束后在后台给回答打分，生成报告时只做汇总
+if "turn_evaluator" not in st.session_state:
+    st.session_state.turn_evaluator = IncrementalEvaluator()
+# 会话持久化：对话、检索记录、报告追加写入 output/sessions/<会话 ID>.jsonl，
+# 会话 ID 放在页面地址的 ?sid= 参数里，刷新页面或重启服务后自动恢复
+session_store = get_session_store()
+# 写入日志的会话设置，变化时才追加新的 meta 记录
+_PERSISTED_SETTINGS = ("system_prompt", "prompt_choice", "enable_tts", "enable_rag", "rag_domain", "rag_top_k", "rag_mode")
+
+
+def evaluate_in_background():
+    """把还没评分的轮次交给后台评分，评分结果同时追加到会话日志。"""
+    if not REPORT_INCREMENTAL_ENABLED:
+        return
+    on_result = None
+    if session_store is not None:
+        session_id = st.session_state.session_id
+        # 回调在后台线程执行，不能访问 st.session_state，提前取出会话 ID
+        on_result = lambda evaluation: session_store.append_eval(session_id, asdict(evaluation))
+    st.session_state.turn_evaluator.submit(st.session_state.history, on_result=on_result)
+
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
+    st.session_state.persisted_meta = {}
+    _sid = st.query_params.get("sid")
+    _snapshot = None
+    if session_store is not None and _sid:
+        try:
+            _snapshot = session_store.load(_sid)
+        except ValueError:
+            _snapshot = None
+    if _snapshot is not None:
+        st.session_state.session_id = _sid
+        st.session_state.history = _snapshot.history
+        st.session_state.rag_history = _snapshot.rag_history
+        st.session_state.ai_report_text = _snapshot.report
+        for _key in _PERSISTED_SETTINGS:
+            if _key in _snapshot.meta:
+                st.session_state[_key] = _snapshot.meta[_key]
+        st.session_state.persisted_meta = dict(_snapshot.meta)
+        # 原文历史超出预算时后台重建滚动摘要
+        st.session_state.memory.maybe_fold(st.session_state.history)
+        # 已保存的逐轮评分直接复用，缺失的轮次在后台补评
+        st.session_state.turn_evaluator.load(_snapshot.evaluations)
+        evaluate_in_background()
+    else:
+        st.session_state.session_id = uuid4().hex
+    if session_store is not None:
+        st.query_params["sid"] = st.session_state.session_id
+# 配置了 INTERVIEW_SERVICE_URL 时作为瘦客户端：对话状态、检索、LLM、TTS 都在面试服务端
+service_client = get_service_client()
+if "service_session_id" not in st.session_state:
+    st.session_state.service_session_id = None
+# Prometheus 指标端点（进程内只启动一次）
+if METRICS_PORT:
+    try:
+        start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        print(f"⚠️ 指标端口 {METRICS_PORT} 启动失败: {e}")
 
 
 # -----------------------------------------------------------------------------
@@ -171,6 +355,10 @@ if "report_generating" not in st.session_state:
 # -----------------------------------------------------------------------------
 with st.sidebar:
     st.title("面试官设置")
+    if service_client is not None:
+        st.caption(f"已连接面试服务：{service_client.base_url}")
+    if session_store is not None:
+        st.caption(f"会话 ID：{st.session_state.session_id}（刷新页面后自动恢复）")
     st.markdown("---")
 
     # 预设提示词选择
@@ -247,6 +435,24 @@ with st.sidebar:
             )
             st.session_state.rag_top_k = rag_top_k
 
+            _mode_labels = {"hybrid": "混合（BM25 + 向量）", "vector": "向量", "lexical": "关键词（离线）"}
+            rag_mode = st.selectbox(
+                "检索方式",
+                options=list(RETRIEVAL_MODES),
+                # 环境变量或旧会话日志里可能是无效值，此时回落到第一项
+                index=RETRIEVAL_MODES.index(st.session_state.rag_mode) if st.session_state.rag_mode in RETRIEVAL_MODES else 0,
+                format_func=lambda m: _mode_labels.get(m, m),
+                help="关键词模式只用本地 BM25 索引，embedding 接口不可用时也能检索",
+            )
+            st.session_state.rag_mode = rag_mode
+
+            _prefetch = st.session_state.rag_prefetcher.stats()
+            if _prefetch["total"]:
+                st.caption(
+                    f"检索预取命中率 {_prefetch['hit_rate']:.0%}（{_prefetch['hit']}/{_prefetch['total']}），"
+                    f"累计节省 {_prefetch['saved_seconds']:.1f}s"
+                )
+
     st.markdown("---")
     if st.button("新对话", use_container_width=True):
         # 清理上一段 TTS 文件
@@ -256,15 +462,72 @@ with st.sidebar:
                 Path(old_tts).unlink(missing_ok=True)
             except Exception:
                 pass
+        if service_client is not None and st.session_state.service_session_id:
+            try:
+                service_client.close_session(st.session_state.service_session_id)
+            except Exception as e:
+                print(f"⚠️ 关闭服务端会话失败: {e}")
+            st.session_state.service_session_id = None
         st.session_state.history = []
+        st.session_state.memory.reset()
         st.session_state.audio_processed_token = None
         st.session_state.last_tts_path = None
         st.session_state.rag_history = []
+        st.session_state.rag_prefetcher.cancel()
         st.session_state.ai_report_text = ""
         st.session_state.report_generating = False
+        st.session_state.turn_evaluator.reset()
+        # 上一场面试的日志保留在磁盘上，关闭其文件句柄；新对话使用新的会话 ID
+        if session_store is not None:
+            session_store.close(st.session_state.session_id)
+        st.session_state.session_id = uuid4().hex
+        st.session_state.persisted_meta = {}
+        if session_store is not None:
+            st.query_params["sid"] = st.session_state.session_id
         st.rerun()
+    _cache = st.session_state.prompt_cache_stats.summary()
+    if _cache["requests"]:
+        with st.expander("Prompt 缓存", expanded=False):
+            _last = st.session_state.prompt_cache_stats.last
+            st.caption(
+                f"上一轮：prompt {_last['prompt_tokens']} tokens，"
+                f"命中缓存 {_last['cached_tokens']}，未命中 {_last['uncached_tokens']}"
+            )
+            st.caption(
+                f"累计 {_cache['requests']} 次请求：命中率 {_cache['cache_hit_ratio']:.0%}，"
+                f"未命中 {_cache['uncached_tokens']} / {_cache['prompt_tokens']} tokens"
+            )
+    _last_turn = get_tracer().last_turn() if TRACING_ENABLED else None
+    if _last_turn is not None and _last_turn.spans:
+        with st.expander("⏱️ 上一轮耗时", expanded=False):
+            st.caption(f"本轮总耗时 {_last_turn.duration:.2f}s（开始 = 距本轮开始的秒数）")
+            st.table([
+                {
+                    "阶段": item["name"] + (f" ⚠️{item['error']}" if item["error"] else ""),
+                    "开始": f"{item['offset']:.2f}",
+                    "耗时": f"{item['duration']:.2f}",
+                    "备注": ", ".join(f"{k}={v}" for k, v in item["attrs"].items()),
+                }
+                for item in _last_turn.breakdown()
+            ])
+            _rows = []
+            for _name, _metrics in get_tracer().snapshot().items():
+                _duration = _metrics.get("duration_seconds")
+                if not _duration:
+                    continue
+                _ttft = _metrics.get("ttft_seconds")
+                _rows.append({
+                    "阶段": _name,
+                    "次数": _duration["count"],
+                    "p50": f"{_duration['p50']:.2f}",
+                    "p95": f"{_duration['p95']:.2f}",
+                    "p99": f"{_duration['p99']:.2f}",
+                    "首 token p50": f"{_ttft['p50']:.2f}" if _ttft else "",
+                })
+            st.caption("累计分位数（秒）")
+            st.table(_rows)
     st.markdown("---")
-    st.caption("语音输入需浏览器授权麦克风；TTS 为整段播报。")
+    st.caption("语音输入需浏览器授权麦克风；TTS 随回复逐句合成，结束后连续播报。")
 
 
 # -----------------------------------------------------------------------------
@@ -278,6 +541,10 @@ tab_voice, tab_chat, tab_rag, tab_report = st.tabs(
 )
 
 user_input = None
+# 瘦客户端模式下录音直接交给服务端识别
+service_audio = None
+# 本轮耗时分解：语音输入从识别开始计时，文字输入从生成回复开始计时
+_turn_trace = None
 
 # ---------- Tab 1: 语音对话 ----------
 with tab_voice:
@@ -292,29 +559,26 @@ with tab_voice:
             raw = audio_value.getvalue()
             token = hash(raw) if raw else id(audio_value)
         except Exception:
+            raw = None
             token = id(audio_value)
         if st.session_state.audio_processed_token != token:
             st.session_state.audio_processed_token = token
-            temp_wav = TEMP_DIR / f"{uuid4().hex}.wav"
-            temp_wav.parent.mkdir(parents=True, exist_ok=True)
-            with open(temp_wav, "wb") as f:
-                f.write(audio_value.getvalue())
-            with st.spinner("正在识别语音..."):
-                try:
-                    text = run_async(
-                        transcribe_file(str(temp_wav), STEPFUN_API_KEY)
-                    )
-                    if text and text.strip():
-                        user_input = text.strip()
-                    else:
-                        st.warning("未识别到有效内容，请重试。")
-                except Exception as e:
-                    st.error(f"语音识别失败: {e}")
-                finally:
+            _turn_trace = get_tracer().start_turn()
+            if service_client is not None:
+                service_audio = raw or audio_value.getvalue()
+            else:
+                with st.spinner("正在识别语音..."):
                     try:
-                        temp_wav.unlink(missing_ok=True)
-                    except Exception:
-                        pass
+                        # 录音数据直接从内存上传，不再落盘为临时 WAV
+                        text = run_async(
+                            audio_bytes_to_text(raw or audio_value.getvalue(), STEPFUN_API_KEY)
+                        )
+                        if text and text.strip():
+                            user_input = text.strip()
+                        else:
+                            st.warning("未识别到有效内容，请重试。")
+                    except Exception as e:
+                        st.error(f"语音识别失败: {e}")
     else:
         st.session_state.audio_processed_token = None
 
@@ -335,10 +599,10 @@ with tab_voice:
     else:
         st.info("点击上方麦克风开始语音面试")
 
-    # TTS 自动播放（autoplay=True 无需手动点击播放按钮）
+    # TTS 自动播放（autoplay=True 无需手动点击播放按钮）；本地模式边生成边播放过的不再重复播放
     last_tts = st.session_state.get("last_tts_path")
     if last_tts and Path(last_tts).exists():
-        st.audio(last_tts, format="audio/mp3", autoplay=True)
+        st.audio(last_tts, format="audio/mp3", autoplay=st.session_state.get("last_tts_autoplay", True))
 
 # ---------- Tab 2: 文字对话 ----------
 with tab_chat:
@@ -372,24 +636,32 @@ with tab_rag:
     else:
         st.markdown(f"共 **{len(st.session_state.rag_history)}** 条检索记录")
         for idx, item in enumerate(reversed(st.session_state.rag_history), 1):
-            query = item.get("query", "")
+            query = html.escape(item.get("query", ""))
             content = item.get("retrieved", "")
+            hits = item.get("hits", [])
             domain = item.get("domain", "")
             top_k = item.get("top_k", "")
-            snippets = [s.strip() for s in content.split("\n") if s.strip()]
             preview_html = ""
-            for i, snippet in enumerate(snippets, 1):
-                display = snippet[:300] + ("..." if len(snippet) > 300 else "")
-                preview_html += f"<div style='margin-bottom:4px'><b>片段 {i}:</b> {display}</div>"
+            for i, hit in enumerate(hits, 1):
+                text = hit["text"].strip()
+                display = html.escape(text[:300] + ("..." if len(text) > 300 else ""))
+                labels = " / ".join(
+                    v for v in (hit["metadata"].get("topic"), hit["metadata"].get("difficulty")) if v
+                )
+                meta = f"{hit['source']} {hit['score']:.3f}" + (f" · {labels}" if labels else "")
+                preview_html += (
+                    f"<div style='margin-bottom:6px'><b>片段 {i}</b> "
+                    f"<span class='rag-meta'>({html.escape(meta)})</span><br>{display}</div>"
+                )
             st.markdown(
                 f"""<div class="rag-card">
                     <div class="rag-query">Q: {query}</div>
                     <div class="rag-content">{preview_html}</div>
-                    <div class="rag-meta">领域: {domain} · Top-{top_k} · 共 {len(snippets)} 条片段</div>
+                    <div class="rag-meta">领域: {domain} · Top-{top_k} · 共 {len(hits)} 条片段 · 预取: {item.get("prefetch") or "-"}</div>
                 </div>""",
                 unsafe_allow_html=True,
             )
-            with st.expander(f"查看完整检索内容 #{idx}", expanded=False):
+            with st.expander(f"查看拼入 prompt 的检索内容 #{idx}", expanded=False):
                 st.text(content)
 
 # ---------- Tab 4: 面试报告 ----------
@@ -445,6 +717,12 @@ with tab_report:
     if not _history:
         st.info("暂无对话记录，面试结束后可生成 AI 评价报告。")
     else:
+        if REPORT_INCREMENTAL_ENABLED:
+            _eval_stats = st.session_state.turn_evaluator.stats()
+            st.caption(
+                f"逐轮评分：已完成 {_eval_stats['scored']} 轮，进行中 {_eval_stats['pending']} 轮；"
+                f"生成报告时只汇总这些评分，不再重读整段对话。"
+            )
         if st.button("🤖 生成 AI 面试评价报告", use_container_width=True, type="primary"):
             st.session_state.report_generating = True
             st.session_state.ai_report_text = ""
@@ -452,13 +730,28 @@ with tab_report:
         # 流式生成报告
         if st.session_state.report_generating:
             report_placeholder = st.empty()
-            with st.spinner("Qwen-max 正在深度分析面试表现，请稍候（约 15~30 秒）..."):
-                try:
-                    for partial_report in ai_report_stream(_history):
-                        st.session_state.ai_report_text = partial_report
-                        report_placeholder.markdown(partial_report)
-                except Exception as e:
-                    st.error(f"报告生成失败: {e}")
+            try:
+                if REPORT_INCREMENTAL_ENABLED:
+                    # 逐轮评分大多已在面试过程中完成，这里只等剩余的几轮，再做一次汇总
+                    with st.spinner("正在汇总逐轮评分，生成面试评价报告..."):
+                        evaluations = st.session_state.turn_evaluator.results(_history)
+                        report_events = ai_report_from_evaluations_stream_events(evaluations)
+                        st.session_state.ai_report_text = render_stream(
+                            report_events,
+                            report_placeholder.markdown,
+                            error_template="⚠️ 面试评价报告生成失败: {}",
+                        )
+                else:
+                    with st.spinner("Qwen-max 正在深度分析面试表现，请稍候（约 15~30 秒）..."):
+                        st.session_state.ai_report_text = render_stream(
+                            ai_report_stream_events(_history),
+                            report_placeholder.markdown,
+                            error_template="⚠️ 面试评价报告生成失败: {}",
+                        )
+            except Exception as e:
+                st.error(f"报告生成失败: {e}")
+            if session_store is not None and st.session_state.ai_report_text:
+                session_store.set_report(st.session_state.session_id, st.session_state.ai_report_text)
             st.session_state.report_generating = False
             st.rerun()
 
@@ -501,50 +794,234 @@ with tab_report:
 # -----------------------------------------------------------------------------
 # 6. 共享处理逻辑：LLM + RAG + TTS
 # -----------------------------------------------------------------------------
-if user_input:
+def rag_options():
+    """当前侧边栏的检索参数；预取与正式检索使用同一组参数，参数变化后预取结果作废。"""
+    return {
+        "domain": st.session_state.rag_domain,
+        "k": st.session_state.rag_top_k,
+        "persist_dir": str(Path(__file__).parent / "vector_db"),
+        "mode": st.session_state.rag_mode,
+    }
+
+
+def save_tts_audio(audio_bytes, autoplay=True):
+    """把本轮合成的语音写入临时 mp3 供语音 Tab 播放（autoplay 时自动播放），并删除上一轮的文件。"""
+    temp_mp3 = TEMP_DIR / f"{uuid4().hex}.mp3"
+    temp_mp3.write_bytes(audio_bytes)
+    old_tts = st.session_state.get("last_tts_path")
+    if old_tts and old_tts != str(temp_mp3) and Path(old_tts).exists():
+        try:
+            Path(old_tts).unlink(missing_ok=True)
+        except Exception:
+            pass
+    st.session_state.last_tts_path = str(temp_mp3)
+    st.session_state.last_tts_autoplay = autoplay
+
+
+def record_rag_hits(query, hits, prefetch_outcome=None):
+    """把本轮检索结果记入「RAG 知识检索」Tab，并追加到会话日志。"""
+    retrieved = format_hits_for_prompt(hits)
+    if retrieved and retrieved.strip():
+        item = {
+            "query": query,
+            "retrieved": retrieved,
+            "hits": [asdict(hit) for hit in hits],
+            "domain": st.session_state.rag_domain,
+            "top_k": st.session_state.rag_top_k,
+            "prefetch": prefetch_outcome,
+        }
+        st.session_state.rag_history.append(item)
+        if session_store is not None:
+            session_store.append_rag(st.session_state.session_id, item)
+    return retrieved
+
+
+def persist_turn(messages):
+    """把本轮的消息追加到会话日志；侧边栏设置有变化时先记一条 meta。"""
+    if session_store is None:
+        return
+    session_id = st.session_state.session_id
+    settings = {key: st.session_state[key] for key in _PERSISTED_SETTINGS}
+    changed = {k: v for k, v in settings.items() if st.session_state.persisted_meta.get(k) != v}
+    if changed:
+        session_store.set_meta(session_id, **changed)
+        st.session_state.persisted_meta.update(changed)
+    session_store.append_messages(session_id, messages)
+
+
+def service_rag_options():
+    """发给面试服务的检索参数；知识库目录由服务端决定。"""
+    if not st.session_state.enable_rag:
+        return {"enabled": False}
+    return {
+        "domain": st.session_state.rag_domain,
+        "k": st.session_state.rag_top_k,
+        "mode": st.session_state.rag_mode,
+    }
+
+
+def ensure_service_session():
+    """首次发言时在服务端创建会话；服务重启或会话过期后重新创建（服务端历史从头开始）。"""
+    session_id = st.session_state.service_session_id
+    if session_id:
+        try:
+            service_client.get_session(session_id)
+            return session_id
+        except RuntimeError:
+            pass
+    session_id = service_client.create_session(
+        st.session_state.system_prompt, service_rag_options(), st.session_state.enable_tts
+    )
+    st.session_state.service_session_id = session_id
+    return session_id
+
+
+def service_turn_events(events, turn):
+    """
+    把面试服务的事件流转成 render_stream 能消费的 StreamEvent：文本增量照常渲染，
+    识别结果、检索结果、语音、最终结果记在 turn 里。
+    """
+    for event in events:
+        data = event["data"]
+        if event["type"] == TRANSCRIPT:
+            turn["transcript"] = data
+        elif event["type"] == CONTEXT:
+            turn["hits"] = data
+        elif event["type"] == TEXT_DELTA:
+            yield StreamEvent(DELTA, text=data)
+        elif event["type"] == AUDIO:
+            if data["audio"]:
+                turn["audio"].append(data["audio"])
+        elif event["type"] == WARNING:
+            turn["warnings"].append(data)
+        elif event["type"] == DONE:
+            turn["result"] = data
+            if data.get("usage"):
+                yield StreamEvent(USAGE, usage=data["usage"])
+            if data.get("error"):
+                yield StreamEvent(ERROR, text=data["error"])
+        elif event["type"] == "error":
+            yield StreamEvent(ERROR, text=data)
+
+
+if (user_input or service_audio) and st.session_state.memory.turn_limit_reached(st.session_state.history):
+    st.warning(
+        f"本场面试已达到 {st.session_state.memory.max_turns} 轮上限，请在「面试报告」中生成评价，或点击「新对话」重新开始。"
+    )
+    user_input = None
+    service_audio = None
+
+if _turn_trace is not None and not (user_input or service_audio):
+    # 没有识别出内容或已达轮数上限，本轮到此结束
+    get_tracer().end_turn(_turn_trace)
+
+if service_client is not None and (user_input or service_audio):
+    # 瘦客户端：识别、检索、生成、逐句合成都在服务端完成，这里只渲染事件
+    _turn_trace = _turn_trace or get_tracer().start_turn()
+    reply_placeholder = st.empty()
+    turn = {"transcript": user_input, "hits": [], "audio": [], "warnings": [], "result": None}
+    with st.spinner("面试官正在思考..."):
+        try:
+            full_response = render_stream(
+                service_turn_events(
+                    service_client.turn(
+                        ensure_service_session(),
+                        text=user_input,
+                        audio=service_audio,
+                        persona=st.session_state.system_prompt,
+                        rag=service_rag_options(),
+                        tts=st.session_state.enable_tts,
+                    ),
+                    turn,
+                ),
+                lambda text: reply_placeholder.markdown(
+                    f'<div class="chat-card-assistant"><p>{text}</p></div>',
+                    unsafe_allow_html=True,
+                ),
+                error_template="抱歉，系统出现了点小故障: {}",
+                on_usage=st.session_state.prompt_cache_stats.record,
+            )
+        except Exception as e:
+            full_response = f"抱歉，系统出现了点小故障: {str(e)}"
+    for warning in turn["warnings"]:
+        st.warning(warning)
+    if not turn["transcript"]:
+        if service_audio is not None and not full_response.startswith("抱歉"):
+            st.warning("未识别到有效内容，请重试。")
+        else:
+            st.error(full_response)
+    else:
+        st.session_state.history.append({"role": "user", "content": turn["transcript"]})
+        st.session_state.history.append({"role": "assistant", "content": full_response})
+        persist_turn(st.session_state.history[-2:])
+        evaluate_in_background()
+        if turn["hits"]:
+            record_rag_hits(
+                turn["transcript"],
+                [RetrievalHit(**hit) for hit in turn["hits"]],
+                (turn["result"] or {}).get("speculative"),
+            )
+        if turn["audio"] and not full_response.startswith("抱歉"):
+            save_tts_audio(b"".join(turn["audio"]))
+    get_tracer().end_turn(_turn_trace)
+    if turn["transcript"]:
+        st.rerun()
+
+elif user_input:
+    _turn_trace = _turn_trace or get_tracer().start_turn()
     st.session_state.history.append({"role": "user", "content": user_input})
     reply_placeholder = st.empty()
     full_response = ""
+    # TTS：LLM 每生成完一句就开始合成，合成好一段就播放一段，不必等整段回复结束
+    speech = (
+        StreamingSpeechPipeline(TTS_no_stream(STEPFUN_API_KEY))
+        if st.session_state.enable_tts
+        else None
+    )
+    player = SegmentPlayer(speech, st.container()) if speech is not None else None
+
+    def feed_speech(delta):
+        speech.feed_delta(delta)
+        player.pump()
+
     with st.spinner("面试官正在思考..."):
         try:
-            augmented_system_prompt = st.session_state.system_prompt
             retrieved = ""
 
+            # --- 历史：较早的轮次已折叠进摘要，只发送最近几轮原文 ---
+            summary, recent_history = st.session_state.memory.build_context(
+                st.session_state.history[:-1]
+            )
+
             # --- RAG 检索 ---
             if st.session_state.enable_rag:
-                persist_dir = str(Path(__file__).parent / "vector_db")
+                hits, prefetch_outcome = [], None
                 try:
-                    retrieved = get_retrieved_context(
-                        user_input,
-                        domain=st.session_state.rag_domain,
-                        k=st.session_state.rag_top_k,
-                        persist_dir=persist_dir,
+                    # 上一轮提问后已在后台预取；与回答相关则直接复用，否则用回答重新检索
+                    hits, prefetch_outcome = st.session_state.rag_prefetcher.resolve(
+                        user_input, **rag_options()
                     )
+                    retrieved = record_rag_hits(user_input, hits, prefetch_outcome)
                 except Exception as e:
                     st.warning(f"RAG 检索失败: {e}")
                     retrieved = ""
 
-                if retrieved and retrieved.strip():
-                    augmented_system_prompt += (
-                        "\n\n参考知识库内容（仅供回答参考）：\n" + retrieved
-                    )
-                    st.session_state.rag_history.append({
-                        "query": user_input,
-                        "retrieved": retrieved,
-                        "domain": st.session_state.rag_domain,
-                        "top_k": st.session_state.rag_top_k,
-                    })
-
-            for partial in llm_stream_chat(
-                st.session_state.history[:-1],
-                user_input,
-                system_prompt=augmented_system_prompt,
-            ):
-                full_response = partial
-                reply_placeholder.markdown(
-                    f'<div class="chat-card-assistant"><p>{full_response}</p></div>',
+            full_response = render_stream(
+                llm_stream_events(
+                    recent_history,
+                    user_input,
+                    system_prompt=st.session_state.system_prompt,
+                    context=retrieved,
+                    summary=summary,
+                ),
+                lambda text: reply_placeholder.markdown(
+                    f'<div class="chat-card-assistant"><p>{text}</p></div>',
                     unsafe_allow_html=True,
-                )
+                ),
+                on_delta=feed_speech if speech is not None else None,
+                error_template="抱歉，系统出现了点小故障: {}",
+                on_usage=st.session_state.prompt_cache_stats.record,
+            )
         except Exception as e:
             full_response = f"抱歉，系统出现了点小故障: {str(e)}"
             reply_placeholder.markdown(
@@ -552,21 +1029,28 @@ if user_input:
                 unsafe_allow_html=True,
             )
     st.session_state.history.append({"role": "assistant", "content": full_response})
+    persist_turn(st.session_state.history[-2:])
+    evaluate_in_background()
+    # 原文历史超出预算时，后台把最早的几轮折叠进摘要，下一轮生效
+    st.session_state.memory.maybe_fold(st.session_state.history)
+    # 下一个问题已确定：候选人思考、作答期间在后台预取检索结果
+    if (
+        RAG_PREFETCH_ENABLED
+        and st.session_state.enable_rag
+        and full_response
+        and not full_response.startswith("抱歉")
+    ):
+        st.session_state.rag_prefetcher.prefetch(full_response, **rag_options())
 
-    # TTS：生成语音，语音 Tab 会自动播放
-    if st.session_state.enable_tts and full_response and not full_response.startswith("抱歉"):
-        with st.spinner("正在生成语音..."):
-            tts = TTS_no_stream(STEPFUN_API_KEY)
-            temp_mp3 = TEMP_DIR / f"{uuid4().hex}.mp3"
-            if tts.to_speech(full_response, str(temp_mp3)):
-                old_tts = st.session_state.get("last_tts_path")
-                if old_tts and old_tts != str(temp_mp3) and Path(old_tts).exists():
-                    try:
-                        Path(old_tts).unlink(missing_ok=True)
-                    except Exception:
-                        pass
-                st.session_state.last_tts_path = str(temp_mp3)
-            else:
-                st.error("语音生成失败，请检查网络或 API 配置。")
+    # TTS：播完剩余的句子；整段语音另存一份，刷新后在语音 Tab 可回放（已经播过，不再自动播放）
+    if speech is not None and full_response and not full_response.startswith("抱歉"):
+        audio_bytes = player.drain()
+        if audio_bytes:
+            save_tts_audio(audio_bytes, autoplay=False)
+        else:
+            st.error("语音生成失败，请检查网络或 API 配置。")
+    elif speech is not None:
+        speech.close()
 
+    get_tracer().end_turn(_turn_trace)
     st.rerun()
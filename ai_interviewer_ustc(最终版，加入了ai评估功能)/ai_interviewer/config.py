@@ -10,7 +10,7 @@ from pathlib import Path
 STEPFUN_API_KEY = os.getenv("STEPFUN_API_KEY", "6pZ3jWJGHoMXAcZZpjF3ierYzYDqHEpQLU9gK6auHIWhB1uthsLfqUAnzGLcBiW5x")
 
 # 阿里云 DashScope API (用于 LLM)
-DASHSCOPE_API_KEY ="sk-af8e9af4aae340bd86178117f7f3f33c" #os.getenv("DASHSCOPE_API_KEY", "sk-af8e9af4aae340bd86178117f7f3f33c")
+DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "sk-af8e9af4aae340bd86178117f7f3f33c")
 
 # ==================== 路径配置 ====================
 # 项目根目录
@@ -29,18 +29,87 @@ VIDEOS_DIR = OUTPUT_DIR / "videos"
 # 临时文件目录
 TEMP_DIR = BASE_DIR / "temp_audio"
 
+# 缓存目录（查询向量缓存等，可随时删除）
+CACHE_DIR = BASE_DIR / "cache"
+
 # ==================== 模型配置 ====================
 # LLM 模型
 LLM_MODEL = "qwen-plus"
-LLM_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+# 接口地址可用环境变量覆盖（如指向 scripts/fake_services.py 的本地替身做压测）
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+# 面试对话使用的百炼 API Key（报告生成使用 DASHSCOPE_API_KEY）
+LLM_API_KEY = os.getenv("LLM_API_KEY", "sk-97cc56de88184ad1913987c3005a8c93")
+
+# LLM 客户端连接池：连接/读取超时（秒）、连接数上限、全局并发请求上限、429/5xx 重试
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_READ_TIMEOUT = 120.0
+LLM_MAX_CONNECTIONS = 32
+LLM_MAX_KEEPALIVE_CONNECTIONS = 16
+LLM_MAX_CONCURRENCY = 16
+LLM_MAX_RETRIES = 3
+LLM_RETRY_BASE_DELAY = 0.5
 
 # TTS 模型
 TTS_MODEL = "step-tts-mini"
 TTS_VOICE = "cixingnansheng"  # 磁性男声
+TTS_VOLUME = 1.0
+
+# TTS 音频缓存：目录与总大小上限（字节），超过后按最近使用时间淘汰
+TTS_CACHE_DIR = CACHE_DIR / "tts"
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024
 
 # ASR 模型
 ASR_MODEL = "step-asr"
 
+# StepFun 接口地址（TTS 与 ASR 共用）
+STEPFUN_BASE_URL = os.getenv("STEPFUN_BASE_URL", "https://api.stepfun.com/v1")
+
+# ASR 长连接：连接数上限、空闲连接保活时间（秒，需覆盖两次回答之间的间隔）、单次请求超时（秒）
+ASR_MAX_CONNECTIONS = 8
+ASR_KEEPALIVE_TIMEOUT = 120
+ASR_TIMEOUT = 30
+
+# Embedding 模型（RAG 建库与检索必须使用同一个模型）
+EMBEDDING_MODEL = "text-embedding-v2"
+
+# Embedding 后端：dashscope 远程模型 + Chroma；local 本地哈希 n-gram 向量 + NumPy flat 索引（完全离线）
+# 切换后端需要用 build_cs_vector_store.py --backend 重新建库
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "dashscope")
+# 本地后端的向量维度
+LOCAL_EMBEDDING_DIM = 512
+
+# 查询向量缓存：内存 LRU 条数；持久化文件路径（环境变量设为空字符串则只用内存缓存）
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+QUERY_EMBEDDING_CACHE_PATH = os.getenv(
+    "QUERY_EMBEDDING_CACHE_PATH", str(CACHE_DIR / "query_embeddings.sqlite3")
+)
+# 持久层最多保存的向量条数，超出后按最近使用时间淘汰（1024 维约 8KB/条）
+QUERY_EMBEDDING_DISK_MAX_ENTRIES = 20000
+
+# 建库时的 embedding 批量写入：每批条数（DashScope 单次上限 25）、并发请求数、单批最大重试次数
+EMBEDDING_BATCH_SIZE = 25
+EMBEDDING_MAX_WORKERS = 4
+EMBEDDING_MAX_RETRIES = 5
+
+# RAG 默认检索方式：vector 纯向量 / lexical 纯 BM25 关键词（不访问网络）/ hybrid 两路 RRF 融合
+# 库目录下没有 BM25 索引时，首次词法检索会从向量库里的文本现场生成一份
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+# hybrid 模式下向量检索（含 embedding 请求）最多等待的秒数，超时只用词法结果
+RAG_HYBRID_VECTOR_TIMEOUT = 3.0
+
+# 向量相似度下限（0~1），低于该值的片段视为不相关直接丢弃；设为 0 关闭
+RAG_MIN_SCORE = 0.2
+# 近重复去重：两个片段字符 3-gram 的 Jaccard 相似度超过该值时只保留排名靠前的一个
+RAG_DEDUP_THRESHOLD = 0.8
+# 拼进 prompt 的检索内容 token 预算
+RAG_CONTEXT_TOKEN_BUDGET = 800
+
+# RAG 推测式预取：面试官提问后立即用问题检索；回答的关键词被预取结果覆盖的比例不低于该值时直接复用
+RAG_PREFETCH_ENABLED = True
+RAG_PREFETCH_MIN_OVERLAP = 0.3
+# 回答到达时最多等待进行中的预取多少秒，超时则改用回答重新检索
+RAG_PREFETCH_TIMEOUT = 3.0
+
 # ==================== 应用配置 ====================
 # 音频采样率
 AUDIO_SAMPLE_RATE = 16000
@@ -48,9 +117,76 @@ AUDIO_SAMPLE_RATE = 16000
 # 最大对话轮数
 MAX_CONVERSATION_TURNS = 50
 
+# 历史管理：原文历史的 token 预算（超出后把最早的几轮折叠进滚动摘要）、至少保留原文的最近轮数、摘要长度上限
+HISTORY_TOKEN_BUDGET = 3000
+HISTORY_KEEP_RECENT_TURNS = 4
+HISTORY_SUMMARY_MAX_TOKENS = 400
+# 生成滚动摘要用的模型（后台调用，选便宜的即可）
+HISTORY_SUMMARY_MODEL = "qwen-turbo"
+
 # 流式输出延迟（秒）
 STREAM_DELAY = 0.01
 
+# 流式输出时前端最短重绘间隔（秒），避免每个 token 都重绘整张卡片
+STREAM_RENDER_INTERVAL = 0.1
+
+# 边生成边播放语音时，相邻两段之间多留的间隔（秒），弥补时长估计与浏览器开始播放之间的误差
+TTS_SEGMENT_GAP = 0.15
+
+# ==================== 面试评价报告 ====================
+# 逐轮评分：每轮结束后在后台给候选人的回答打分（各维度 0~10 分 + 简短评语），结果按轮缓存；
+# 生成报告时只需把逐轮评分汇总成一份报告，耗时基本不随面试长度增长。关闭后回退为整段对话一次性评价
+REPORT_INCREMENTAL_ENABLED = os.getenv("REPORT_INCREMENTAL_ENABLED", "1") != "0"
+# 逐轮评分使用的模型、输出 token 上限、后台并发数
+REPORT_TURN_EVAL_MODEL = "qwen-plus"
+REPORT_TURN_EVAL_MAX_TOKENS = 300
+REPORT_TURN_EVAL_WORKERS = 4
+# 汇总报告使用的模型（不开思考模式）
+REPORT_AGGREGATE_MODEL = "qwen-max"
+# 生成报告时等待尚未完成的逐轮评分的最长时间（秒），超时的轮次按未评分处理
+REPORT_EVAL_WAIT_TIMEOUT = 30.0
+# 批量报告（scripts/batch_report.py）：并发数、每秒发起的 LLM 请求上限、单个文件失败后的重试次数
+BATCH_REPORT_WORKERS = 4
+BATCH_REPORT_RATE = 2.0
+BATCH_REPORT_MAX_RETRIES = 2
+
+# ==================== 多会话面试服务 ====================
+# api_server.py 的监听地址
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+# 同时存在的会话数上限；会话空闲超过该秒数后回收
+SERVICE_MAX_SESSIONS = 200
+SERVICE_SESSION_TTL = 1800
+# 背压：同时进行的轮次上限，超出的轮次排队；排队数或排队时间超限时直接拒绝（503），由客户端稍后重试
+SERVICE_MAX_CONCURRENT_TURNS = 32
+SERVICE_MAX_PENDING_TURNS = 64
+SERVICE_QUEUE_TIMEOUT = 10.0
+# 前端作为瘦客户端连接的面试服务地址，如 http://127.0.0.1:8000；为空时前端在进程内直接调用各模块
+INTERVIEW_SERVICE_URL = os.getenv("INTERVIEW_SERVICE_URL", "")
+
+# ==================== 会话持久化 ====================
+# 每个会话一个只追加的 JSONL 日志（对话、检索记录、报告），刷新页面或重启后按会话 ID 恢复
+SESSION_STORE_ENABLED = os.getenv("SESSION_STORE_ENABLED", "1") != "0"
+SESSION_STORE_DIR = Path(os.getenv("SESSION_STORE_DIR", str(OUTPUT_DIR / "sessions")))
+# 批量刷盘：后台每隔该秒数 fsync 一次，未刷盘记录达到该条数时提前刷盘
+SESSION_FSYNC_INTERVAL = 1.0
+SESSION_FSYNC_BATCH = 32
+# 被覆盖的记录（旧设置、旧报告）超过该字节数且占文件该比例时压缩日志
+SESSION_COMPACT_MIN_BYTES = 64 * 1024
+SESSION_COMPACT_RATIO = 0.5
+# 超过该秒数没有写入的会话日志由刷盘线程关闭文件句柄（浏览器关掉页面后不会有任何通知），再写入时自动重新打开
+SESSION_IDLE_CLOSE = 300.0
+
+# ==================== 耗时追踪 ====================
+# 记录 ASR、检索、LLM 首 token / 输出速率、TTS 等各阶段耗时，进程内统计 p50/p95/p99
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+# 每个结束的 span 追加一行 JSON 到该文件；默认不写，需要时设置环境变量，如 output/traces.jsonl
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+# 每个指标保留的最近样本数（分位数按这个窗口计算）
+TRACE_MAX_SAMPLES = 2048
+# Prometheus 文本格式的 /metrics 端口；0 表示不启动
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
 # ==================== 初始化目录 ====================
 def init_directories():
     """创建必要的目录结构"""
@@ -61,7 +197,9 @@ def init_directories():
         OUTPUT_DIR,
         REPORTS_DIR,
         VIDEOS_DIR,
-        TEMP_DIR
+        TEMP_DIR,
+        CACHE_DIR,
+        SESSION_STORE_DIR,
     ]
     
     for directory in directories:
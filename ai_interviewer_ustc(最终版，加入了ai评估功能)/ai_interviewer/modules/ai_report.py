@@ -4,23 +4,24 @@ AI 面试报告生成模块
 使用阿里云 DashScope API 调用 Qwen-max (思考模式) 对面试对话进行评价。
 """
 
-from typing import List, Dict, Optional
-from openai import OpenAI
-
-from config import DASHSCOPE_API_KEY, LLM_BASE_URL
-
-# ==================== 客户端初始化 ====================
-client = OpenAI(
-    api_key=DASHSCOPE_API_KEY,
-    base_url=LLM_BASE_URL,  # https://dashscope.aliyuncs.com/compatible-mode/v1
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import DASHSCOPE_API_KEY, REPORT_AGGREGATE_MODEL
+from modules.llm_client import create_chat_completion
+from modules.llm_stream import (
+    DELTA,
+    ERROR,
+    StreamEvent,
+    accumulate_stream_text,
+    event_tokens,
+    iter_completion_events,
 )
+from modules.tracing import traced
+from modules.turn_evaluator import REPORT_DIMENSIONS, TurnEvaluation, aggregate_scores
 
 # ==================== 评价用系统提示词 ====================
-REPORT_SYSTEM_PROMPT = """你是一位资深的技术面试评审专家。你的任务是根据一段完整的面试对话记录，对被面试者的表现进行全面、客观、专业的评价。
-
-请从以下维度进行评价，并给出总体评分（满分100分）：
-
-## 评价维度
+# 评价维度与输出格式，整段评价与逐轮汇总共用
+_REPORT_CRITERIA = """## 评价维度
 
 1. **技术能力**（权重 30%）
    - 对技术问题的理解深度
@@ -85,25 +86,35 @@ REPORT_SYSTEM_PROMPT = """你是一位资深的技术面试评审专家。你的
 
 请确保评价客观、公正，既要肯定优点也要指出不足，给出有建设性的反馈。"""
 
+REPORT_SYSTEM_PROMPT = """你是一位资深的技术面试评审专家。你的任务是根据一段完整的面试对话记录，对被面试者的表现进行全面、客观、专业的评价。
 
-def _format_history_for_report(history: List[Dict[str, str]]) -> str:
-    """
-    将对话历史格式化为面试对话记录文本，供评价模型阅读。
+请从以下维度进行评价，并给出总体评分（满分100分）：
 
-    参数:
-        history: 对话历史列表，每个元素为 {"role": "user"|"assistant", "content": "..."}
+""" + _REPORT_CRITERIA
 
-    返回:
-        格式化后的对话记录字符串
-    """
-    if not history:
-        return "（无对话记录）"
+AGGREGATE_SYSTEM_PROMPT = """你是一位资深的技术面试评审专家。面试过程中已经对候选人的每一轮回答做过评分（各维度 0~10 分）并记录了要点，
+同时按权重换算出了各维度与总体的参考分。你的任务是把这些逐轮评价汇总成一份完整的面试评价报告：
+- 各维度得分与总体评分以参考分为基准，可结合整体表现在 ±5 分内调整
+- 评价内容要引用具体轮次的表现，不要编造逐轮评价中没有的内容
 
+请从以下维度进行评价，并给出总体评分（满分100分）：
+
+""" + _REPORT_CRITERIA
+
+
+def _format_history_with_counts(history: Iterable[Dict[str, str]]) -> Tuple[str, int, int]:
+    """单次遍历完成格式化与计数，history 可以是列表，也可以是逐条读取磁盘记录的迭代器。"""
     lines = []
     turn = 0
+    user_turns = 0
+    assistant_turns = 0
     for msg in history:
         role = msg.get("role", "")
         content = msg.get("content", "").strip()
+        if role == "user":
+            user_turns += 1
+        elif role == "assistant":
+            assistant_turns += 1
         if not content:
             continue
         if role == "user":
@@ -114,11 +125,52 @@ def _format_history_for_report(history: List[Dict[str, str]]) -> str:
             lines.append(f"面试官：{content}")
         lines.append("")  # 空行分隔
 
-    return "\n".join(lines)
+    return "\n".join(lines), user_turns, assistant_turns
 
 
+def _format_history_for_report(history: Iterable[Dict[str, str]]) -> str:
+    """
+    将对话历史格式化为面试对话记录文本，供评价模型阅读。
+
+    参数:
+        history: 对话历史列表（或迭代器），每个元素为 {"role": "user"|"assistant", "content": "..."}
+
+    返回:
+        格式化后的对话记录字符串
+    """
+    formatted, user_turns, assistant_turns = _format_history_with_counts(history)
+    if not user_turns and not assistant_turns:
+        return "（无对话记录）"
+    return formatted
+
+
+def _build_report_messages(history: Iterable[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+    """构造评价请求的消息列表：系统提示词 + 整段面试对话；没有任何对话时返回 None。"""
+    # 格式化对话记录并统计基本信息
+    formatted_history, user_turns, assistant_turns = _format_history_with_counts(history)
+    if not user_turns and not assistant_turns:
+        return None
+
+    # 构造用户消息：把整段面试对话交给评价模型
+    user_message = (
+        f"以下是一段完整的技术面试对话记录，共 {user_turns} 轮候选人回答、"
+        f"{assistant_turns} 轮面试官提问。\n"
+        f"请根据对话内容对被面试者的表现进行全面评价。\n\n"
+        f"--- 面试对话记录 ---\n\n"
+        f"{formatted_history}\n"
+        f"--- 对话记录结束 ---\n\n"
+        f"请按要求的格式输出评价报告。"
+    )
+
+    return [
+        {"role": "system", "content": REPORT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+@traced("report.generate")
 def ai_report(
-    history: List[Dict[str, str]],
+    history: Iterable[Dict[str, str]],
     model: str = "qwen-max",
     enable_thinking: bool = True,
 ) -> str:
@@ -126,7 +178,7 @@ def ai_report(
     根据完整对话历史，调用阿里云 Qwen-max (思考模式) 生成面试评价报告。
 
     参数:
-        history:  完整的面试对话历史列表
+        history:  完整的面试对话历史列表（也可以是迭代器，如 SessionStore.iter_history 逐条读取磁盘记录）
                   格式: [{"role": "user"|"assistant", "content": "..."}, ...]
                   其中 role="user" 是被面试者的回答，role="assistant" 是面试官的提问/追问。
         model:    使用的模型名称，默认 "qwen-max"（思考模式下实际会走 qwen-max 的深度推理）
@@ -149,32 +201,10 @@ def ai_report(
         >>> report = ai_report(history)
         >>> print(report)
     """
-    if not history:
+    messages = _build_report_messages(history)
+    if messages is None:
         return "⚠️ 没有对话记录，无法生成面试评价报告。"
 
-    # 格式化对话记录
-    formatted_history = _format_history_for_report(history)
-
-    # 统计基本信息
-    user_turns = sum(1 for msg in history if msg.get("role") == "user")
-    assistant_turns = sum(1 for msg in history if msg.get("role") == "assistant")
-
-    # 构造用户消息：把整段面试对话交给评价模型
-    user_message = (
-        f"以下是一段完整的技术面试对话记录，共 {user_turns} 轮候选人回答、"
-        f"{assistant_turns} 轮面试官提问。\n"
-        f"请根据对话内容对被面试者的表现进行全面评价。\n\n"
-        f"--- 面试对话记录 ---\n\n"
-        f"{formatted_history}\n"
-        f"--- 对话记录结束 ---\n\n"
-        f"请按要求的格式输出评价报告。"
-    )
-
-    messages = [
-        {"role": "system", "content": REPORT_SYSTEM_PROMPT},
-        {"role": "user", "content": user_message},
-    ]
-
     try:
         # 构造请求参数
         request_params = {
@@ -187,7 +217,7 @@ def ai_report(
         if enable_thinking:
             request_params["extra_body"] = {"enable_thinking": True}
 
-        completion = client.chat.completions.create(**request_params)
+        completion = create_chat_completion(api_key=DASHSCOPE_API_KEY, **request_params)
 
         # 提取回复内容
         if completion.choices and completion.choices[0].message:
@@ -199,8 +229,46 @@ def ai_report(
         raise RuntimeError(f"面试评价报告生成失败: {str(e)}") from e
 
 
+@traced("report.stream", tokens=event_tokens)
+def ai_report_stream_events(
+    history: Iterable[Dict[str, str]],
+    model: str = "qwen-max",
+    enable_thinking: bool = True,
+):
+    """
+    事件模式：流式生成面试评价报告，逐个 yield StreamEvent（增量文本 / 用量 / 结束原因 / 错误）。
+    长报告下消费方只处理增量，不必每个 token 都拿到一份完整副本。
+
+    使用示例:
+        >>> from modules.llm_stream import join_stream_text
+        >>> report = join_stream_text(ai_report_stream_events(history))
+    """
+    messages = _build_report_messages(history)
+    if messages is None:
+        yield StreamEvent(DELTA, text="⚠️ 没有对话记录，无法生成面试评价报告。")
+        return
+
+    try:
+        request_params = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        if enable_thinking:
+            request_params["extra_body"] = {"enable_thinking": True}
+
+        completion = create_chat_completion(api_key=DASHSCOPE_API_KEY, **request_params)
+        yield from iter_completion_events(completion)
+
+    except Exception as e:
+        yield StreamEvent(ERROR, text=str(e))
+
+
+@traced("report.stream_text")
 def ai_report_stream(
-    history: List[Dict[str, str]],
+    history: Iterable[Dict[str, str]],
     model: str = "qwen-max",
     enable_thinking: bool = True,
 ):
@@ -221,51 +289,85 @@ def ai_report_stream(
         >>> for partial_report in ai_report_stream(st.session_state.history):
         ...     placeholder.markdown(partial_report)
     """
-    if not history:
-        yield "⚠️ 没有对话记录，无法生成面试评价报告。"
-        return
+    yield from accumulate_stream_text(
+        ai_report_stream_events(history, model=model, enable_thinking=enable_thinking),
+        error_template="⚠️ 面试评价报告生成失败: {}",
+    )
 
-    # 格式化对话记录
-    formatted_history = _format_history_for_report(history)
 
-    user_turns = sum(1 for msg in history if msg.get("role") == "user")
-    assistant_turns = sum(1 for msg in history if msg.get("role") == "assistant")
+def _format_evaluations(evaluations: List[TurnEvaluation]) -> str:
+    """逐轮评价压缩成每轮一行，汇总请求的长度只随轮数线性增长且每轮很短。"""
+    short_names = {name: name[:2] for name, _ in REPORT_DIMENSIONS}
+    lines = []
+    for evaluation in evaluations:
+        question = evaluation.question[:40] + ("…" if len(evaluation.question) > 40 else "")
+        if evaluation.error:
+            lines.append(f"第 {evaluation.turn} 轮｜问：{question or '（开场）'}｜未评分")
+            continue
+        scores = " ".join(
+            f"{short_names[name]}{'-' if value is None else f'{value:g}'}"
+            for name, value in evaluation.scores.items()
+        )
+        parts = [f"第 {evaluation.turn} 轮", f"问：{question or '（开场）'}", scores, f"要点：{evaluation.notes}"]
+        if evaluation.highlight:
+            parts.append(f"亮点：{evaluation.highlight}")
+        if evaluation.weakness:
+            parts.append(f"不足：{evaluation.weakness}")
+        lines.append("｜".join(parts))
+    return "\n".join(lines)
+
 
+def _build_aggregate_messages(evaluations: List[TurnEvaluation]) -> List[Dict[str, str]]:
+    """构造汇总请求：系统提示词 + 逐轮评价 + 按权重换算的参考分。"""
+    summary = aggregate_scores(evaluations)
+    reference = "，".join(
+        f"{name} {summary['dimensions'][name]:g} / {weight}" for name, weight in REPORT_DIMENSIONS
+    )
     user_message = (
-        f"以下是一段完整的技术面试对话记录，共 {user_turns} 轮候选人回答、"
-        f"{assistant_turns} 轮面试官提问。\n"
-        f"请根据对话内容对被面试者的表现进行全面评价。\n\n"
-        f"--- 面试对话记录 ---\n\n"
-        f"{formatted_history}\n"
-        f"--- 对话记录结束 ---\n\n"
+        f"面试共 {len(evaluations)} 轮候选人回答，其中 {summary['scored_turns']} 轮已评分。\n"
+        f"参考分：总体 {summary['overall']} / 100；{reference}\n"
+        f"分数缩写：技术=技术能力，问题=问题解决能力，沟通=沟通表达能力，学习=学习潜力与思维深度，综合=综合素养，"
+        f"\"-\" 表示该轮未体现。\n\n"
+        f"--- 逐轮评价 ---\n\n"
+        f"{_format_evaluations(evaluations)}\n"
+        f"--- 逐轮评价结束 ---\n\n"
         f"请按要求的格式输出评价报告。"
     )
-
-    messages = [
-        {"role": "system", "content": REPORT_SYSTEM_PROMPT},
+    return [
+        {"role": "system", "content": AGGREGATE_SYSTEM_PROMPT},
         {"role": "user", "content": user_message},
     ]
 
-    try:
-        request_params = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-        }
 
-        if enable_thinking:
-            request_params["extra_body"] = {"enable_thinking": True}
-            # 流式 + 思考模式下，需要设置 stream_options 以获取增量输出
-            request_params["stream_options"] = {"include_usage": True}
+@traced("report.aggregate", tokens=event_tokens)
+def ai_report_from_evaluations_stream_events(
+    evaluations: List[TurnEvaluation],
+    model: str = REPORT_AGGREGATE_MODEL,
+):
+    """
+    事件模式：把逐轮评分（turn_evaluator.IncrementalEvaluator.results 的返回值）汇总成面试评价报告。
+    输入是每轮一行的紧凑评价而不是整段对话，也不开思考模式，耗时基本不随面试长度增长。
 
-        completion = client.chat.completions.create(**request_params)
+    使用示例:
+        >>> evaluations = evaluator.results(history)
+        >>> report = join_stream_text(ai_report_from_evaluations_stream_events(evaluations))
+    """
+    if not evaluations:
+        yield StreamEvent(DELTA, text="⚠️ 没有对话记录，无法生成面试评价报告。")
+        return
+    if not any(evaluation.error is None for evaluation in evaluations):
+        yield StreamEvent(ERROR, text="逐轮评分全部失败，请稍后重试")
+        return
 
-        full_response = ""
-        for chunk in completion:
-            if chunk.choices and chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                full_response += content
-                yield full_response
+    try:
+        completion = create_chat_completion(
+            api_key=DASHSCOPE_API_KEY,
+            model=model,
+            messages=_build_aggregate_messages(evaluations),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        yield from iter_completion_events(completion)
 
     except Exception as e:
-        yield f"⚠️ 面试评价报告生成失败: {str(e)}"
+        yield StreamEvent(ERROR, text=str(e))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+后台事件循环
+在一个常驻的守护线程里跑 asyncio 事件循环，同步代码（例如 Streamlit 脚本的每次 rerun）
+把协程提交进来执行。事件循环不会像 asyncio.run 那样每次销毁，
+绑定在循环上的长连接（aiohttp 会话等）得以跨请求复用。
+"""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional
+
+
+class BackgroundEventLoop:
+    def __init__(self, name: str = "background-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        提交协程，立即返回 concurrent.futures.Future，可在任意线程等待或取消。
+        协程在提交方 contextvars 的副本中运行（如追踪的当前轮次），与在调用线程里直接 await 一致。
+        """
+        return asyncio.run_coroutine_threadsafe(_run_in_context(coro, contextvars.copy_context()), self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """提交协程并阻塞等待结果；超时会取消协程并抛出 TimeoutError。"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        """先释放登记在本循环上的客户端等资源，再停止循环线程。"""
+        if self.loop.is_running():
+            try:
+                self.run(close_loop_resources(), timeout=5)
+            except Exception as e:
+                print(f"⚠️ 释放后台事件循环资源失败: {e!r}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+async def _run_in_context(coro: Coroutine, context: contextvars.Context) -> Any:
+    # run_coroutine_threadsafe 创建的任务继承的是后台线程的上下文；在提交方上下文里另建任务，取消会一并传递
+    return await context.run(asyncio.ensure_future, coro)
+
+
+# 绑定在某个事件循环上的资源（HTTP 客户端、信号量等）登记的清理协程。
+# 这些对象会反过来引用事件循环，弱引用永远不会失效，只能在循环关闭前显式调用 close_loop_resources
+_loop_cleanups: Dict[asyncio.AbstractEventLoop, List[Callable[[], Awaitable[Any]]]] = {}
+_cleanup_lock = threading.Lock()
+
+
+def register_loop_cleanup(cleanup: Callable[[], Awaitable[Any]]) -> None:
+    """为当前事件循环登记一个清理协程函数（需在协程中调用）。"""
+    loop = asyncio.get_running_loop()
+    with _cleanup_lock:
+        _loop_cleanups.setdefault(loop, []).append(cleanup)
+
+
+async def close_loop_resources() -> None:
+    """执行当前事件循环登记的全部清理（后登记的先执行），之后本模块不再持有该循环。"""
+    loop = asyncio.get_running_loop()
+    with _cleanup_lock:
+        cleanups = _loop_cleanups.pop(loop, [])
+    for cleanup in reversed(cleanups):
+        try:
+            await cleanup()
+        except Exception as e:
+            print(f"⚠️ 释放事件循环资源失败: {e!r}")
+
+
+_default_loop: Optional[BackgroundEventLoop] = None
+_default_lock = threading.Lock()
+
+
+def get_background_loop() -> BackgroundEventLoop:
+    """进程内共享的后台事件循环（首次调用时启动）。"""
+    global _default_loop
+    with _default_lock:
+        if _default_loop is None:
+            _default_loop = BackgroundEventLoop()
+        return _default_loop
+
+
+def run_in_background(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """在共享后台事件循环中运行协程并等待结果。"""
+    return get_background_loop().run(coro, timeout)
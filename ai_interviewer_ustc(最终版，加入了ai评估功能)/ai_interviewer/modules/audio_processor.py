@@ -1,15 +1,41 @@
 # 这里处理 TTS 和 ASR 的 API 调用
 # modules/audio_processor.py
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+import asyncio
 import os
+import random
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from modules.async_runtime import register_loop_cleanup
+from modules.tracing import annotate, submit_in_context, traced
+from modules.tts_cache import get_tts_cache
+
 try:
-    from config import TTS_MODEL, TTS_VOICE
+    from config import (
+        ASR_KEEPALIVE_TIMEOUT,
+        ASR_MAX_CONNECTIONS,
+        ASR_MODEL,
+        ASR_TIMEOUT,
+        STEPFUN_BASE_URL,
+        TTS_CACHE_DIR,
+        TTS_CACHE_MAX_BYTES,
+        TTS_MODEL,
+        TTS_VOICE,
+        TTS_VOLUME,
+    )
 except ImportError:
     TTS_MODEL = "step-tts-mini"
     TTS_VOICE = "cixingnansheng"
+    TTS_VOLUME = 1.0
+    TTS_CACHE_DIR = None  # 没有 config 时不启用音频缓存
+    TTS_CACHE_MAX_BYTES = 0
+    ASR_MODEL = "step-asr"
+    STEPFUN_BASE_URL = "https://api.stepfun.com/v1"
+    ASR_MAX_CONNECTIONS = 8
+    ASR_KEEPALIVE_TIMEOUT = 120
+    ASR_TIMEOUT = 30
 
 # 永远不要在代码里写死绝对路径，尤其是带中文的(血的教训)
 # 这里保留为空或默认值即可，实际由 app 控制
@@ -17,44 +43,181 @@ speech_file_path = "temp_audio_test.mp3"
 
 
 class TTS_no_stream:
-    def __init__(self, api_key, model=None, voice=None):
+    def __init__(self, api_key, model=None, voice=None, volume=None, use_cache=True):
+        """
+        use_cache: 是否使用磁盘音频缓存（相同文本 + 模型 + 音色 + 音量直接复用已合成的音频）
+        """
         self.client = OpenAI(
             api_key=api_key,
-            base_url="https://api.stepfun.com/v1"
+            base_url=STEPFUN_BASE_URL
         )
         self.model = model or TTS_MODEL
         self.default_voice = voice or TTS_VOICE
+        self.volume = TTS_VOLUME if volume is None else volume
+        self.cache = (
+            get_tts_cache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+            if use_cache and TTS_CACHE_DIR
+            else None
+        )
 
+    @traced("tts.to_speech")
     def to_speech(self, text, output_path):
         """
         output_path: 必须是完整的文件路径 (str 或 Path 对象)
         返回 True 表示成功，False 表示失败。
         """
+        audio = self.synthesize(text)
+        if audio is None:
+            return False
         try:
             save_path = Path(output_path).resolve()
+            with open(save_path, "wb") as f:
+                f.write(audio)
+            return True
+        except OSError as e:
+            print(f"❌ TTS 音频保存失败: {e}")
+            return False
 
+    @traced("tts.synthesize")
+    def synthesize(self, text):
+        """
+        合成一段文本，返回 mp3 字节；失败返回 None。
+        命中音频缓存时不发起网络请求。
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(text, self.model, self.default_voice, self.volume)
+            cached = self.cache.get(cache_key)
+            if cached:
+                annotate(cache="hit")
+                return cached
+        try:
             response = self.client.audio.speech.create(
                 model=self.model,
                 voice=self.default_voice,
                 input=text,
-                extra_body={"volume": 1.0}
+                extra_body={"volume": self.volume}
             )
-            with open(save_path, "wb") as f:
-                f.write(response.content)
-            return True
+            if cache_key is not None:
+                self.cache.put(cache_key, response.content)
+            return response.content
 
         except Exception as e:
-            err_type = type(e).__name__
-            msg = str(e)
-            if "401" in msg or "authentication" in msg.lower() or "api_key" in msg.lower():
-                print(f"❌ TTS 鉴权失败（请检查 STEPFUN_API_KEY）: {msg}")
-            elif "429" in msg or "rate" in msg.lower():
-                print(f"❌ TTS 请求限流: {msg}")
-            elif "500" in msg or "502" in msg or "503" in msg:
-                print(f"❌ TTS 服务端错误: {err_type} - {msg}")
-            else:
-                print(f"❌ TTS 生成错误: {err_type} - {msg}")
-            return False
+            _report_tts_error(e)
+            return None
+
+
+def _classify_tts_error(e):
+    """把 TTS 异常归类为 "auth" / "rate_limit" / "server" / "other"。"""
+    msg = str(e)
+    if "401" in msg or "authentication" in msg.lower() or "api_key" in msg.lower():
+        return "auth"
+    elif "429" in msg or "rate" in msg.lower():
+        return "rate_limit"
+    elif "500" in msg or "502" in msg or "503" in msg:
+        return "server"
+    return "other"
+
+
+def _report_tts_error(e):
+    err_type = type(e).__name__
+    msg = str(e)
+    kind = _classify_tts_error(e)
+    if kind == "auth":
+        print(f"❌ TTS 鉴权失败（请检查 STEPFUN_API_KEY）: {msg}")
+    elif kind == "rate_limit":
+        print(f"❌ TTS 请求限流: {msg}")
+    elif kind == "server":
+        print(f"❌ TTS 服务端错误: {err_type} - {msg}")
+    else:
+        print(f"❌ TTS 生成错误: {err_type} - {msg}")
+
+
+class TTS_async:
+    """
+    异步 TTS：与 TTS_no_stream 参数一致，直接返回音频字节而不是写文件。
+    synthesize_many 在并发上限内同时合成多句，按输入顺序返回，
+    多句回复的总耗时接近最慢的那一句而不是各句之和。遇到限流（429）按抖动退避重试。
+    """
+
+    def __init__(self, api_key, model=None, voice=None, volume=None, use_cache=True,
+                 max_concurrency=4, max_retries=3, retry_base_delay=0.5):
+        self.api_key = api_key
+        self.model = model or TTS_MODEL
+        self.default_voice = voice or TTS_VOICE
+        self.volume = TTS_VOLUME if volume is None else volume
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.cache = (
+            get_tts_cache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+            if use_cache and TTS_CACHE_DIR
+            else None
+        )
+        # AsyncOpenAI 内部的连接池绑定事件循环，每个循环各建一个；循环关闭前由 close_loop_resources 关闭
+        self._clients = {}
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=STEPFUN_BASE_URL,
+            )
+            register_loop_cleanup(lambda: self._close_client(loop))
+        return client
+
+    async def _close_client(self, loop):
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+    @traced("tts.synthesize")
+    async def synthesize(self, text):
+        """合成一段文本，返回 mp3 字节；失败返回 None。命中音频缓存时不发起网络请求。"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(text, self.model, self.default_voice, self.volume)
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached:
+                annotate(cache="hit")
+                return cached
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._get_client().audio.speech.create(
+                    model=self.model,
+                    voice=self.default_voice,
+                    input=text,
+                    extra_body={"volume": self.volume}
+                )
+                break
+            except Exception as e:
+                if _classify_tts_error(e) == "rate_limit" and attempt < self.max_retries:
+                    delay = self.retry_base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    attempt += 1
+                    print(f"⚠️ TTS 请求限流，{delay:.1f}s 后第 {attempt} 次重试")
+                    await asyncio.sleep(delay)
+                    continue
+                _report_tts_error(e)
+                return None
+
+        audio = response.content
+        if cache_key is not None:
+            await asyncio.to_thread(self.cache.put, cache_key, audio)
+        return audio
+
+    async def synthesize_many(self, sentences, max_concurrency=None):
+        """并发合成多句，返回与输入等长、顺序一致的列表，失败的句子对应 None。"""
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def _one(sentence):
+            async with semaphore:
+                return await self.synthesize(sentence)
+
+        return await asyncio.gather(*(_one(sentence) for sentence in sentences))
 
 # 下面的 chunking_tool 保持不变...
 def chunking_tool(text):
@@ -86,56 +249,331 @@ def chunking_tool(text):
     return combined_chunks
 
 
+class IncrementalSentenceSegmenter:
+    """
+    增量断句器：逐段喂入 LLM 的增量文本（delta），每个完整句子只输出一次。
+    内部只保留尚未成句的尾巴，并记住上次扫描到的位置，整段回复的断句总开销是线性的，
+    不会像对累积文本反复调用 chunking_tool 那样随长度平方增长。
 
+    规则：
+    - 中文 。！？ 与英文 ?! 以及换行都是句末；句末标点后紧跟的标点与右引号/右括号并入本句
+    - 英文句点只有在后面是空白、非字母数字字符或文本结束时才断句，
+      "3.14" 这类小数、"node.js" 这类词内句点、"e.g." 这类缩写都不会被切开
+    - "1. 第一项" 这类列表序号、"No. 5" 这类编号缩写后的句点也不断句
+    - 句末标点出现在当前文本末尾时先不断句，等下一段文本确认后面跟的是什么
+    """
 
+    TERMINATORS = "。！？!?\n"
+    CLOSERS = "”’」』）)】\"'"
+    ABBREVIATIONS = {"e.g", "i.e", "etc", "vs", "mr", "mrs", "ms", "dr", "prof", "fig", "approx", "cf"}
+    # 只有后面跟着数字时才算缩写的词："No. 5" 不断句，"I said no. Then" 照常断句
+    NUMBER_ABBREVIATIONS = {"no"}
+    # 列表序号前允许出现的字符（序号前是行首、空白或这些标点时才视为 "1." 这样的序号）
+    LIST_MARKER_PRECEDERS = "：:，,；;、（(【["
 
+    def __init__(self):
+        self._buffer = ""
+        self._scan_pos = 0
+
+    def feed(self, delta):
+        """喂入一段增量文本，返回新完成的句子列表（可能为空）。"""
+        if not delta:
+            return []
+        self._buffer += delta
+        return self._drain(final=False)
+
+    def flush(self):
+        """文本流结束：返回剩余的所有句子（包括没有结尾标点的最后一段），并清空状态。"""
+        sentences = self._drain(final=True)
+        tail = self._buffer.strip()
+        if tail:
+            sentences.append(tail)
+        self._buffer = ""
+        self._scan_pos = 0
+        return sentences
+
+    def _is_sentence_period(self, buf, dot, run_end, final):
+        # buf[dot] == "."，buf[dot:run_end] 为句末标点串；返回 None 表示还要等后面的文本才能判断
+        nxt = buf[run_end] if run_end < len(buf) else ""
+        if nxt and nxt.isascii() and nxt.isalnum():
+            return False  # 小数、版本号、域名、缩写中间的点
+        word_start = dot
+        while word_start > 0 and (buf[word_start - 1].isascii() and buf[word_start - 1].isalpha() or buf[word_start - 1] == "."):
+            word_start -= 1
+        word = buf[word_start:dot].lower()
+        if word in self.ABBREVIATIONS:
+            return False
+        if word in self.NUMBER_ABBREVIATIONS and run_end == dot + 1:
+            k = run_end
+            while k < len(buf) and buf[k] in " \t":
+                k += 1
+            if k == len(buf):
+                return True if final else None
+            return not buf[k].isdigit()
+        digit_start = dot
+        while digit_start > 0 and buf[digit_start - 1].isascii() and buf[digit_start - 1].isdigit():
+            digit_start -= 1
+        if 0 < dot - digit_start <= 2 and run_end == dot + 1:
+            before = buf[digit_start - 1] if digit_start > 0 else ""
+            if not before or before.isspace() or before in self.LIST_MARKER_PRECEDERS:
+                return False  # "1. 第一项" 这样的列表序号
+        return True
+
+    def _drain(self, final):
+        buf = self._buffer
+        end = len(buf)
+        sentences = []
+        start = 0
+        i = self._scan_pos
+        while i < end:
+            ch = buf[i]
+            if ch not in self.TERMINATORS and ch != ".":
+                i += 1
+                continue
+            j = i + 1
+            while j < end and (buf[j] in self.TERMINATORS or buf[j] == "." or buf[j] in self.CLOSERS):
+                j += 1
+            if j == end and not final:
+                break  # 句末标点后面还可能跟着引号、数字或缩写的后半部分，等下一段
+            if ch == ".":
+                is_end = self._is_sentence_period(buf, i, j, final)
+                if is_end is None:
+                    break
+                if not is_end:
+                    i = j
+                    continue
+            sentence = buf[start:j].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = i = j
+        self._buffer = buf[start:]
+        self._scan_pos = i - start
+        return sentences
+
+
+# MPEG 版本 -> 各层的比特率表（kbps）与采样率表；索引来自帧头
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def mp3_duration(data):
+    """
+    按 MPEG Layer III 帧头累加出 mp3 的播放时长（秒），CBR/VBR 都适用；解析不了的数据返回 0。
+    流式播放时用它估计上一段什么时候播完，好在合适的时机接上下一段。
+    """
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        pos = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    seconds = 0.0
+    while pos + 4 <= len(data):
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        version = (b1 >> 3) & 0x03
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0 or version == 1 or (b1 >> 1) & 0x03 != 1:
+            break  # 不是 Layer III 帧头（或是尾部的 ID3v1 标签）
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 0x03
+        if bitrate_index in (0, 15) or rate_index == 3:
+            break
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+        samples = 1152 if version == 3 else 576
+        pos += samples // 8 * bitrate // sample_rate + ((b2 >> 1) & 0x01)
+        seconds += samples / sample_rate
+    return seconds
+
+
+class StreamingSpeechPipeline:
+    """
+    边生成边合成：IncrementalSentenceSegmenter 每切出一个完整句子就提交给 TTS 线程池并发合成，
+    音频片段按句子顺序取回（播放或拼接），首段语音只需等第一句话生成完。
+
+    用法：
+        speech = StreamingSpeechPipeline(TTS_no_stream(api_key))
+        for partial in llm_stream_chat(...):
+            speech.feed_text(partial)      # partial 为累积文本
+        speech.finish(full_response)
+        audio = speech.collect()           # 按顺序拼接的 mp3 字节
+    """
+
+    def __init__(self, tts, max_workers=3, on_segment=None):
+        """
+        tts:         提供 synthesize(text) -> Optional[bytes] 的对象，通常是 TTS_no_stream
+        max_workers: 同时进行的 TTS 请求数
+        on_segment:  可选回调 on_segment(index, sentence, audio_bytes)，按句子顺序调用
+        """
+        self.tts = tts
+        self.on_segment = on_segment
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._segmenter = IncrementalSentenceSegmenter()
+        self._fed_chars = 0
+        self._sentences = []
+        self._futures = []
+        self._delivered = 0
+        self.failed = 0
+
+    def _submit(self, sentence):
+        self._sentences.append(sentence)
+        self._futures.append(submit_in_context(self._executor, self.tts.synthesize, sentence))
+
+    def feed_delta(self, delta):
+        """传入 LLM 新生成的增量文本，提交其中新完成的句子。"""
+        self._fed_chars += len(delta)
+        for sentence in self._segmenter.feed(delta):
+            self._submit(sentence)
+
+    def feed_text(self, full_text):
+        """传入当前累积的完整文本（llm_stream_chat 的输出），只处理新增部分。"""
+        self.feed_delta(full_text[self._fed_chars:])
+
+    def finish(self, full_text=None):
+        """LLM 生成结束：把剩下没有结尾标点的最后一段也提交。"""
+        if full_text is not None:
+            self.feed_text(full_text)
+        for sentence in self._segmenter.flush():
+            self._submit(sentence)
+
+    def iter_segments(self, block=True):
+        """
+        按句子顺序产出 (index, sentence, audio_bytes)，合成失败的句子跳过。
+        block=False 时只产出已经合成好的前缀，遇到还在合成的句子就返回，可在 LLM 生成过程中反复调用。
+        """
+        while self._delivered < len(self._futures):
+            index = self._delivered
+            if not block and not self._futures[index].done():
+                return
+            audio = self._futures[index].result()
+            self._delivered += 1
+            if not audio:
+                self.failed += 1
+                continue
+            if self.on_segment:
+                self.on_segment(index, self._sentences[index], audio)
+            yield index, self._sentences[index], audio
+
+    def collect(self):
+        """等待全部句子合成完毕，返回按顺序拼接的 mp3 字节（mp3 帧可直接拼接）。"""
+        audio = b"".join(segment for _, _, segment in self.iter_segments())
+        self.close()
+        return audio
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 
 # audio_processor.py - 修复版本
 import asyncio
 import aiohttp
-from typing import Optional
+import io
+import wave
+from typing import Dict, Optional
 import tempfile
 import os
 
-async def audio_to_text(audio_file_path: str, api_key: str) -> Optional[str]:
-    """异步语音转文本"""
-    try:
-        # 异步读取文件
-        audio_data = await asyncio.to_thread(_read_file, audio_file_path)
-        if not audio_data:
-            return None
-        
-        # 准备请求
+
+class ASRClient:
+    """
+    常驻的 ASR 客户端：复用同一个 aiohttp 会话与连接池，
+    连续几次回答之间不必重新做 TCP + TLS 握手。
+    会话绑定创建它的事件循环，应通过 get_asr_client 在对应循环里获取。
+    """
+
+    def __init__(self, api_key: str, model: str = None, base_url: str = None):
+        self.api_key = api_key
+        self.model = model or ASR_MODEL
+        self.url = f"{(base_url or STEPFUN_BASE_URL).rstrip('/')}/audio/transcriptions"
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=ASR_MAX_CONNECTIONS,
+                keepalive_timeout=ASR_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=aiohttp.ClientTimeout(total=ASR_TIMEOUT),
+            )
+        return self._session
+
+    async def transcribe(self, audio_data: bytes, filename: str = "audio.wav",
+                         content_type: str = "audio/wav", language: str = "zh") -> Optional[str]:
+        """上传音频数据并返回识别文本；失败返回 None。"""
         data = aiohttp.FormData()
-        data.add_field('model', 'step-asr')
-        data.add_field('file', audio_data, 
-                      filename=os.path.basename(audio_file_path),
-                      content_type='audio/wav')
-        data.add_field('language', 'zh')
-        
-        # 异步API请求
-        async with aiohttp.ClientSession() as session:
-            headers = {"Authorization": f"Bearer {api_key}"}
-            
-            async with session.post(
-                "https://api.stepfun.com/v1/audio/transcriptions",
-                headers=headers,
-                data=data,
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get('text', '').strip()
-                else:
-                    print(f"API错误: {response.status}")
-                    return None
-                    
+        data.add_field('model', self.model)
+        data.add_field('file', audio_data,
+                       filename=filename,
+                       content_type=content_type)
+        data.add_field('language', language)
+
+        async with self._get_session().post(self.url, data=data) as response:
+            if response.status == 200:
+                result = await response.json()
+                return result.get('text', '').strip()
+            print(f"API错误: {response.status}")
+            return None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+# 每个事件循环各自持有一组客户端；aiohttp 会话引用着事件循环，由 close_loop_resources 在循环关闭前关闭
+_asr_clients: Dict[asyncio.AbstractEventLoop, dict] = {}
+
+
+def get_asr_client(api_key: str) -> ASRClient:
+    """获取当前事件循环下共享的 ASRClient（需在协程中调用）。"""
+    loop = asyncio.get_running_loop()
+    clients = _asr_clients.get(loop)
+    if clients is None:
+        clients = _asr_clients[loop] = {}
+        register_loop_cleanup(lambda: _close_asr_clients(loop))
+    client = clients.get(api_key)
+    if client is None:
+        client = clients[api_key] = ASRClient(api_key)
+    return client
+
+
+async def _close_asr_clients(loop):
+    for client in _asr_clients.pop(loop, {}).values():
+        await client.close()
+
+
+@traced("asr")
+async def audio_bytes_to_text(audio_data, api_key: str, filename: str = "audio.wav",
+                              content_type: str = "audio/wav") -> Optional[str]:
+    """
+    异步语音转文本（内存版）：直接上传内存中的音频数据，不经过临时文件。
+    audio_data 可以是 bytes / bytearray / memoryview。
+    """
+    if not audio_data:
+        return None
+    annotate(audio_bytes=len(audio_data))
+    try:
+        # 复用常驻会话发送请求
+        return await get_asr_client(api_key).transcribe(
+            audio_data, filename=filename, content_type=content_type
+        )
     except Exception as e:
         print(f"转换错误: {e}")
         return None
 
+
+@traced("asr.file")
+async def audio_to_text(audio_file_path: str, api_key: str) -> Optional[str]:
+    """异步语音转文本（文件版）：读取文件后交给 audio_bytes_to_text"""
+    # 异步读取文件
+    audio_data = await asyncio.to_thread(_read_file, audio_file_path)
+    if not audio_data:
+        return None
+    return await audio_bytes_to_text(
+        audio_data, api_key, filename=os.path.basename(audio_file_path)
+    )
+
 def _read_file(path: str) -> Optional[bytes]:
     """同步读取文件"""
     try:
@@ -219,6 +657,17 @@ async def _async_input(prompt: str = "") -> str:
     return await loop.run_in_executor(None, input, prompt)
 
 
+def pcm_to_wav_bytes(audio_data: bytes, sample_rate: int = 16000) -> bytes:
+    """把 16bit 单声道 PCM 数据封装成内存中的 WAV 字节"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(audio_data)
+    return buffer.getvalue()
+
+
 async def save_audio_simple(audio_data: bytes, sample_rate: int = 16000) -> Optional[str]:
     """简化版音频保存"""
     try:
@@ -262,19 +711,9 @@ async def voice_to_text(api_key: str, sample_rate: int = 16000) -> Optional[str]
         print("录音失败")
         return None
     
-    # 2. 异步保存
-    temp_file = await save_audio_simple(audio_data, sample_rate)
-    if not temp_file:
-        print("保存失败")
-        return None
-    
-    try:
-        # 3. 异步转文本
-        text = await audio_to_text(temp_file, api_key)
-        return text
-        
-    finally:
-        await cleanup_file(temp_file)
+    # 2. 在内存中封装为 WAV，直接上传转文本
+    wav_data = pcm_to_wav_bytes(audio_data, sample_rate)
+    return await audio_bytes_to_text(wav_data, api_key)
 
 
 async def transcribe_file(file_path: str, api_key: str) -> Optional[str]:
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+本地 Embedding 后端与 NumPy 精确检索索引
+HashingEmbeddings：把字/二元组/英文词哈希到固定维度（带符号的 hashing trick），纯 CPU、无需下载模型、不访问网络。
+FlatVectorIndex：所有 chunk 向量存成一个 float32 的 .npy 矩阵（行已 L2 归一化）+ 一份 JSON 元数据，
+查询时以内存映射方式打开矩阵，一次矩阵乘法算出全部余弦相似度，再取 Top-K。
+"""
+
+import json
+import math
+import os
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.lexical_index import match_filter, tokenize
+
+FLAT_INDEX_DIR = "flat_index"
+_VECTORS_FILE = "vectors.npy"
+_META_FILE = "meta.json"
+
+
+class HashingEmbeddings:
+    """
+    与 LangChain Embeddings 接口一致（embed_documents / embed_query），可直接替换 DashScope。
+    dim: 向量维度；维度越高哈希冲突越少，检索时矩阵也越大
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> Counter:
+        text = unicodedata.normalize("NFKC", text or "")
+        tokens = tokenize(text)
+        # 单字特征提高短查询的召回（"栈" 这类一个字的术语没有二元组）
+        tokens.extend(ch for ch in text if "\u4e00" <= ch <= "\u9fff")
+        return Counter(tokens)
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """批量向量化，返回 (len(texts), dim) 的 float32 矩阵，每行已 L2 归一化。"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, tf in self._features(text).items():
+                # Python 内置 hash 每个进程随机加盐，必须用稳定哈希，否则建库与查询的向量对不上
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(tf))
+        return normalize_rows(matrix)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def embed_to_array(embeddings, texts: Sequence[str]) -> np.ndarray:
+    """任意后端的批量向量化结果统一转成归一化的 float32 矩阵。"""
+    if hasattr(embeddings, "embed_array"):
+        return embeddings.embed_array(texts)
+    return normalize_rows(np.asarray(embeddings.embed_documents(list(texts)), dtype=np.float32))
+
+
+class FlatVectorIndex:
+    """
+    vectors:   (N, dim) float32 矩阵，行已归一化；load 时为只读内存映射
+    ids / texts / metadatas: 与矩阵行一一对应
+    info:      建库参数（backend、dim 等），查询前用来校验后端是否一致
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, str]],
+        info: Optional[Dict] = None,
+    ):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.info = info or {}
+        self._mask_lock = threading.Lock()
+        # 过滤条件 -> 满足条件的行号，面试中过滤条件只有寥寥几种
+        self._masks: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0
+
+    def _rows_for(self, search_filter: Optional[Dict]) -> Optional[np.ndarray]:
+        if not search_filter:
+            return None
+        key = json.dumps(search_filter, ensure_ascii=False, sort_keys=True)
+        rows = self._masks.get(key)
+        if rows is None:
+            rows = np.fromiter(
+                (i for i, meta in enumerate(self.metadatas) if match_filter(meta, search_filter)),
+                dtype=np.int64,
+            )
+            with self._mask_lock:
+                self._masks[key] = rows
+        return rows
+
+    def search(
+        self,
+        query_vector: Sequence[float],
+        k: int = 6,
+        search_filter: Optional[Dict] = None,
+    ) -> List[Tuple[str, float, str, Dict[str, str]]]:
+        """返回按余弦相似度降序的 [(id, score, text, metadata), ...]。"""
+        if not self.ids or k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        rows = self._rows_for(search_filter)
+        if rows is None:
+            scores = self.vectors @ query
+        elif rows.size == 0:
+            return []
+        else:
+            scores = self.vectors[rows] @ query
+
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row = int(rows[i]) if rows is not None else int(i)
+            results.append((self.ids[row], float(scores[i]), self.texts[row], self.metadatas[row]))
+        return results
+
+    def save(self, index_dir: str) -> None:
+        # 先写临时文件再替换；矩阵先于元数据落盘，加载方以元数据的 mtime 判断是否需要重新加载
+        os.makedirs(index_dir, exist_ok=True)
+        vectors_path = os.path.join(index_dir, _VECTORS_FILE)
+        with open(vectors_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(vectors_path + ".tmp", vectors_path)
+
+        meta_path = os.path.join(index_dir, _META_FILE)
+        meta = dict(self.info, ids=self.ids, texts=self.texts, metadatas=self.metadatas)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "FlatVectorIndex":
+        with open(os.path.join(index_dir, _META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(index_dir, _VECTORS_FILE), mmap_mode="r")
+        ids = meta.pop("ids")
+        texts = meta.pop("texts")
+        metadatas = meta.pop("metadatas")
+        return cls(vectors, ids, texts, metadatas, info=meta)
+
+    @classmethod
+    def build(
+        cls,
+        chunks: Iterable[Tuple[str, str, Dict[str, str]]],
+        embeddings,
+        batch_size: int = 256,
+        info: Optional[Dict] = None,
+    ) -> "FlatVectorIndex":
+        """按批向量化 (id, text, metadata) 并拼成一个矩阵。"""
+        ids, texts, metadatas, blocks = [], [], [], []
+        batch: List[str] = []
+        for chunk_id, text, metadata in chunks:
+            ids.append(chunk_id)
+            texts.append(text)
+            metadatas.append(metadata or {})
+            batch.append(text)
+            if len(batch) >= batch_size:
+                blocks.append(embed_to_array(embeddings, batch))
+                batch = []
+        if batch:
+            blocks.append(embed_to_array(embeddings, batch))
+
+        dim = getattr(embeddings, "dim", None) or (blocks[0].shape[1] if blocks else 0)
+        vectors = np.vstack(blocks) if blocks else np.zeros((0, dim), dtype=np.float32)
+        return cls(vectors, ids, texts, metadatas, info=dict(info or {}, dim=int(vectors.shape[1])))
+
+
+_loaded_lock = threading.Lock()
+# 索引目录 -> (元数据文件 mtime, 索引)
+_loaded: Dict[str, Tuple[int, FlatVectorIndex]] = {}
+
+
+def load_flat_index(db_path: str) -> Optional[FlatVectorIndex]:
+    """加载（并缓存）领域库目录下的 flat_index；重建后自动重新加载，不存在时返回 None。"""
+    index_dir = os.path.abspath(os.path.join(db_path, FLAT_INDEX_DIR))
+    try:
+        mtime = os.stat(os.path.join(index_dir, _META_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    cached = _loaded.get(index_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _loaded_lock:
+        cached = _loaded.get(index_dir)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, FlatVectorIndex.load(index_dir))
+            _loaded[index_dir] = cached
+        return cached[1]
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+查询向量缓存
+在 Embedding 接口前加一层缓存：内存 LRU + 可选的 SQLite 持久层。
+面试中重复度很高的开场问题（"自我介绍"、"TCP 三次握手"）命中缓存后不再走网络。
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from hashlib import sha1
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from modules.tracing import traced
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 持久层格式版本：1 起向量按 float64 保存（与内存中的向量完全一致），并带最近使用时间
+_SCHEMA_VERSION = 1
+# 超出条数上限时一次淘汰到上限的这个比例，避免每次写入都触发清理
+_PRUNE_TO = 0.9
+
+
+def normalize_query(text: str) -> str:
+    """缓存 key 使用的文本归一化：全半角统一（NFKC）+ 合并连续空白。"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    embed_fn:     实际的向量化函数，输入一段文本返回向量（测试时可传入假函数）
+    max_entries:  内存 LRU 的最大条目数
+    persist_path: SQLite 文件路径；为 None 时只用内存缓存
+    namespace:    通常为 embedding 模型名，不同模型的向量互不混用
+    max_disk_entries: 持久层最多保存的条数，超出后按最近使用时间淘汰；0 表示不限
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], List[float]],
+        max_entries: int = 2048,
+        persist_path: Optional[Union[str, Path]] = None,
+        namespace: str = "",
+        max_disk_entries: int = 0,
+    ):
+        self.embed_fn = embed_fn
+        self.max_entries = max(1, int(max_entries))
+        self.max_disk_entries = max(0, int(max_disk_entries))
+        self.namespace = namespace
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn: Optional[sqlite3.Connection] = None
+        # 持久层条数的近似值（并发写同一 key 时会多计），只用来判断是否需要清理
+        self._disk_count = 0
+        if persist_path:
+            try:
+                Path(persist_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(persist_path), check_same_thread=False)
+                if self._conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                    # 旧格式按 float32 保存，读回后与内存中的向量不一致；缓存可以丢，直接重建
+                    self._conn.execute("DROP TABLE IF EXISTS query_embeddings")
+                    self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, vector BLOB NOT NULL, ts REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_ts ON query_embeddings (ts)")
+                self._conn.commit()
+                self._disk_count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            except sqlite3.Error as e:
+                # 持久层只是加速手段，打不开就退化为纯内存缓存
+                print(f"⚠️ 向量缓存文件不可用，仅使用内存缓存: {e}")
+                self._conn = None
+
+    def _key(self, normalized: str) -> str:
+        return sha1(f"{self.namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        # 调用方需持有 self._lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load_from_disk(self, key: str) -> Optional[List[float]]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            # 磁盘命中的条目会进入内存 LRU，之后很少再读盘，这里顺便刷新最近使用时间
+            self._conn.execute("UPDATE query_embeddings SET ts = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ 向量缓存写入失败: {e}")
+        return array("d", row[0]).tolist()
+
+    def _save_to_disk(self, key: str, vector: List[float]) -> None:
+        if self._conn is None:
+            return
+        try:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, namespace, vector, ts) VALUES (?, ?, ?, ?)",
+                (key, self.namespace, array("d", vector).tobytes(), time.time()),
+            )
+            self._disk_count += cursor.rowcount
+            if self.max_disk_entries and self._disk_count > self.max_disk_entries:
+                self._prune_disk()
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ 向量缓存写入失败: {e}")
+
+    def _prune_disk(self) -> None:
+        # 调用方需持有 self._lock；淘汰最久没用过的条目（不分 namespace，文件大小整体受限）
+        count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        excess = count - int(self.max_disk_entries * _PRUNE_TO)
+        if excess <= 0:
+            self._disk_count = count
+            return
+        self._conn.execute(
+            "DELETE FROM query_embeddings WHERE key IN "
+            "(SELECT key FROM query_embeddings ORDER BY ts LIMIT ?)",
+            (excess,),
+        )
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    def get(self, text: str) -> List[float]:
+        """返回文本的向量，优先读内存，其次读磁盘，最后才调用 embed_fn。"""
+        normalized = normalize_query(text)
+        key = self._key(normalized)
+
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            vector = self._load_from_disk(key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector
+            self.misses += 1
+
+        # 网络调用放在锁外，避免一个慢请求阻塞其他查询
+        vector = list(self.embed_fn(normalized))
+        with self._lock:
+            self._remember(key, vector)
+            self._save_to_disk(key, vector)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计：hits 包含 disk_hits。"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }
+
+    def clear(self, include_disk: bool = False) -> None:
+        with self._lock:
+            self._memory.clear()
+            if include_disk and self._conn is not None:
+                self._conn.execute(
+                    "DELETE FROM query_embeddings WHERE namespace = ?", (self.namespace,)
+                )
+                self._conn.commit()
+                self._disk_count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+
+class CachedEmbeddings:
+    """
+    包装一个 LangChain 风格的 Embedding 对象（需提供 embed_query / embed_documents），
+    可直接作为 Chroma 的 embedding_function 使用。
+    只缓存 embed_query；embed_documents 用于建库，直接透传。
+    """
+
+    def __init__(self, embeddings, cache: Optional[QueryEmbeddingCache] = None, **cache_kwargs):
+        self.embeddings = embeddings
+        self.cache = cache or QueryEmbeddingCache(embeddings.embed_query, **cache_kwargs)
+
+    @traced("rag.embed_query")
+    def embed_query(self, text: str) -> List[float]:
+        return self.cache.get(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+面试对话历史管理
+发给 LLM 的历史 = 滚动摘要 + 最近若干轮原文。原文部分超过 token 预算时，把最早的几轮折叠进摘要，
+摘要是增量更新的（旧摘要 + 新折叠的几轮 -> 新摘要），不会每轮从头总结整段面试。
+折叠在后台线程中进行，不阻塞当前回复；每轮发送的历史长度因此有上界，与面试进行了多久无关。
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    HISTORY_KEEP_RECENT_TURNS,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    HISTORY_SUMMARY_MODEL,
+    HISTORY_TOKEN_BUDGET,
+    LLM_API_KEY,
+    MAX_CONVERSATION_TURNS,
+)
+from modules.llm_client import create_chat_completion
+from modules.token_utils import estimate_messages_tokens, estimate_tokens, truncate_to_tokens
+from modules.tracing import submit_in_context
+
+SUMMARY_SYSTEM_PROMPT = """你负责为一场技术面试维护滚动摘要。给你"已有摘要"和"新增对话"，请输出合并后的新摘要：
+- 记录面试官问过的问题、候选人回答的要点与明显的对错、暴露的知识盲区
+- 保留候选人的背景信息（项目、技术栈、求职方向）
+- 不要编造对话中没有的内容，不要评价打分
+- 使用简洁的中文要点，不超过 {max_tokens} 字"""
+
+# 折叠时把原文压到预算的这个比例以下，避免每轮都刚好超出预算、每轮都触发折叠
+_FOLD_TARGET_RATIO = 0.5
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+
+def _format_messages(messages: List[Dict[str, str]]) -> str:
+    lines = []
+    for message in messages:
+        speaker = "候选人" if message.get("role") == "user" else "面试官"
+        lines.append(f"{speaker}：{message.get('content', '')}")
+    return "\n".join(lines)
+
+
+def llm_summarize(previous_summary: str, messages: List[Dict[str, str]]) -> str:
+    """默认摘要器：调用 LLM 把新增对话合并进已有摘要。"""
+    response = create_chat_completion(
+        api_key=LLM_API_KEY,
+        model=HISTORY_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(max_tokens=HISTORY_SUMMARY_MAX_TOKENS)},
+            {
+                "role": "user",
+                "content": f"已有摘要：\n{previous_summary or '（无）'}\n\n新增对话：\n{_format_messages(messages)}",
+            },
+        ],
+        max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+        temperature=0.3,
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+def _fallback_summary(previous_summary: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+    # LLM 不可用时的兜底：旧摘要与新对话原文直接拼接后按预算截断，保证摘要长度仍然有上界
+    merged = (previous_summary + "\n" if previous_summary else "") + _format_messages(messages)
+    return truncate_to_tokens(merged, max_tokens)
+
+
+class ConversationMemory:
+    """
+    max_tokens:        原文历史的 token 预算，超过后触发折叠
+    keep_recent_turns: 至少保留原文的最近轮数（一问一答为一轮）
+    summary_max_tokens: 摘要长度上限
+    summarizer:        (旧摘要, 新折叠的消息) -> 新摘要；默认调用 LLM
+    max_turns:         单场面试允许的最大轮数
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = HISTORY_TOKEN_BUDGET,
+        keep_recent_turns: int = HISTORY_KEEP_RECENT_TURNS,
+        summary_max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS,
+        summarizer: Optional[Summarizer] = None,
+        max_turns: int = MAX_CONVERSATION_TURNS,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer or llm_summarize
+        self.max_turns = max_turns
+        self.summary = ""
+        # history[:summarized_upto] 已折叠进摘要
+        self.summarized_upto = 0
+        self._lock = threading.Lock()
+        self._pending: Optional[Tuple[int, Future]] = None
+
+    def turn_count(self, history: List[Dict[str, str]]) -> int:
+        return sum(1 for message in history if message.get("role") == "user")
+
+    def turn_limit_reached(self, history: List[Dict[str, str]]) -> bool:
+        return self.max_turns > 0 and self.turn_count(history) >= self.max_turns
+
+    def _collect(self) -> None:
+        # 后台折叠完成后才更新摘要和折叠位置，两者一起变化
+        with self._lock:
+            if self._pending is None or not self._pending[1].done():
+                return
+            cut, future = self._pending
+            self._pending = None
+            try:
+                summary = future.result()
+            except Exception as e:
+                print(f"⚠️ 历史摘要失败，本次折叠取消: {e}")
+                return
+            self.summary = summary
+            self.summarized_upto = cut
+
+    def build_context(self, history: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+        """返回 (滚动摘要, 需要原文发送的最近消息)。摘要为空字符串表示还没有折叠过。"""
+        self._collect()
+        if self.summarized_upto > len(history):
+            # 外部清空或替换了历史
+            self.reset()
+        return self.summary, list(history[self.summarized_upto:])
+
+    def _fold_point(self, history: List[Dict[str, str]]) -> int:
+        # 从最早的未折叠消息开始，按整轮（从 user 消息起）向后推进折叠点
+        target = int(self.max_tokens * _FOLD_TARGET_RATIO)
+        user_indexes = [
+            i for i in range(self.summarized_upto, len(history))
+            if history[i].get("role") == "user"
+        ]
+        # 最近 keep_recent_turns 轮必须保留原文
+        candidates = user_indexes[1:len(user_indexes) - self.keep_recent_turns + 1]
+        cut = self.summarized_upto
+        for index in candidates:
+            cut = index
+            if estimate_messages_tokens(history[cut:]) <= target:
+                break
+        return cut
+
+    def maybe_fold(self, history: List[Dict[str, str]]) -> bool:
+        """
+        每轮结束后调用：原文超过预算时在后台把最早的几轮折叠进摘要。
+        已有折叠在进行时不重复提交。返回是否提交了新的折叠任务。
+        """
+        self._collect()
+        with self._lock:
+            if self._pending is not None:
+                return False
+            if estimate_messages_tokens(history[self.summarized_upto:]) <= self.max_tokens:
+                return False
+            cut = self._fold_point(history)
+            if cut <= self.summarized_upto:
+                return False
+            folded = list(history[self.summarized_upto:cut])
+            self._pending = (cut, submit_in_context(_executor, self._summarize, self.summary, folded))
+            return True
+
+    def _summarize(self, previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        try:
+            summary = self.summarizer(previous_summary, messages)
+        except Exception as e:
+            print(f"⚠️ LLM 摘要失败，使用截断摘要: {e}")
+            summary = ""
+        if not summary:
+            return _fallback_summary(previous_summary, messages, self.summary_max_tokens)
+        return truncate_to_tokens(summary, self.summary_max_tokens)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """等待进行中的折叠完成（脚本/测试中使用）。"""
+        pending = self._pending
+        if pending is not None:
+            pending[1].result(timeout)
+        self._collect()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.summary = ""
+            self.summarized_upto = 0
+            self._pending = None
+
+    def stats(self, history: List[Dict[str, str]]) -> Dict[str, int]:
+        summary, recent = self.summary, history[self.summarized_upto:]
+        return {
+            "turns": self.turn_count(history),
+            "folded_messages": self.summarized_upto,
+            "summary_tokens": estimate_tokens(summary),
+            "recent_tokens": estimate_messages_tokens(recent),
+        }
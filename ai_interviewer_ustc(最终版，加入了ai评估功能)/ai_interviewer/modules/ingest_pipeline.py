@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+向量库批量写入流水线
+文档按需读取、切分，按 batch 交给有界线程池并发调用 embedding（带退避重试），
+再分批写入向量库。任意时刻内存中最多只有 max_workers * 2 个 batch，语料再大内存也是平的。
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# (chunk_id, text, metadata)
+Chunk = Tuple[str, str, Dict[str, str]]
+# writer(ids, texts, metadatas, vectors)
+Writer = Callable[[List[str], List[str], List[Dict[str, str]], List[List[float]]], None]
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """把任意可迭代对象按 batch_size 切成列表，不会一次性展开整个输入。"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestStats:
+    """一次写入的统计信息。"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        self.retries = 0
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "retries": self.retries,
+            "embed_seconds": round(self.embed_seconds, 3),
+            "write_seconds": round(self.write_seconds, 3),
+            "elapsed": round(self.elapsed, 3),
+            "chunks_per_second": round(self.chunks_per_second, 2),
+        }
+
+
+class EmbeddingIngestPipeline:
+    """
+    embeddings:   提供 embed_documents(texts) 的对象
+    writer:       把一批已算好向量的 chunk 写入向量库，只在调用线程中执行（Chroma 写入不需要并发）
+    batch_size:   每次 embedding 请求的文本条数（DashScope text-embedding-v2 单次上限 25）
+    max_workers:  同时在途的 embedding 请求数
+    max_retries:  单个 batch 的最大重试次数，超过后整个流水线抛出异常
+    base_delay:   退避基准秒数，第 n 次重试等待 base_delay * 2^n 再乘以随机抖动
+    progress_every: 每写入多少个 batch 打印一次进度，0 表示不打印
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        writer: Writer,
+        batch_size: int = 25,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        progress_every: int = 10,
+    ):
+        self.embeddings = embeddings
+        self.writer = writer
+        self.batch_size = max(1, int(batch_size))
+        self.max_workers = max(1, int(max_workers))
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = base_delay
+        self.progress_every = progress_every
+
+    def _embed_with_retry(self, texts: List[str], stats: IngestStats) -> List[List[float]]:
+        # 在工作线程中执行，修改 stats 需持有 stats.lock
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                with stats.lock:
+                    stats.embed_seconds += time.perf_counter() - start
+                return vectors
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f"embedding 批次在 {attempt} 次重试后仍失败: {e}") from e
+                delay = self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                with stats.lock:
+                    stats.retries += 1
+                print(f"⚠️ embedding 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}")
+                time.sleep(delay)
+
+    def _write(self, batch: List[Chunk], vectors: List[List[float]], stats: IngestStats) -> None:
+        start = time.perf_counter()
+        self.writer(
+            [chunk[0] for chunk in batch],
+            [chunk[1] for chunk in batch],
+            [chunk[2] for chunk in batch],
+            vectors,
+        )
+        stats.write_seconds += time.perf_counter() - start
+        stats.chunks += len(batch)
+        stats.batches += 1
+        stats.elapsed = time.perf_counter() - stats.started_at
+        if self.progress_every and stats.batches % self.progress_every == 0:
+            print(
+                f"已写入 {stats.chunks} 个 chunk（{stats.batches} 批），"
+                f"{stats.chunks_per_second:.1f} chunk/s，重试 {stats.retries} 次"
+            )
+
+    def run(self, chunks: Iterable[Chunk], stats: Optional[IngestStats] = None) -> IngestStats:
+        """消费 chunk 迭代器直到耗尽，返回统计信息。任一批次最终失败会取消剩余批次并抛出异常。"""
+        stats = stats or IngestStats()
+        max_in_flight = self.max_workers * 2
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for batch in batched(chunks, self.batch_size):
+                    # 背压：在途 batch 达到上限时先写完已完成的，再继续读取输入
+                    while len(in_flight) >= max_in_flight:
+                        self._drain(in_flight, stats)
+                    texts = [chunk[1] for chunk in batch]
+                    future = executor.submit(self._embed_with_retry, texts, stats)
+                    in_flight[future] = batch
+                while in_flight:
+                    self._drain(in_flight, stats)
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+        stats.elapsed = time.perf_counter() - stats.started_at
+        return stats
+
+    def _drain(self, in_flight: dict, stats: IngestStats) -> None:
+        # 等待至少一个在途 batch 完成并写入
+        done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        for future in done:
+            batch = in_flight.pop(future)
+            self._write(batch, future.result(), stats)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+本地词法索引（BM25）
+CS 题库是短小、术语密集的中文问答（"OSI 参考模型"、"路由器"），关键词精确匹配往往比纯向量更准。
+这里实现一个不依赖任何第三方库的倒排索引：中文按字二元组切分，英文/数字按单词切分，BM25 打分。
+建库脚本同时产出该索引；检索时既可与向量结果做 RRF 融合，也可在 embedding 接口不可用时单独使用。
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LEXICAL_INDEX_FILE = "bm25_index.json"
+
+# 英文单词（保留 node.js / c++ / tcp/ip 这类术语内部的连接符）与连续的中文字符
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.+#/_-][a-z0-9]+)*\+*|[\u4e00-\u9fff]+")
+_STOPWORDS = {"的", "了", "是", "在", "和", "与", "及", "或", "吗", "呢", "吧", "啊", "什么", "怎么", "如何", "为什么", "一下", "请问"}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文连续片段切成相邻二元组（"路由器" -> "路由"、"由器"），单字片段保留单字；
+    英文与数字转小写按词切分。
+    """
+    tokens = []
+    for piece in _TOKEN_RE.findall((text or "").lower()):
+        if piece[0].isascii():
+            tokens.append(piece)
+            continue
+        for word in _split_stopwords(piece):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _split_stopwords(piece: str) -> List[str]:
+    # 在停用词处断开，避免 "的路" 这类跨停用词的二元组
+    words, current, i = [], "", 0
+    while i < len(piece):
+        for size in (3, 2, 1):
+            if piece[i:i + size] in _STOPWORDS:
+                if current:
+                    words.append(current)
+                current = ""
+                i += size
+                break
+        else:
+            current += piece[i]
+            i += 1
+    if current:
+        words.append(current)
+    return words
+
+
+def match_filter(metadata: Dict[str, str], search_filter: Optional[Dict]) -> bool:
+    """支持 {"k": v} 与 Chroma 风格的 {"$and": [{"k": v}, ...]} 两种写法的等值过滤。"""
+    if not search_filter:
+        return True
+    for key, value in search_filter.items():
+        if key == "$and":
+            if not all(match_filter(metadata, clause) for clause in value):
+                return False
+        elif key.startswith("$"):
+            continue  # 其他操作符词法索引不支持，交给向量检索处理
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, str]] = []
+        self.doc_lengths: List[int] = []
+        # term -> [[文档序号, 词频], ...]
+        self.postings: Dict[str, List[List[int]]] = {}
+
+    def add(self, chunk_id: str, text: str, metadata: Optional[Dict[str, str]] = None) -> None:
+        doc_index = len(self.ids)
+        tokens = tokenize(text)
+        self.ids.append(chunk_id)
+        self.texts.append(text)
+        self.metadatas.append(metadata or {})
+        self.doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append([doc_index, tf])
+
+    def add_many(self, chunks: Iterable[Tuple[str, str, Dict[str, str]]]) -> None:
+        for chunk_id, text, metadata in chunks:
+            self.add(chunk_id, text, metadata)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(
+        self,
+        query: str,
+        k: int = 6,
+        search_filter: Optional[Dict] = None,
+    ) -> List[Tuple[str, float, str, Dict[str, str]]]:
+        """返回按 BM25 分数降序的 [(id, score, text, metadata), ...]。"""
+        if not self.ids:
+            return []
+        n_docs = len(self.ids)
+        avgdl = sum(self.doc_lengths) / n_docs or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / avgdl)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_index, score in ranked:
+            if not match_filter(self.metadatas[doc_index], search_filter):
+                continue
+            results.append((self.ids[doc_index], score, self.texts[doc_index], self.metadatas[doc_index]))
+            if len(results) >= k:
+                break
+        return results
+
+    def save(self, path: str) -> None:
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.ids = data["ids"]
+        index.texts = data["texts"]
+        index.metadatas = data["metadatas"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        return index
+
+
+_loaded_lock = threading.Lock()
+# 索引文件路径 -> (文件 mtime, 索引)
+_loaded: Dict[str, Tuple[int, BM25Index]] = {}
+
+
+def load_lexical_index(db_path: str) -> Optional[BM25Index]:
+    """加载（并缓存）某个领域库目录下的 BM25 索引；文件更新后自动重新加载，不存在时返回 None。"""
+    path = os.path.abspath(os.path.join(db_path, LEXICAL_INDEX_FILE))
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, BM25Index.load(path))
+            _loaded[path] = cached
+        return cached[1]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """RRF：每个列表中排名 r 的结果得分 1 / (k + r)，多路累加后降序返回 [(id, score), ...]。"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, 1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,44 +1,52 @@
 #这个文件的作用是只处理文字入，文字出，其他一律不管
 #history 在app.py中存储，然后在app.py中调用这里的llm_stream_chat函数，实现流式输出
-import os
-from openai import OpenAI
-import re
+#客户端统一由 llm_client 提供（连接池、超时、重试），API Key 在 config.py 中配置
+from config import LLM_API_KEY, LLM_MODEL
+from modules.llm_client import create_chat_completion
+from modules.llm_stream import ERROR, StreamEvent, accumulate_stream_text, event_tokens, iter_completion_events
+from modules.prompt_builder import build_chat_messages
+from modules.tracing import traced
 
-client = OpenAI(
-    # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
-    api_key="sk-97cc56de88184ad1913987c3005a8c93",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-)
 
-
-def llm_stream_chat(history, user_input, system_prompt=None):
+@traced("llm.chat", tokens=event_tokens)
+def llm_stream_events(history, user_input, system_prompt=None, context=None, summary=None):
     """
-    history: 对话历史列表 [{"role":"user"|"assistant","content":"..."}]
-    user_input: 新的用户输入字符串
-    system_prompt: 可选，系统角色提示词（如面试官人设）
+    事件模式：参数同 llm_stream_chat，逐个 yield StreamEvent（增量文本 / 用量 / 结束原因 / 错误），
+    不在内部拼接累积文本。完整回复可用 join_stream_text 在最后拼接一次。
+    用量事件里的 prompt_tokens_details.cached_tokens 为命中服务端前缀缓存的 token 数。
     """
-    # 1. 准备发送给模型的消息
-    messages = list(history) if history else []
-    if system_prompt and system_prompt.strip():
-        messages = [{"role": "system", "content": system_prompt.strip()}] + messages
-    messages = messages + [{"role": "user", "content": user_input}]
-    
+    # 1. 准备发送给模型的消息：人设、历史在前保持不变，本轮检索内容放在最后一条消息
+    messages = build_chat_messages(system_prompt, history, user_input, context=context, summary=summary)
+
     try:
-        completion = client.chat.completions.create(
-            model="qwen-plus",
+        completion = create_chat_completion(
+            api_key=LLM_API_KEY,
+            model=LLM_MODEL,
             messages=messages,
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True},
         )
-
-        full_response = ""
-        # 2. 流式获取内容
-        for chunk in completion:
-            if chunk.choices and chunk.choices[0].delta.content:#chunk会返回一个列表，里面可能有多轮回答，但通常是一轮,所以下面会用chunk.choixes[0],delta为增量
-                content = chunk.choices[0].delta.content
-                full_response += content
-                # 重要：yield 当前累积的所有文本，Gradio 才能实时刷新界面
-                yield full_response 
+        # 2. 流式获取内容，每个 chunk 只产出增量
+        yield from iter_completion_events(completion)
 
     except Exception as e:
-        yield f"抱歉，系统出现了点小故障: {str(e)}"
+        yield StreamEvent(ERROR, text=str(e))
         #鲁棒性这一块
+
+
+@traced("llm.chat_text")
+def llm_stream_chat(history, user_input, system_prompt=None, context=None, summary=None):
+    """
+    history: 对话历史列表 [{"role":"user"|"assistant","content":"..."}]
+    user_input: 新的用户输入字符串
+    system_prompt: 可选，系统角色提示词（如面试官人设），应保持每轮不变以命中前缀缓存
+    context: 可选，本轮检索到的知识库内容（附在本轮用户消息之后）
+    summary: 可选，较早轮次的滚动摘要
+
+    兼容接口：每次 yield 当前累积的所有文本，Gradio 才能实时刷新界面。
+    新代码优先使用 llm_stream_events。
+    """
+    yield from accumulate_stream_text(
+        llm_stream_events(history, user_input, system_prompt, context=context, summary=summary),
+        error_template="抱歉，系统出现了点小故障: {}",
+    )
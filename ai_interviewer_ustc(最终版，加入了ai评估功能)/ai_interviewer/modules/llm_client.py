@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+共享的 LLM 客户端层
+所有模块通过这里拿 OpenAI 兼容客户端：同一 (api_key, base_url) 复用一个带连接池的 HTTP 客户端，
+统一超时、并发上限，以及对 429 / 5xx / 连接错误的抖动退避重试。参数全部来自 config.py。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    OpenAI,
+)
+
+from config import (
+    LLM_API_KEY,
+    LLM_BASE_URL,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_MAX_RETRIES,
+    LLM_READ_TIMEOUT,
+    LLM_RETRY_BASE_DELAY,
+)
+from modules.async_runtime import register_loop_cleanup
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_async_clients: Dict[Tuple[str, str, int], AsyncOpenAI] = {}
+
+# 同步调用的全局并发上限；流式请求会一直占用名额直到流被读完或关闭
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+# asyncio.Semaphore 绑定事件循环，按循环分别创建；循环关闭前由 close_loop_resources 清理
+_async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def get_llm_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """返回共享的同步客户端（keep-alive 连接池）。重试由本模块负责，SDK 自带重试关闭。"""
+    key = (api_key or LLM_API_KEY, base_url or LLM_BASE_URL)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                timeout=_timeout(),
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_llm_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """返回当前事件循环下共享的异步客户端（httpx.AsyncClient 不能跨事件循环使用）。"""
+    loop = asyncio.get_running_loop()
+    key = (api_key or LLM_API_KEY, base_url or LLM_BASE_URL, id(loop))
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                timeout=_timeout(),
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+            )
+            _async_clients[key] = client
+            # 客户端的连接池引用着事件循环，只能在循环关闭前显式关闭并移除
+            register_loop_cleanup(partial(_close_async_client, key))
+        return client
+
+
+async def _close_async_client(key: Tuple[str, str, int]) -> None:
+    with _lock:
+        client = _async_clients.pop(key, None)
+    if client is not None:
+        await client.close()
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """429、5xx、连接失败与超时可重试；鉴权、参数错误等直接抛出。"""
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(exc, APIConnectionError)  # 包括 APITimeoutError
+
+
+def retry_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待秒数：指数退避 + 随机抖动，最长 30 秒。"""
+    return min(30.0, LLM_RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class _BoundedStream:
+    """包装流式响应：流被读完、关闭或回收时归还并发名额。"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._release()
+            close = getattr(self._stream, "close", None)
+            if close:
+                close()
+
+    def __del__(self):
+        self.close()
+
+
+class _BoundedAsyncStream:
+    """异步版 _BoundedStream：流被读完、关闭、迭代它的任务被取消或对象被回收时归还并发名额。"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    def _release_once(self) -> bool:
+        if self._released:
+            return False
+        self._released = True
+        self._release()
+        return True
+
+    async def close(self):
+        if self._release_once():
+            close = getattr(self._stream, "close", None)
+            if close:
+                await close()
+
+    def __del__(self):
+        # 回收时已无法 await 关闭底层连接，只归还名额
+        self._release_once()
+
+
+def create_chat_completion(api_key: Optional[str] = None, base_url: Optional[str] = None, **params):
+    """
+    同步调用 chat.completions.create，参数与 SDK 一致。
+    受全局并发上限约束；建立请求失败且可重试时按抖动退避重试（流式请求只重试建立连接阶段）。
+    """
+    client = get_llm_client(api_key, base_url)
+    _sync_slots.acquire()
+    attempt = 0
+    try:
+        while True:
+            try:
+                result = client.chat.completions.create(**params)
+                break
+            except Exception as e:
+                if attempt >= LLM_MAX_RETRIES or not is_retryable_error(e):
+                    raise
+                delay = retry_delay(attempt)
+                attempt += 1
+                print(f"⚠️ LLM 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}")
+                time.sleep(delay)
+    except BaseException:
+        _sync_slots.release()
+        raise
+
+    if params.get("stream"):
+        return _BoundedStream(result, _sync_slots.release)
+    _sync_slots.release()
+    return result
+
+
+def _get_async_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _async_slots.get(loop)
+    if slots is None:
+        slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _async_slots[loop] = slots
+        register_loop_cleanup(partial(_drop_async_slots, loop))
+    return slots
+
+
+async def _drop_async_slots(loop: asyncio.AbstractEventLoop) -> None:
+    _async_slots.pop(loop, None)
+
+
+async def acreate_chat_completion(api_key: Optional[str] = None, base_url: Optional[str] = None, **params):
+    """
+    异步版 create_chat_completion，并发上限与重试规则相同。
+    流式请求与同步版一样，名额一直占用到流被读完、关闭或迭代被取消为止。
+    """
+    client = get_async_llm_client(api_key, base_url)
+    slots = _get_async_slots()
+    await slots.acquire()
+    attempt = 0
+    try:
+        while True:
+            try:
+                result = await client.chat.completions.create(**params)
+                break
+            except Exception as e:
+                if attempt >= LLM_MAX_RETRIES or not is_retryable_error(e):
+                    raise
+                delay = retry_delay(attempt)
+                attempt += 1
+                print(f"⚠️ LLM 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}")
+                await asyncio.sleep(delay)
+    except BaseException:
+        slots.release()
+        raise
+
+    if params.get("stream"):
+        return _BoundedAsyncStream(result, slots.release)
+    slots.release()
+    return result
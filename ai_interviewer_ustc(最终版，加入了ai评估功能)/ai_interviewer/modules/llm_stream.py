@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 流式输出的事件模式
+把 OpenAI 兼容接口的流式 chunk 转成类型化事件（增量文本 / 用量 / 结束原因 / 错误），
+消费方只拿到增量，完整文本在最后拼接一次，避免每个 token 都复制一遍累积字符串。
+"""
+
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+from modules.token_utils import estimate_tokens
+
+DELTA = "delta"
+USAGE = "usage"
+FINISH = "finish"
+ERROR = "error"
+
+
+@dataclass
+class StreamEvent:
+    type: str                               # DELTA / USAGE / FINISH / ERROR
+    text: str = ""                          # DELTA: 本次增量文本；ERROR: 错误信息
+    usage: Optional[Dict[str, Any]] = None  # USAGE: token 用量
+    finish_reason: Optional[str] = None     # FINISH: stop / length / ...
+
+
+def _usage_to_dict(usage) -> Dict[str, Any]:
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    return dict(usage)
+
+
+def _chunk_events(chunk) -> Iterator[StreamEvent]:
+    if chunk.choices:
+        choice = chunk.choices[0]
+        if choice.delta and choice.delta.content:
+            yield StreamEvent(DELTA, text=choice.delta.content)
+        if choice.finish_reason:
+            yield StreamEvent(FINISH, finish_reason=choice.finish_reason)
+    # 开启 stream_options.include_usage 后，最后一个 chunk 的 choices 为空、只带 usage
+    if getattr(chunk, "usage", None):
+        yield StreamEvent(USAGE, usage=_usage_to_dict(chunk.usage))
+
+
+def iter_completion_events(completion) -> Iterator[StreamEvent]:
+    """把 client.chat.completions.create(stream=True) 的返回值转换为事件流。"""
+    for chunk in completion:
+        yield from _chunk_events(chunk)
+
+
+async def aiter_completion_events(completion) -> AsyncIterator[StreamEvent]:
+    """异步版 iter_completion_events，用于 AsyncOpenAI 的流式返回值。"""
+    async for chunk in completion:
+        for event in _chunk_events(chunk):
+            yield event
+
+
+def event_tokens(event: StreamEvent) -> int:
+    """增量文本事件的估算 token 数，其余事件为 0；耗时追踪据此计算首 token 耗时和输出速率。"""
+    return estimate_tokens(event.text) if event.type == DELTA else 0
+
+
+def join_stream_text(events: Iterable[StreamEvent]) -> str:
+    """消费事件流，只在结束时拼接一次完整文本；遇到错误事件抛出 RuntimeError。"""
+    parts = []
+    for event in events:
+        if event.type == DELTA:
+            parts.append(event.text)
+        elif event.type == ERROR:
+            raise RuntimeError(event.text)
+    return "".join(parts)
+
+
+def accumulate_stream_text(events: Iterable[StreamEvent], error_template: str = "{}") -> Iterator[str]:
+    """
+    兼容旧接口的适配器：每收到一段增量就 yield 从开头到当前的完整文本。
+    错误事件按 error_template 格式化后 yield 一次。
+    """
+    full_response = ""
+    for event in events:
+        if event.type == DELTA:
+            full_response += event.text
+            yield full_response
+        elif event.type == ERROR:
+            yield error_template.format(event.text)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+前缀稳定的 prompt 组装
+服务端的前缀缓存（DashScope / OpenAI 的 prompt caching）只对"与上次请求完全相同的开头"生效。
+消息顺序固定为：面试官人设（+ 滚动摘要）-> 已冻结的历史原文 -> 本轮用户输入 + 本轮检索内容。
+每轮变化的检索内容只出现在最后一条消息里，前面的人设和历史逐字不变，下一轮可以整体命中缓存；
+只有历史折叠进摘要时前缀才会变化一次。
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+CONTEXT_HEADER = "参考知识库内容（仅供回答参考，候选人看不到）："
+SUMMARY_HEADER = "此前面试内容摘要："
+
+
+def build_system_message(persona: Optional[str], summary: Optional[str] = None) -> Optional[Dict[str, str]]:
+    parts = []
+    if persona and persona.strip():
+        parts.append(persona.strip())
+    if summary and summary.strip():
+        parts.append(f"{SUMMARY_HEADER}\n{summary.strip()}")
+    if not parts:
+        return None
+    return {"role": "system", "content": "\n\n".join(parts)}
+
+
+def build_turn_message(user_input: str, context: Optional[str] = None) -> Dict[str, str]:
+    """本轮的用户消息；检索内容附在用户输入之后，不进入会被复用的前缀。"""
+    if context and context.strip():
+        return {"role": "user", "content": f"{user_input}\n\n---\n{CONTEXT_HEADER}\n{context.strip()}"}
+    return {"role": "user", "content": user_input}
+
+
+def build_chat_messages(
+    persona: Optional[str],
+    history: Optional[List[Dict[str, str]]],
+    user_input: str,
+    context: Optional[str] = None,
+    summary: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """
+    persona:    面试官人设（system prompt），整场面试保持不变
+    history:    原文发送的历史消息（存的是不带检索内容的原始输入）
+    user_input: 本轮用户输入
+    context:    本轮检索到的知识库内容
+    summary:    较早轮次的滚动摘要
+    """
+    messages = []
+    system_message = build_system_message(persona, summary)
+    if system_message:
+        messages.append(system_message)
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history or [])
+    messages.append(build_turn_message(user_input, context))
+    return messages
+
+
+def cached_prompt_tokens(usage: Optional[Dict[str, Any]]) -> int:
+    """从 usage 中取命中前缀缓存的 prompt token 数；接口未返回该字段时为 0。"""
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or 0)
+
+
+class PromptCacheStats:
+    """累计每次请求的 prompt token 与缓存命中情况，衡量前缀缓存带来的节省。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.last: Dict[str, int] = {}
+
+    def record(self, usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+        prompt_tokens = int((usage or {}).get("prompt_tokens") or 0)
+        cached = min(cached_prompt_tokens(usage), prompt_tokens)
+        last = {"prompt_tokens": prompt_tokens, "cached_tokens": cached, "uncached_tokens": prompt_tokens - cached}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached
+            self.last = last
+        return last
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "uncached_tokens": self.prompt_tokens - self.cached_tokens,
+                "cache_hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
@@ -1,9 +1,48 @@
+import hashlib
+import json
 import os
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from langchain_community.embeddings import DashScopeEmbeddings
 from langchain_chroma import Chroma
 
-from config import DASHSCOPE_API_KEY
+from config import (
+    DASHSCOPE_API_KEY,
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_MAX_WORKERS,
+    LOCAL_EMBEDDING_DIM,
+    QUERY_EMBEDDING_CACHE_PATH,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_DISK_MAX_ENTRIES,
+    RAG_CONTEXT_TOKEN_BUDGET,
+    RAG_DEDUP_THRESHOLD,
+    RAG_HYBRID_VECTOR_TIMEOUT,
+    RAG_MIN_SCORE,
+    RAG_RETRIEVAL_MODE,
+)
+from modules.embedding_backends import (
+    FLAT_INDEX_DIR,
+    FlatVectorIndex,
+    HashingEmbeddings,
+    load_flat_index,
+)
+from modules.embedding_cache import CachedEmbeddings
+from modules.ingest_pipeline import EmbeddingIngestPipeline
+from modules.lexical_index import (
+    LEXICAL_INDEX_FILE,
+    BM25Index,
+    load_lexical_index,
+    reciprocal_rank_fusion,
+)
+from modules.token_utils import estimate_tokens, truncate_to_tokens
+from modules.tracing import annotate, span, submit_in_context, traced
 
 '''
 一些说明：
@@ -12,48 +51,452 @@ text_embedding有很多种model可以选择，比如 BAAI/bge-m3 或者是 BAAI/
 
 在本次，我们选择的是阿里云DashScope的text-embedding-v2，需要阿里云的API来进行使用
 
+也可以把 config.EMBEDDING_BACKEND 设为 local：使用本地哈希 n-gram 向量 + NumPy flat 索引，建库与检索都不访问网络
+
 '''
 
-# 统一的 RAG 检索入口，llm_agent 只需调用 get_retrieved_context
-def get_retrieved_context(
+# ==================== 向量库句柄注册表 ====================
+# 进程级缓存：同一个 (persist_dir, domain, embedding 模型) 只打开一次 Chroma，
+# 避免每轮对话都重新创建 Embedding 对象、重新打开 SQLite 并加载集合。
+# 建库后调用 mark_vector_store_rebuilt：同进程内直接失效缓存，
+# 其他进程（如正在运行的 Streamlit）通过库目录下的构建标记文件感知到重建。
+BUILD_STAMP_FILE = ".build_stamp"
+
+_registry_lock = threading.Lock()
+_embeddings_registry: Dict[str, CachedEmbeddings] = {}
+# value: (Chroma 句柄, 打开时的构建标记)
+_vector_store_registry: Dict[Tuple[str, str, str], Tuple[Chroma, Optional[int]]] = {}
+
+
+def _registry_key(persist_dir: str, domain: str, embedding_model: str) -> Tuple[str, str, str]:
+    # persist_dir 统一成绝对路径，避免 "./vector_db" 与绝对路径被当成两个库
+    return (os.path.abspath(persist_dir), domain, embedding_model)
+
+
+def _read_build_stamp(db_path: str) -> Optional[int]:
+    # 只做一次 stat，开销远小于重新打开 Chroma
+    try:
+        return os.stat(os.path.join(db_path, BUILD_STAMP_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_embeddings(embedding_model: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """获取（并缓存）指定模型的 Embedding 对象，查询向量走 LRU + 磁盘缓存。"""
+    with _registry_lock:
+        embeddings = _embeddings_registry.get(embedding_model)
+        if embeddings is None:
+            if DASHSCOPE_API_KEY:
+                os.environ["DASHSCOPE_API_KEY"] = DASHSCOPE_API_KEY
+            embeddings = CachedEmbeddings(
+                DashScopeEmbeddings(model=embedding_model),
+                max_entries=QUERY_EMBEDDING_CACHE_SIZE,
+                persist_path=QUERY_EMBEDDING_CACHE_PATH or None,
+                max_disk_entries=QUERY_EMBEDDING_DISK_MAX_ENTRIES,
+                namespace=embedding_model,
+            )
+            _embeddings_registry[embedding_model] = embeddings
+        return embeddings
+
+
+def get_query_cache_stats(embedding_model: str = EMBEDDING_MODEL) -> Dict[str, int]:
+    """查询向量缓存的命中统计；尚未发生检索时返回全 0。"""
+    embeddings = _embeddings_registry.get(embedding_model)
+    if embeddings is None:
+        return {"hits": 0, "disk_hits": 0, "misses": 0, "size": 0}
+    return embeddings.stats()
+
+
+# ==================== Embedding 后端 ====================
+# 后端名 -> 返回 Embeddings 对象（embed_documents / embed_query）的工厂函数。
+# dashscope 的向量存 Chroma；其余后端的向量存领域库目录下的 flat_index。
+_local_embeddings: Optional[HashingEmbeddings] = None
+
+
+def _get_local_embeddings() -> HashingEmbeddings:
+    global _local_embeddings
+    if _local_embeddings is None:
+        _local_embeddings = HashingEmbeddings(dim=LOCAL_EMBEDDING_DIM)
+    return _local_embeddings
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[[], object]] = {
+    "dashscope": get_embeddings,
+    "local": _get_local_embeddings,
+}
+
+
+def register_embedding_backend(name: str, factory: Callable[[], object]) -> None:
+    """注册新的 embedding 后端（例如本地 ONNX 模型），建库与检索即可通过名字选用。"""
+    EMBEDDING_BACKENDS[name] = factory
+
+
+def get_embedding_backend(name: str = EMBEDDING_BACKEND):
+    factory = EMBEDDING_BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"未知的 embedding 后端: {name}，可选 {tuple(EMBEDDING_BACKENDS)}")
+    return factory()
+
+
+def get_vector_store(
+    domain: str = "cs",
+    persist_dir: str = "./vector_db",
+    embedding_model: str = EMBEDDING_MODEL,
+) -> Optional[Chroma]:
+    """
+    返回已预热的 Chroma 句柄；向量库目录不存在时返回 None。
+    同一进程内相同 key 的调用共享同一个句柄。
+    """
+    key = _registry_key(persist_dir, domain, embedding_model)
+    db_path = os.path.join(key[0], domain)
+    stamp = _read_build_stamp(db_path)
+    cached = _vector_store_registry.get(key)
+    if cached is not None and cached[1] == stamp:
+        return cached[0]
+
+    if not os.path.exists(db_path):
+        invalidate_vector_store(domain=domain, persist_dir=persist_dir)
+        return None
+
+    embeddings = get_embeddings(embedding_model)
+    with _registry_lock:
+        # 双重检查：并发的首次调用只打开一次
+        cached = _vector_store_registry.get(key)
+        if cached is None or cached[1] != stamp:
+            vector_db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+            cached = (vector_db, stamp)
+            _vector_store_registry[key] = cached
+        return cached[0]
+
+
+def invalidate_vector_store(
+    domain: Optional[str] = None,
+    persist_dir: Optional[str] = None,
+) -> int:
+    """
+    让缓存的向量库句柄失效，下次检索时重新打开。
+    domain / persist_dir 为 None 表示不按该项过滤；都为 None 时清空全部。
+    返回被移除的句柄数量。
+    """
+    abs_dir = os.path.abspath(persist_dir) if persist_dir else None
+    with _registry_lock:
+        stale = [
+            key for key in _vector_store_registry
+            if (abs_dir is None or key[0] == abs_dir)
+            and (domain is None or key[1] == domain)
+        ]
+        for key in stale:
+            del _vector_store_registry[key]
+    return len(stale)
+
+
+def mark_vector_store_rebuilt(domain: str = "cs", persist_dir: str = "./vector_db") -> None:
+    """建库/更新完成后调用：刷新构建标记并失效本进程中的缓存句柄。"""
+    db_path = os.path.join(persist_dir, domain)
+    if os.path.isdir(db_path):
+        stamp_path = os.path.join(db_path, BUILD_STAMP_FILE)
+        with open(stamp_path, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+        # 部分文件系统 mtime 精度较粗，显式更新为当前纳秒时间
+        now_ns = time.time_ns()
+        os.utime(stamp_path, ns=(now_ns, now_ns))
+    invalidate_vector_store(domain=domain, persist_dir=persist_dir)
+
+
+# 检索模式：vector 纯向量；lexical 纯 BM25（不访问网络）；hybrid 两路结果做 RRF 融合
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+NO_CONTEXT_TEXT = "暂无相关领域背景知识"
+
+
+@dataclass
+class RetrievalHit:
+    id: str                                   # chunk id（文本 + metadata 的哈希）
+    text: str
+    score: float                              # vector: 相似度 0~1；lexical: BM25 分；hybrid: RRF 分
+    metadata: Dict[str, str] = field(default_factory=dict)  # topic / difficulty 等
+    source: str = "vector"                    # vector / lexical / hybrid
+
+
+def _normalize_filter(search_filter: Optional[Dict[str, str]]) -> Optional[Dict]:
+    # 如果传入的是简单键值对且有多个条件，自动组装成 $and 以适配 Chroma 过滤语法。
+    if search_filter and all(not key.startswith("$") for key in search_filter):
+        if len(search_filter) > 1:
+            return {"$and": [{k: v} for k, v in search_filter.items()]}
+    return search_filter
+
+
+@traced("rag.vector_search")
+def _vector_search(
+    query: str,
+    db_path: str,
+    domain: str,
+    persist_dir: str,
+    k: int,
+    search_filter: Optional[Dict],
+    backend: str,
+) -> Optional[List[RetrievalHit]]:
+    """向量检索，按相似度降序返回；对应后端的库不存在时返回 None。"""
+    if backend == "dashscope":
+        vector_db = get_vector_store(domain=domain, persist_dir=persist_dir)
+        if vector_db is None:
+            return None
+        pairs = vector_db.similarity_search_with_relevance_scores(query, k=k, filter=search_filter)
+        return [
+            RetrievalHit(chunk_hash(doc.page_content, doc.metadata), doc.page_content, score, doc.metadata or {})
+            for doc, score in pairs
+        ]
+
+    index = load_flat_index(db_path)
+    if index is None:
+        return None
+    built_with = index.info.get("backend")
+    if built_with != backend:
+        raise ValueError(f"flat_index 由 {built_with} 后端构建，与当前后端 {backend} 不一致，请重新建库")
+    with span("rag.embed_query", backend=backend):
+        query_vector = get_embedding_backend(backend).embed_query(query)
+    with span("rag.flat_search", size=len(index)):
+        results = index.search(query_vector, k=k, search_filter=search_filter)
+    return [RetrievalHit(chunk_id, text, score, metadata) for chunk_id, score, text, metadata in results]
+
+
+@traced("rag.lexical_search")
+def _lexical_hits(lexical_index: BM25Index, query: str, k: int, search_filter: Optional[Dict]) -> List[RetrievalHit]:
+    return [
+        RetrievalHit(chunk_id, text, score, metadata, source="lexical")
+        for chunk_id, score, text, metadata in lexical_index.search(query, k=k, search_filter=search_filter)
+    ]
+
+
+# 库目录下没有 bm25_index.json（例如只提交了 Chroma 库）时，从 Chroma 集合里的文本生成的 BM25 索引
+# db_path -> (构建标记, 索引)；生成失败的库只提示一次
+_derived_lexical: Dict[str, Tuple[Optional[int], BM25Index]] = {}
+_derived_lexical_lock = threading.Lock()
+_lexical_warned: set = set()
+
+
+def _get_lexical_index(db_path: str, domain: str, persist_dir: str, backend: str) -> Optional[BM25Index]:
+    """加载库目录下的 BM25 索引；没有索引文件时用 Chroma 里已有的文本生成并尽量落盘，都不可用时返回 None。"""
+    lexical_index = load_lexical_index(db_path)
+    if lexical_index is not None or backend != "dashscope":
+        return lexical_index
+    key = os.path.abspath(db_path)
+    stamp = _read_build_stamp(db_path)
+    cached = _derived_lexical.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with _derived_lexical_lock:
+        cached = _derived_lexical.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            lexical_index = _lexical_index_from_chroma(db_path, domain, persist_dir)
+        except Exception as exc:
+            lexical_index = None
+            if key not in _lexical_warned:
+                _lexical_warned.add(key)
+                print(f"⚠️ {db_path} 没有 BM25 索引且无法从向量库生成，词法检索不可用: {exc}")
+        if lexical_index is None:
+            return None
+        _derived_lexical[key] = (stamp, lexical_index)
+        return lexical_index
+
+
+@traced("rag.build_lexical")
+def _lexical_index_from_chroma(db_path: str, domain: str, persist_dir: str) -> Optional[BM25Index]:
+    vector_db = get_vector_store(domain=domain, persist_dir=persist_dir)
+    if vector_db is None:
+        return None
+    stored = vector_db.get(include=["documents", "metadatas"])
+    lexical_index = BM25Index()
+    for text, metadata in zip(stored["documents"], stored["metadatas"]):
+        if text:
+            # 与向量结果使用同一种 chunk id，hybrid 融合时才能对上
+            lexical_index.add(chunk_hash(text, metadata), text, metadata or {})
+    annotate(chunks=len(lexical_index))
+    try:
+        lexical_index.save(os.path.join(db_path, LEXICAL_INDEX_FILE))
+    except OSError as exc:
+        print(f"⚠️ BM25 索引写入失败，仅在本进程内使用: {exc}")
+    return lexical_index
+
+
+# hybrid 模式的向量检索放到线程池里，超时后先用词法结果返回（超时的请求仍会在后台跑完）
+_vector_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-vector")
+
+
+def _fuse_hits(hit_lists: List[List[RetrievalHit]]) -> List[RetrievalHit]:
+    # 按 chunk id 做 RRF 融合，分数替换为 RRF 分
+    by_id: Dict[str, RetrievalHit] = {}
+    for hits in hit_lists:
+        for hit in hits:
+            by_id.setdefault(hit.id, hit)
+    fused = reciprocal_rank_fusion([[hit.id for hit in hits] for hits in hit_lists])
+    return [
+        RetrievalHit(chunk_id, by_id[chunk_id].text, score, by_id[chunk_id].metadata, source="hybrid")
+        for chunk_id, score in fused
+    ]
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    compact = "".join(text.split())
+    if len(compact) <= size:
+        return {compact}
+    return {compact[i:i + size] for i in range(len(compact) - size + 1)}
+
+
+def dedup_hits(hits: List[RetrievalHit], threshold: float = RAG_DEDUP_THRESHOLD) -> List[RetrievalHit]:
+    """按排名顺序保留结果，与已保留片段的字符 3-gram Jaccard 相似度超过 threshold 的视为近重复丢弃。"""
+    if threshold >= 1:
+        return list(hits)
+    kept, kept_shingles = [], []
+    for hit in hits:
+        shingles = _shingles(hit.text)
+        duplicate = any(
+            len(shingles & other) / len(shingles | other) > threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(hit)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def _retrieve(
+    query: str,
+    domain: str,
+    k: int,
+    persist_dir: str,
+    search_filter: Optional[Dict[str, str]],
+    mode: str,
+    backend: str,
+    min_score: float,
+) -> Optional[List[RetrievalHit]]:
+    """按模式检索候选（未去重、未截断）；所需索引都不存在时返回 None。"""
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"未知的检索模式: {mode}，可选 {RETRIEVAL_MODES}")
+    normalized_filter = _normalize_filter(search_filter)
+    db_path = os.path.join(persist_dir, domain)
+    # 多取一倍候选，给阈值过滤、去重和融合留余量
+    candidates = k * 2
+
+    if mode == "lexical":
+        lexical_index = _get_lexical_index(db_path, domain, persist_dir, backend)
+        if lexical_index is None:
+            return None
+        return _lexical_hits(lexical_index, query, candidates, normalized_filter)
+
+    if mode == "vector":
+        hits = _vector_search(query, db_path, domain, persist_dir, candidates, normalized_filter, backend)
+        if hits is None:
+            return None
+        return [hit for hit in hits if hit.score >= min_score]
+
+    # hybrid：向量检索失败或超时时退化为词法检索
+    lexical_index = _get_lexical_index(db_path, domain, persist_dir, backend)
+    vector_hits = None
+    if lexical_index is None:
+        vector_hits = _vector_search(query, db_path, domain, persist_dir, candidates, normalized_filter, backend)
+    else:
+        future = submit_in_context(
+            _vector_executor, _vector_search,
+            query, db_path, domain, persist_dir, candidates, normalized_filter, backend,
+        )
+        try:
+            vector_hits = future.result(timeout=RAG_HYBRID_VECTOR_TIMEOUT)
+        except FutureTimeoutError:
+            print(f"⚠️ 向量检索超过 {RAG_HYBRID_VECTOR_TIMEOUT}s，本次只用词法检索结果")
+            annotate(vector_timeout=True)
+        except Exception as exc:
+            print(f"⚠️ 向量检索失败，退化为词法检索: {exc}")
+    if vector_hits is None and lexical_index is None:
+        return None
+    rankings = [[hit for hit in vector_hits or [] if hit.score >= min_score]]
+    if lexical_index is not None:
+        rankings.append(_lexical_hits(lexical_index, query, candidates, normalized_filter))
+    return _fuse_hits(rankings)
+
+
+@traced("rag.retrieve")
+def retrieve(
     query: str,
     domain: str = "cs",
     k: int = 6,
     persist_dir: str = "./vector_db",
     search_filter: Optional[Dict[str, str]] = None,
-) -> str:
-    # 基于指定领域的 Chroma 向量库检索上下文片段
+    mode: str = RAG_RETRIEVAL_MODE,
+    backend: str = EMBEDDING_BACKEND,
+    min_score: float = RAG_MIN_SCORE,
+    dedup_threshold: float = RAG_DEDUP_THRESHOLD,
+) -> List[RetrievalHit]:
+    """
+    结构化检索：返回按相关度降序、去除近重复后的至多 k 条 RetrievalHit；知识库不存在时返回空列表。
+    mode: "vector" / "lexical" / "hybrid"，见 RETRIEVAL_MODES。
+    backend: 向量检索使用的 embedding 后端，需与建库时一致，见 EMBEDDING_BACKENDS。
+    min_score: 向量相似度下限，只作用于向量结果（hybrid 模式在融合前过滤）。
+    """
     try:
-        if DASHSCOPE_API_KEY:
-            os.environ["DASHSCOPE_API_KEY"] = DASHSCOPE_API_KEY
-        embeddings = DashScopeEmbeddings(model="text-embedding-v2")
-        db_path = os.path.join(persist_dir, domain)
-        if not os.path.exists(db_path):
-            return "暂无相关领域背景知识"
-
-        vector_db = Chroma(persist_directory=db_path, embedding_function=embeddings)
-        normalized_filter = search_filter
-        # 如果传入的是简单键值对且有多个条件，自动组装成 $and 以适配 Chroma 过滤语法。
-        if search_filter and all(not key.startswith("$") for key in search_filter):
-            if len(search_filter) > 1:
-                normalized_filter = {"$and": [{k: v} for k, v in search_filter.items()]}
-
-        docs = vector_db.similarity_search(query, k=k, filter=normalized_filter)
-        return "\n".join(doc.page_content for doc in docs)
+        hits = _retrieve(query, domain, k, persist_dir, search_filter, mode, backend, min_score)
+        hits = dedup_hits(hits or [], dedup_threshold)[:k]
+        annotate(mode=mode, hits=len(hits))
+        return hits
     except Exception as exc:  # 错误处理
         print(f"检索出错: {exc}")
         raise  # 向调用方抛出，便于前端展示错误信息
 
 
-def build_vector_store(
-    docs: List[Dict[str, str]],
+def format_hits_for_prompt(hits: List[RetrievalHit], token_budget: int = RAG_CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    把检索结果按排名编号拼成 prompt 片段，总长度不超过 token_budget。
+    预算装不下的片段整条舍弃；第一条就超出预算时截断保留。
+    """
+    parts, used = [], 0
+    for i, hit in enumerate(hits, 1):
+        labels = [hit.metadata.get(key) for key in ("topic", "difficulty") if hit.metadata.get(key)]
+        header = f"[{i}]" + (f"（{' / '.join(labels)}）" if labels else "")
+        block = f"{header} {hit.text.strip()}"
+        cost = estimate_tokens(block) + 1  # 换行
+        if used + cost > token_budget:
+            if not parts:
+                parts.append(truncate_to_tokens(block, token_budget))
+            break
+        parts.append(block)
+        used += cost
+    return "\n".join(parts)
+
+
+# 统一的 RAG 检索入口，llm_agent 只需调用 get_retrieved_context
+@traced("rag.get_retrieved_context")
+def get_retrieved_context(
+    query: str,
     domain: str = "cs",
+    k: int = 6,
     persist_dir: str = "./vector_db",
-    k: int = 2,
-    chunk_size: int = 500,
-    chunk_overlap: int = 50,
+    search_filter: Optional[Dict[str, str]] = None,
+    mode: str = RAG_RETRIEVAL_MODE,
+    backend: str = EMBEDDING_BACKEND,
 ) -> str:
-    """可选的建库辅助函数：传入已分段好的文本列表，写入 Chroma。"""
+    """
+    兼容旧接口：retrieve 结果的文本按换行拼接，没有检索到内容时返回 NO_CONTEXT_TEXT；
+    新代码请使用 retrieve + format_hits_for_prompt。
+    """
+    hits = retrieve(query, domain, k, persist_dir, search_filter, mode, backend)
+    return "\n".join(hit.text for hit in hits) or NO_CONTEXT_TEXT
+
+
+# ==================== 建库 ====================
+# 每个 chunk 的 id 由 (文本, metadata) 的哈希决定，内容不变 id 就不变，
+# 增量建库据此只处理新增/变化/删除的 chunk。manifest 记录库中现有的 chunk id。
+# BM25 词法索引很便宜，每次建库/同步都按当前全部 chunk 重新生成。
+MANIFEST_FILE = "index_manifest.json"
+_DELETE_BATCH_SIZE = 500
+
+
+def iter_chunks(
+    docs: Iterable[Dict[str, str]],
+    chunk_size: int,
+    chunk_overlap: int,
+) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """逐个文档切分并计算 chunk id，惰性产出 (id, text, metadata)，相同 id 只产出一次。"""
     from langchain_text_splitters import RecursiveCharacterTextSplitter
 
     splitter = RecursiveCharacterTextSplitter(
@@ -62,23 +505,252 @@ def build_vector_store(
         separators=["\n\n", "\n", "。", "！", "？", ".", "!", ";", "；"],
     )
 
-    texts, metadatas = [], []
+    seen = set()
     for item in docs:
         content = item.get("content") or ""
         metadata = item.get("metadata") or {}
         for chunk in splitter.split_text(content):
-            texts.append(chunk)
-            metadatas.append(metadata)
+            chunk_id = chunk_hash(chunk, metadata)
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            yield chunk_id, chunk, metadata
 
-    if DASHSCOPE_API_KEY:
-        os.environ["DASHSCOPE_API_KEY"] = DASHSCOPE_API_KEY
-    embeddings = DashScopeEmbeddings(model="text-embedding-v2")
-    db_path = os.path.join(persist_dir, domain)
-    vector_db = Chroma.from_texts(
-        texts=texts,
-        embedding=embeddings,
-        metadatas=metadatas,
-        persist_directory=db_path,
+
+def chunk_hash(text: str, metadata: Optional[Dict[str, str]] = None) -> str:
+    payload = json.dumps(
+        {"text": text, "metadata": metadata or {}}, ensure_ascii=False, sort_keys=True
     )
-    vector_db.persist()
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(db_path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(db_path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(db_path: str, manifest: Dict) -> None:
+    # 先写临时文件再替换，中途失败不会留下半个 manifest
+    path = os.path.join(db_path, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _build_manifest(ids: List[str], chunk_size: int, chunk_overlap: int) -> Dict:
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "chunk_ids": sorted(ids),
+    }
+
+
+def _make_chroma_writer(vector_db: Chroma):
+    """返回把已算好向量的 chunk upsert 进 Chroma 的 writer，避免 add_texts 重复计算 embedding。"""
+    collection = vector_db._collection
+
+    def write(ids, texts, metadatas, vectors):
+        # Chroma 不接受空 metadata，与 langchain add_texts 一样拆成两组写入
+        with_meta = [i for i, m in enumerate(metadatas) if m]
+        without_meta = [i for i, m in enumerate(metadatas) if not m]
+        if with_meta:
+            collection.upsert(
+                ids=[ids[i] for i in with_meta],
+                embeddings=[vectors[i] for i in with_meta],
+                documents=[texts[i] for i in with_meta],
+                metadatas=[metadatas[i] for i in with_meta],
+            )
+        if without_meta:
+            collection.upsert(
+                ids=[ids[i] for i in without_meta],
+                embeddings=[vectors[i] for i in without_meta],
+                documents=[texts[i] for i in without_meta],
+            )
+
+    return write
+
+
+def _make_ingest_pipeline(vector_db: Chroma, **pipeline_kwargs) -> EmbeddingIngestPipeline:
+    options = {
+        "batch_size": EMBEDDING_BATCH_SIZE,
+        "max_workers": EMBEDDING_MAX_WORKERS,
+        "max_retries": EMBEDDING_MAX_RETRIES,
+    }
+    options.update({k: v for k, v in pipeline_kwargs.items() if v is not None})
+    # 建库走原始 embedding 对象：文档向量不需要进查询缓存
+    return EmbeddingIngestPipeline(
+        get_embeddings().embeddings, _make_chroma_writer(vector_db), **options
+    )
+
+
+def build_vector_store(
+    docs: Iterable[Dict[str, str]],
+    domain: str = "cs",
+    persist_dir: str = "./vector_db",
+    k: int = 2,
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    batch_size: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> str:
+    """
+    可选的建库辅助函数：传入文档（可以是惰性生成器），切分后分批并发 embedding 写入 Chroma。
+    batch_size / max_workers 为 None 时使用 config 中的默认值。
+    """
+    db_path = os.path.join(persist_dir, domain)
+    vector_db = Chroma(persist_directory=db_path, embedding_function=get_embeddings())
+    pipeline = _make_ingest_pipeline(vector_db, batch_size=batch_size, max_workers=max_workers)
+
+    ids = []
+    lexical_index = BM25Index()
+
+    def _tracked_chunks():
+        for chunk in iter_chunks(docs, chunk_size, chunk_overlap):
+            ids.append(chunk[0])
+            lexical_index.add(*chunk)
+            yield chunk
+
+    stats = pipeline.run(_tracked_chunks())
+    print(f"建库完成: {stats.as_dict()}")
+    save_manifest(db_path, _build_manifest(ids, chunk_size, chunk_overlap))
+    lexical_index.save(os.path.join(db_path, LEXICAL_INDEX_FILE))
+    # 库内容已变化，通知所有进程丢弃缓存的旧句柄
+    mark_vector_store_rebuilt(domain=domain, persist_dir=persist_dir)
     return db_path
+
+
+def sync_vector_store(
+    docs: Iterable[Dict[str, str]],
+    domain: str = "cs",
+    persist_dir: str = "./vector_db",
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    dry_run: bool = False,
+    batch_size: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    增量建库：只对新增/变化的 chunk 调用 embedding 并写入，删除已不存在的 chunk。
+    内容变化的 chunk 表现为"旧 id 删除 + 新 id 新增"。
+    dry_run=True 时只计算差异，不调用 embedding、不修改向量库。
+
+    返回: {"added": 新增数, "removed": 删除数, "unchanged": 未变化数, "total": 同步后总数}
+    """
+    db_path = os.path.join(persist_dir, domain)
+    if not os.path.exists(db_path):
+        if dry_run:
+            count = sum(1 for _ in iter_chunks(docs, chunk_size, chunk_overlap))
+            return {"added": count, "removed": 0, "unchanged": 0, "total": count}
+        build_vector_store(
+            docs, domain=domain, persist_dir=persist_dir,
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            batch_size=batch_size, max_workers=max_workers,
+        )
+        manifest = load_manifest(db_path) or {}
+        count = len(manifest.get("chunk_ids", []))
+        return {"added": count, "removed": 0, "unchanged": 0, "total": count}
+
+    vector_db = None
+    manifest = load_manifest(db_path)
+    if manifest is None:
+        # 旧版本建的库没有 manifest（id 是随机 uuid），以库中实际 id 为准，全部视为待删除
+        vector_db = get_vector_store(domain=domain, persist_dir=persist_dir)
+        existing_ids = set(vector_db.get(include=[])["ids"])
+    else:
+        existing_ids = set(manifest.get("chunk_ids", []))
+
+    reembed_all = manifest is not None and manifest.get("embedding_model") != EMBEDDING_MODEL
+    if reembed_all:
+        # 换了 embedding 模型，旧向量不可复用：id 相同也必须重新写入（upsert 覆盖）
+        print(f"⚠️ embedding 模型已变化（{manifest.get('embedding_model')} -> {EMBEDDING_MODEL}），全部重建")
+
+    # 单遍扫描：边切分边记录全部 id，只把需要 embedding 的 chunk 交给流水线
+    wanted = set()
+    lexical_index = BM25Index()
+
+    def _pending_chunks():
+        for chunk in iter_chunks(docs, chunk_size, chunk_overlap):
+            wanted.add(chunk[0])
+            lexical_index.add(*chunk)
+            if reembed_all or chunk[0] not in existing_ids:
+                yield chunk
+
+    if dry_run:
+        added = sum(1 for _ in _pending_chunks())
+    else:
+        if vector_db is None:
+            vector_db = get_vector_store(domain=domain, persist_dir=persist_dir)
+        pipeline = _make_ingest_pipeline(vector_db, batch_size=batch_size, max_workers=max_workers)
+        stats = pipeline.run(_pending_chunks())
+        added = stats.chunks
+        if added:
+            print(f"增量写入完成: {stats.as_dict()}")
+
+    to_remove = sorted(existing_ids - wanted)
+    delta = {
+        "added": added,
+        "removed": len(to_remove),
+        "unchanged": len(wanted) - added,
+        "total": len(wanted),
+    }
+    if dry_run:
+        return delta
+    lexical_path = os.path.join(db_path, LEXICAL_INDEX_FILE)
+    if not added and not to_remove and manifest is not None:
+        # 向量库无变化；旧版本建的库可能还没有词法索引，补建一次
+        if not os.path.exists(lexical_path):
+            lexical_index.save(lexical_path)
+        return delta
+
+    for start in range(0, len(to_remove), _DELETE_BATCH_SIZE):
+        vector_db.delete(ids=to_remove[start:start + _DELETE_BATCH_SIZE])
+
+    save_manifest(db_path, _build_manifest(sorted(wanted), chunk_size, chunk_overlap))
+    lexical_index.save(lexical_path)
+    mark_vector_store_rebuilt(domain=domain, persist_dir=persist_dir)
+    return delta
+
+
+def build_flat_index(
+    docs: Iterable[Dict[str, str]],
+    domain: str = "cs",
+    persist_dir: str = "./vector_db",
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    backend: str = "local",
+) -> Dict[str, int]:
+    """
+    用指定后端建 NumPy flat 索引（{persist_dir}/{domain}/flat_index），同时生成 BM25 词法索引。
+    本地后端向量化很快，每次都全量重建，不走 manifest 增量逻辑。
+    """
+    db_path = os.path.join(persist_dir, domain)
+    os.makedirs(db_path, exist_ok=True)
+    embeddings = get_embedding_backend(backend)
+    lexical_index = BM25Index()
+
+    def _tracked_chunks():
+        for chunk in iter_chunks(docs, chunk_size, chunk_overlap):
+            lexical_index.add(*chunk)
+            yield chunk
+
+    started = time.perf_counter()
+    index = FlatVectorIndex.build(
+        _tracked_chunks(),
+        embeddings,
+        info={
+            "backend": backend,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+    )
+    index.save(os.path.join(db_path, FLAT_INDEX_DIR))
+    lexical_index.save(os.path.join(db_path, LEXICAL_INDEX_FILE))
+    print(f"flat 索引构建完成: {len(index)} 条，维度 {index.dim}，耗时 {time.perf_counter() - started:.2f}s")
+    return {"total": len(index), "dim": index.dim}
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+RAG 推测式预取
+面试官的问题一确定（上一轮回复结束），就在后台用这个问题去检索；候选人还在说话/打字时检索已经完成。
+回答到达后做一次核对：预取结果覆盖了回答里足够多的关键词就直接复用（命中），
+否则用回答重新检索（未命中）。命中时本轮 LLM 调用前不再有检索等待。
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import RAG_PREFETCH_MIN_OVERLAP, RAG_PREFETCH_TIMEOUT
+from modules.lexical_index import tokenize
+from modules.rag_engine import RetrievalHit, retrieve
+from modules.tracing import submit_in_context
+
+# 解析结果
+HIT = "hit"            # 预取结果被复用
+MISS = "miss"          # 预取结果与回答不相关，重新检索
+STALE = "stale"        # 预取时的检索参数（领域、Top-K、模式）已变化
+FAILED = "failed"      # 预取出错或超时
+NO_PREFETCH = "none"   # 没有可用的预取（第一轮等）
+
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*[？?]")
+
+
+def extract_question(reply: str, max_chars: int = 200) -> str:
+    """
+    从面试官回复中取出最后两个问句作为检索词（追问常拆成两句："讲讲三次握手？为什么不是两次？"）；
+    没有问句时取回复末尾。
+    """
+    questions = [q.strip() for q in _SENTENCE_RE.findall(reply or "") if q.strip()]
+    if questions:
+        return "".join(questions[-2:])[-max_chars:]
+    return (reply or "").strip()[-max_chars:]
+
+
+def answer_coverage(answer: str, hits: List[RetrievalHit]) -> float:
+    """回答的关键词中有多大比例出现在预取到的片段里。"""
+    answer_terms = set(tokenize(answer))
+    if not answer_terms:
+        return 0.0
+    hit_terms = set()
+    for hit in hits:
+        hit_terms.update(tokenize(hit.text))
+    return len(answer_terms & hit_terms) / len(answer_terms)
+
+
+class RetrievalPrefetcher:
+    """
+    retrieve_fn: 检索函数，签名同 rag_engine.retrieve（测试时可替换）
+    min_overlap: 回答关键词覆盖率不低于该值时复用预取结果
+    timeout:     回答到达时最多等待进行中的预取多少秒
+    """
+
+    def __init__(
+        self,
+        retrieve_fn: Callable[..., List[RetrievalHit]] = retrieve,
+        min_overlap: float = RAG_PREFETCH_MIN_OVERLAP,
+        timeout: float = RAG_PREFETCH_TIMEOUT,
+    ):
+        self.retrieve_fn = retrieve_fn
+        self.min_overlap = min_overlap
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-prefetch")
+        self._lock = threading.Lock()
+        # (检索词, 检索参数, Future, 提交时间)
+        self._pending: Optional[Tuple[str, Dict, Future, float]] = None
+        self.counts: Dict[str, int] = {HIT: 0, MISS: 0, STALE: 0, FAILED: 0, NO_PREFETCH: 0}
+        self.cancelled = 0
+        # 命中时省下的检索耗时（秒）
+        self.saved_seconds = 0.0
+
+    def prefetch(self, interviewer_reply: str, **retrieve_kwargs) -> Optional[str]:
+        """面试官回复确定后调用：取出问句并在后台检索。返回使用的检索词。"""
+        query = extract_question(interviewer_reply)
+        if not query:
+            return None
+        self.cancel()
+
+        def _timed():
+            started = time.perf_counter()
+            hits = self.retrieve_fn(query, **retrieve_kwargs)
+            return hits, time.perf_counter() - started
+
+        with self._lock:
+            self._pending = (query, dict(retrieve_kwargs), submit_in_context(self._executor, _timed), time.monotonic())
+        return query
+
+    def cancel(self) -> None:
+        """取消进行中的预取；已在执行的检索无法中断，但结果会被丢弃。"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None and not pending[2].done():
+            pending[2].cancel()
+            self.cancelled += 1
+
+    def resolve(self, answer: str, **retrieve_kwargs) -> Tuple[List[RetrievalHit], str]:
+        """
+        候选人回答到达后调用，返回 (检索结果, 解析结果)。
+        预取命中时直接返回预取结果，否则用回答同步检索。
+        """
+        with self._lock:
+            pending, self._pending = self._pending, None
+
+        outcome = NO_PREFETCH
+        if pending is not None:
+            _, prefetch_kwargs, future, _ = pending
+            if prefetch_kwargs != retrieve_kwargs:
+                future.cancel()
+                outcome = STALE
+            else:
+                try:
+                    hits, elapsed = future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    future.cancel()
+                    outcome = FAILED
+                except Exception as e:
+                    print(f"⚠️ RAG 预取失败: {e}")
+                    outcome = FAILED
+                else:
+                    if hits and answer_coverage(answer, hits) >= self.min_overlap:
+                        self._record(HIT, elapsed)
+                        return hits, HIT
+                    outcome = MISS
+
+        self._record(outcome)
+        return self.retrieve_fn(answer, **retrieve_kwargs), outcome
+
+    def _record(self, outcome: str, saved: float = 0.0) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+            self.saved_seconds += saved
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = sum(self.counts.values())
+            return dict(
+                self.counts,
+                total=total,
+                cancelled=self.cancelled,
+                hit_rate=self.counts[HIT] / total if total else 0.0,
+                saved_seconds=round(self.saved_seconds, 3),
+            )
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+面试服务（api_server.py）的同步瘦客户端
+前端只负责采集输入和展示事件，对话状态、检索、LLM、TTS 都在服务端；配置 INTERVIEW_SERVICE_URL 后启用。
+"""
+
+import base64
+import json
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+
+from config import INTERVIEW_SERVICE_URL
+
+
+class InterviewServiceClient:
+    def __init__(self, base_url: str = INTERVIEW_SERVICE_URL, timeout: float = 120.0):
+        self.base_url = base_url.rstrip("/")
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+        )
+
+    def _check(self, response: httpx.Response) -> None:
+        if response.status_code < 400:
+            return
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = response.text
+        raise RuntimeError(f"面试服务返回 {response.status_code}: {detail}")
+
+    def create_session(self, persona: Optional[str] = None, rag: Optional[Dict[str, Any]] = None,
+                       tts: bool = True) -> str:
+        """rag 为 None 表示不检索。返回会话 ID。"""
+        response = self._client.post("/sessions", json={"persona": persona, "rag": rag, "tts": tts})
+        self._check(response)
+        return response.json()["session_id"]
+
+    def get_session(self, session_id: str) -> Dict[str, Any]:
+        response = self._client.get(f"/sessions/{session_id}")
+        self._check(response)
+        return response.json()
+
+    def update_session(self, session_id: str, persona: Optional[str] = None,
+                       rag: Optional[Dict[str, Any]] = None, tts: Optional[bool] = None) -> None:
+        """修改会话设置，参数为 None 的项不变；rag 为 {"enabled": False} 时关闭检索。"""
+        response = self._client.patch(
+            f"/sessions/{session_id}", json={"persona": persona, "rag": rag, "tts": tts}
+        )
+        self._check(response)
+
+    def close_session(self, session_id: str) -> None:
+        response = self._client.delete(f"/sessions/{session_id}")
+        if response.status_code != 404:
+            self._check(response)
+
+    def cancel(self, session_id: str) -> bool:
+        response = self._client.post(f"/sessions/{session_id}/cancel")
+        self._check(response)
+        return response.json()["cancelled"]
+
+    def turn(
+        self,
+        session_id: str,
+        text: Optional[str] = None,
+        audio: Optional[bytes] = None,
+        filename: str = "audio.wav",
+        persona: Optional[str] = None,
+        rag: Optional[Dict[str, Any]] = None,
+        tts: Optional[bool] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        进行一轮（文字或录音二选一），逐个产出事件 {"type", "data", "elapsed"}，最后一个是 done。
+        persona / rag / tts 非 None 时同时更新会话设置。
+        音频事件的 data["audio"] 已解码为 bytes。提前停止迭代会断开连接，服务端随之取消本轮。
+        """
+        if audio is not None:
+            # 录音接口的请求体是原始字节，会话设置单独提交
+            if persona is not None or rag is not None or tts is not None:
+                self.update_session(session_id, persona, rag, tts)
+            request = self._client.build_request(
+                "POST", f"/sessions/{session_id}/turns/audio",
+                params={"filename": filename}, content=audio,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        else:
+            request = self._client.build_request(
+                "POST", f"/sessions/{session_id}/turns",
+                json={"text": text, "persona": persona, "rag": rag, "tts": tts},
+            )
+        response = self._client.send(request, stream=True)
+        try:
+            if response.status_code >= 400:
+                response.read()
+                self._check(response)
+            for line in response.iter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "audio" and event["data"].get("audio"):
+                    event["data"]["audio"] = base64.b64decode(event["data"]["audio"])
+                yield event
+        finally:
+            response.close()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+_clients: Dict[str, InterviewServiceClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_service_client(base_url: str = INTERVIEW_SERVICE_URL) -> Optional[InterviewServiceClient]:
+    """同一服务地址复用一个客户端（连接池）；未配置服务地址时返回 None。"""
+    if not base_url:
+        return None
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = InterviewServiceClient(base_url)
+        return client
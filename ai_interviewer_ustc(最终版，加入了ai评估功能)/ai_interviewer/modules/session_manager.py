@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+多会话面试状态管理（与传输层无关，api_server.py 在其上提供 HTTP / WebSocket 接口）
+- 每个候选人一个 InterviewSession：历史、滚动摘要、人设、检索参数、推测检索词都在会话对象里，
+  不再依赖 st.session_state，一个进程可以同时服务多场面试
+- 所有会话共享同一组连接池：LLM 客户端、ASR 会话、TTS 客户端按事件循环复用（见 llm_client / audio_processor）
+- 背压：全局同时进行的轮次有上限，超出的排队；排队数或排队时间超限时立即拒绝，而不是无限堆积请求
+- 同一会话同一时间只允许一轮；空闲超时的会话被回收
+- 配置了 SessionStore 时每轮追加写入会话日志，被回收或服务重启后的会话按 ID 从日志恢复
+所有方法都应在同一个事件循环（服务进程的主循环）中调用。
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (
+    BASE_DIR,
+    SERVICE_MAX_CONCURRENT_TURNS,
+    SERVICE_MAX_PENDING_TURNS,
+    SERVICE_MAX_SESSIONS,
+    SERVICE_QUEUE_TIMEOUT,
+    SERVICE_SESSION_TTL,
+    STEPFUN_API_KEY,
+)
+from modules.audio_processor import TTS_async
+from modules.history_manager import ConversationMemory
+from modules.rag_engine import RETRIEVAL_MODES, retrieve
+from modules.rag_prefetch import extract_question
+from modules.session_store import SessionStore, get_session_store
+from modules.turn_pipeline import InterviewTurnPipeline, TurnHandle, TurnRequest, TurnResult
+
+DEFAULT_PERSONA = "你是一位专业、友善的技术面试官。你会根据候选人的回答进行追问，并给予简洁的反馈。每次回复保持简洁，2～4句话为宜。"
+# 服务端使用自己的知识库目录，不接受客户端传入的路径
+SERVICE_PERSIST_DIR = str(BASE_DIR / "vector_db")
+_RAG_OPTION_KEYS = ("domain", "k", "mode")
+
+
+class SessionNotFoundError(KeyError):
+    """会话不存在或已被回收。"""
+
+
+class SessionBusyError(RuntimeError):
+    """该会话上一轮还没有结束。"""
+
+
+class ServiceOverloadedError(RuntimeError):
+    """排队的轮次过多或排队超时，客户端应稍后重试。"""
+
+
+class TurnLimitReachedError(RuntimeError):
+    """本场面试已达到 MAX_CONVERSATION_TURNS 轮上限。"""
+
+
+class InvalidRequestError(ValueError):
+    """客户端传入的参数不合法（服务端映射为 400，其余 ValueError 仍按内部错误处理）。"""
+
+
+def normalize_rag_options(options: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """校验客户端传来的检索参数，只保留 domain / k / mode；None 或 {"enabled": false} 表示不检索。"""
+    if options is None:
+        return None
+    if not isinstance(options, dict):
+        raise InvalidRequestError("rag 参数必须是对象")
+    if options.get("enabled") is False:
+        return None
+    normalized = {key: options[key] for key in _RAG_OPTION_KEYS if options.get(key) is not None}
+    normalized.setdefault("domain", "cs")
+    try:
+        normalized["k"] = max(1, min(15, int(normalized.get("k", 6))))
+    except (TypeError, ValueError):
+        raise InvalidRequestError(f"k 必须是整数: {normalized.get('k')!r}") from None
+    if "mode" in normalized and normalized["mode"] not in RETRIEVAL_MODES:
+        raise InvalidRequestError(f"未知的检索模式: {normalized['mode']}，可选 {RETRIEVAL_MODES}")
+    domain = normalized["domain"]
+    if not isinstance(domain, str) or not domain or "/" in domain or "\\" in domain or domain.startswith("."):
+        raise InvalidRequestError(f"非法的知识库领域: {domain!r}")
+    return normalized
+
+
+class InterviewSession:
+    """一场面试的全部状态。"""
+
+    def __init__(self, persona: str, rag_options: Optional[Dict[str, Any]], tts_enabled: bool = True,
+                 session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.persona = persona
+        self.rag_options = rag_options
+        self.tts_enabled = tts_enabled
+        self.history: List[Dict[str, str]] = []
+        self.memory = ConversationMemory()
+        # 上一轮面试官的问题，下一轮与 ASR 并行做推测检索
+        self.speculative_query: Optional[str] = None
+        self.created = time.time()
+        self.last_active = time.monotonic()
+        self.turns = 0
+        self.current: Optional[TurnHandle] = None
+        self.last_result: Optional[TurnResult] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def snapshot(self, include_history: bool = True) -> Dict[str, Any]:
+        info = {
+            "session_id": self.session_id,
+            "persona": self.persona,
+            "rag": self.rag_options,
+            "tts": self.tts_enabled,
+            "turns": self.turns,
+            "busy": self.busy,
+            "created": self.created,
+            "idle_seconds": round(time.monotonic() - self.last_active, 1),
+            "memory": self.memory.stats(self.history),
+        }
+        if self.last_result is not None:
+            info["last_timings"] = self.last_result.timings
+        if include_history:
+            info["history"] = list(self.history)
+        return info
+
+
+class SessionManager:
+    """
+    asr / llm:          传给 InterviewTurnPipeline，None 时用默认实现（StepFun ASR、共享 LLM 客户端）
+    tts:                所有会话共享的异步 TTS 对象；None 时创建 TTS_async
+    retrieve_fn:        检索函数，签名同 rag_engine.retrieve
+    max_sessions:       会话数上限，满了先回收空闲超时的会话，仍然满则拒绝新会话
+    store:              会话日志；默认 get_session_store()，未启用持久化时为 None
+    max_concurrent_turns / max_pending_turns / queue_timeout: 背压参数，见 config.py
+    """
+
+    def __init__(
+        self,
+        asr=None,
+        llm=None,
+        tts=None,
+        retrieve_fn: Callable[..., list] = retrieve,
+        max_sessions: int = SERVICE_MAX_SESSIONS,
+        session_ttl: float = SERVICE_SESSION_TTL,
+        max_concurrent_turns: int = SERVICE_MAX_CONCURRENT_TURNS,
+        max_pending_turns: int = SERVICE_MAX_PENDING_TURNS,
+        queue_timeout: float = SERVICE_QUEUE_TIMEOUT,
+        store: Optional[SessionStore] = None,
+    ):
+        self.asr = asr
+        self.llm = llm
+        self.tts = tts if tts is not None else TTS_async(STEPFUN_API_KEY)
+        self.retrieve_fn = retrieve_fn
+        self.store = store if store is not None else get_session_store()
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_pending_turns = max_pending_turns
+        self.queue_timeout = queue_timeout
+        self._sessions: Dict[str, InterviewSession] = {}
+        # 会话表可能被监控接口从其他线程读取
+        self._lock = threading.Lock()
+        self._slots = asyncio.Semaphore(max_concurrent_turns)
+        self.max_concurrent_turns = max_concurrent_turns
+        self._running = 0
+        self._pending = 0
+        self.rejected = 0
+        self.completed = 0
+
+    # ---------- 会话 ----------
+    def create(self, persona: Optional[str] = None, rag_options: Optional[Dict[str, Any]] = None,
+               tts_enabled: bool = True) -> InterviewSession:
+        session = InterviewSession(persona or DEFAULT_PERSONA, normalize_rag_options(rag_options), tts_enabled)
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                self._evict_locked()
+            if len(self._sessions) >= self.max_sessions:
+                raise ServiceOverloadedError(f"会话数已达上限 {self.max_sessions}")
+            self._sessions[session.session_id] = session
+        self._persist_settings(session)
+        return session
+
+    def get(self, session_id: str) -> InterviewSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            session = self._resume(session_id)
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        return session
+
+    def _resume(self, session_id: str) -> Optional[InterviewSession]:
+        """从会话日志恢复已被回收（或服务重启前）的会话；没有日志时返回 None。"""
+        if self.store is None:
+            return None
+        try:
+            snapshot = self.store.load(session_id)
+        except ValueError:
+            return None
+        if snapshot is None:
+            return None
+        meta = snapshot.meta
+        session = InterviewSession(
+            meta.get("persona") or DEFAULT_PERSONA, meta.get("rag"), meta.get("tts", True), session_id
+        )
+        session.history = snapshot.history
+        session.turns = sum(1 for m in snapshot.history if m["role"] == "user")
+        if snapshot.created is not None:
+            session.created = snapshot.created
+        for message in reversed(snapshot.history):
+            if message["role"] == "assistant":
+                session.speculative_query = extract_question(message["content"])
+                break
+        session.memory.maybe_fold(session.history)
+        with self._lock:
+            # 并发恢复同一会话时以先放进表里的为准
+            existing = self._sessions.get(session_id)
+            if existing is not None:
+                return existing
+            if len(self._sessions) >= self.max_sessions:
+                self._evict_locked()
+            if len(self._sessions) >= self.max_sessions:
+                raise ServiceOverloadedError(f"会话数已达上限 {self.max_sessions}")
+            self._sessions[session_id] = session
+        return session
+
+    def _persist_settings(self, session: InterviewSession) -> None:
+        if self.store is not None:
+            self.store.set_meta(
+                session.session_id, persona=session.persona, rag=session.rag_options, tts=session.tts_enabled
+            )
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        if session.current is not None:
+            session.current.cancel()
+        # 日志保留在磁盘上（可按 ID 恢复或重新生成报告），只释放文件句柄
+        if self.store is not None:
+            self.store.close(session_id)
+
+    def _evict_locked(self) -> int:
+        now = time.monotonic()
+        expired = [
+            sid for sid, session in self._sessions.items()
+            if not session.busy and now - session.last_active > self.session_ttl
+        ]
+        for sid in expired:
+            self._sessions.pop(sid, None)
+            if self.store is not None:
+                self.store.close(sid)
+        return len(expired)
+
+    def evict_idle(self) -> int:
+        """回收空闲超时的会话，返回回收数量。"""
+        with self._lock:
+            return self._evict_locked()
+
+    def configure(self, session: InterviewSession, persona: Optional[str] = None,
+                  rag_options: Optional[Dict[str, Any]] = None, tts_enabled: Optional[bool] = None) -> None:
+        """更新会话设置，参数为 None 的项保持不变；rag_options 为 {"enabled": false} 时关闭检索。"""
+        before = (session.persona, session.rag_options, session.tts_enabled)
+        if persona is not None:
+            session.persona = persona
+        if rag_options is not None:
+            session.rag_options = normalize_rag_options(rag_options)
+        if tts_enabled is not None:
+            session.tts_enabled = tts_enabled
+        if (session.persona, session.rag_options, session.tts_enabled) != before:
+            self._persist_settings(session)
+
+    # ---------- 轮次 ----------
+    def _pipeline(self, session: InterviewSession) -> InterviewTurnPipeline:
+        retrieve_fn = None
+        if session.rag_options is not None:
+            retrieve_fn = partial(self.retrieve_fn, persist_dir=SERVICE_PERSIST_DIR, **session.rag_options)
+        return InterviewTurnPipeline(
+            asr=self.asr,
+            retrieve=retrieve_fn,
+            llm=self.llm,
+            tts=self.tts if session.tts_enabled else None,
+        )
+
+    async def _acquire_slot(self) -> None:
+        if self._pending >= self.max_pending_turns:
+            self.rejected += 1
+            raise ServiceOverloadedError(f"排队的轮次已达上限 {self.max_pending_turns}，请稍后重试")
+        self._pending += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ServiceOverloadedError(f"排队超过 {self.queue_timeout:.0f}s，请稍后重试") from None
+        finally:
+            self._pending -= 1
+        self._running += 1
+
+    def _release_slot(self) -> None:
+        self._running -= 1
+        self._slots.release()
+
+    async def start_turn(
+        self,
+        session: InterviewSession,
+        text: Optional[str] = None,
+        audio: Optional[bytes] = None,
+        audio_filename: str = "audio.wav",
+        persona: Optional[str] = None,
+        rag_options: Optional[Dict[str, Any]] = None,
+        tts_enabled: Optional[bool] = None,
+    ) -> TurnHandle:
+        """
+        开始一轮（文字或录音二选一），返回 TurnHandle。persona / rag_options / tts_enabled 非 None 时同时更新会话设置。
+        会话正忙抛 SessionBusyError；已达轮数上限抛 TurnLimitReachedError；服务过载抛 ServiceOverloadedError。
+        """
+        if text is None and audio is None:
+            raise InvalidRequestError("text 与 audio 至少提供一个")
+        if session.busy:
+            raise SessionBusyError("上一轮还没有结束")
+        # 与 Streamlit 本地模式一致：达到上限后只能生成报告或新开会话
+        if session.memory.turn_limit_reached(session.history):
+            raise TurnLimitReachedError(f"本场面试已达到 {session.memory.max_turns} 轮上限，请生成评价报告或新建会话")
+        self.configure(session, persona, rag_options, tts_enabled)
+
+        # 先占住会话，排队期间同一会话的重复提交直接被拒绝
+        session.current = TurnHandle()
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            session.current = None
+            raise
+
+        try:
+            summary, recent = session.memory.build_context(session.history)
+            request = TurnRequest(
+                history=recent,
+                persona=session.persona,
+                text=text,
+                audio=audio,
+                audio_filename=audio_filename,
+                summary=summary,
+                speculative_query=session.speculative_query,
+            )
+            handle = self._pipeline(session).start(request)
+        except BaseException:
+            # 轮次没能启动：归还名额并解除占用，否则之后该会话的每一轮都会被当作正忙
+            self._release_slot()
+            session.current = None
+            raise
+        session.current = handle
+        session.touch()
+        handle.task.add_done_callback(lambda task: self._finish_turn(session, task))
+        return handle
+
+    def _finish_turn(self, session: InterviewSession, task: asyncio.Task) -> None:
+        self._release_slot()
+        session.current = None
+        session.touch()
+        if task.cancelled():
+            return
+        result: TurnResult = task.result()
+        session.last_result = result
+        self.completed += 1
+        # 打断时也记下已生成的部分，与前端展示一致；出错或没有内容的轮次不进入历史
+        if result.error or not result.transcript or not result.reply:
+            return
+        session.history.append({"role": "user", "content": result.transcript})
+        session.history.append({"role": "assistant", "content": result.reply})
+        session.turns += 1
+        if self.store is not None:
+            try:
+                self.store.append_messages(session.session_id, session.history[-2:])
+            except OSError as e:
+                print(f"⚠️ 会话日志写入失败: {e}")
+        session.memory.maybe_fold(session.history)
+        session.speculative_query = extract_question(result.reply)
+
+    def cancel(self, session: InterviewSession) -> bool:
+        """打断会话当前的一轮；没有进行中的轮次时返回 False。"""
+        if session.current is None or session.current.task is None:
+            return False
+        session.current.cancel()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = len(self._sessions)
+        return {
+            "sessions": sessions,
+            "running_turns": self._running,
+            "pending_turns": self._pending,
+            "max_concurrent_turns": self.max_concurrent_turns,
+            "completed_turns": self.completed,
+            "rejected_turns": self.rejected,
+        }
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+面试会话持久化：每个会话一个只追加的 JSONL 日志
+- 每轮只在文件末尾追加几行（对话消息、检索记录、报告），不重写已有内容
+- 写入先进缓冲区，后台线程按时间间隔或条数批量 fsync；进程崩溃最多丢失最近一个刷盘间隔的记录
+- 读取时逐行回放，末尾被截断的半行直接跳过；按会话 ID 恢复历史、检索记录和报告
+- 被覆盖的记录（旧的会话设置、重新生成前的报告）累积到一定比例后压缩：写临时文件再原子替换
+- iter_history 逐条产出消息，报告可以直接从磁盘重新生成，不必把整段记录读进内存
+
+记录格式：{"type": "meta" | "message" | "rag" | "eval" | "report", "ts": 时间戳, ...}
+同一会话同一时间只应由一个进程写入。
+"""
+
+import atexit
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from config import (
+    SESSION_COMPACT_MIN_BYTES,
+    SESSION_COMPACT_RATIO,
+    SESSION_FSYNC_BATCH,
+    SESSION_FSYNC_INTERVAL,
+    SESSION_IDLE_CLOSE,
+    SESSION_STORE_DIR,
+    SESSION_STORE_ENABLED,
+)
+
+META = "meta"        # 会话设置（人设、检索参数等），后写的覆盖先写的
+MESSAGE = "message"  # 一条对话消息 {"role", "content"}
+RAG = "rag"          # 一轮检索记录，同 app_streamlit 的 rag_history 条目
+EVAL = "eval"        # 一轮回答的评分，同 turn_evaluator.TurnEvaluation 的字段
+REPORT = "report"    # 面试评价报告全文，后写的覆盖先写的
+
+# 只保留最后一条的记录类型，旧记录在压缩时丢弃
+_SUPERSEDED_TYPES = (META, REPORT)
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_SUFFIX = ".jsonl"
+
+
+@dataclass
+class SessionSnapshot:
+    """回放日志得到的会话内容。"""
+    session_id: str
+    meta: Dict[str, Any] = field(default_factory=dict)
+    history: List[Dict[str, str]] = field(default_factory=list)
+    rag_history: List[Dict[str, Any]] = field(default_factory=list)
+    evaluations: List[Dict[str, Any]] = field(default_factory=list)
+    report: str = ""
+    created: Optional[float] = None
+    updated: Optional[float] = None
+
+
+class _SessionLog:
+    """一个会话日志文件的写入端与体积统计；调用方需持有 SessionStore 的锁。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.total_bytes = 0
+        # 已被后续记录覆盖的字节数，压缩后可以回收
+        self.garbage_bytes = 0
+        self._last_size: Dict[str, int] = {}
+        self.pending = 0
+        self.last_write = time.monotonic()
+        if path.exists():
+            self._scan()
+        self._file = open(path, "a", encoding="utf-8", newline="\n")
+
+    def _scan(self) -> None:
+        complete = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                complete += len(raw)
+                record = _parse_line(raw)
+                self._account(record.get("type") if record else None, len(raw))
+        if complete < self.path.stat().st_size:
+            # 上次写到一半崩溃留下的半行：截掉，否则新记录会接在它后面
+            with open(self.path, "r+b") as f:
+                f.truncate(complete)
+
+    def _account(self, record_type: Optional[str], size: int) -> None:
+        self.total_bytes += size
+        if record_type in _SUPERSEDED_TYPES:
+            self.garbage_bytes += self._last_size.get(record_type, 0)
+            self._last_size[record_type] = size
+        elif record_type is None:
+            # 截断或损坏的行
+            self.garbage_bytes += size
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._account(record["type"], len(line.encode("utf-8")))
+        self.pending += 1
+        self.last_write = time.monotonic()
+
+    def flush(self, fsync: bool = True) -> None:
+        self._file.flush()
+        if fsync and self.pending:
+            os.fsync(self._file.fileno())
+            self.pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def _parse_line(raw: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        record = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return record if isinstance(record, dict) else None
+
+
+class SessionStore:
+    """
+    root:              日志目录，每个会话一个 <session_id>.jsonl
+    fsync_interval:    后台刷盘间隔（秒）
+    fsync_batch:       未刷盘的记录达到该条数时立即唤醒刷盘线程
+    compact_min_bytes / compact_ratio: 可回收字节数同时超过下限和占比时自动压缩
+    idle_close:        超过该秒数没有写入的日志由刷盘线程关闭文件句柄；0 表示不自动关闭
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path] = SESSION_STORE_DIR,
+        fsync_interval: float = SESSION_FSYNC_INTERVAL,
+        fsync_batch: int = SESSION_FSYNC_BATCH,
+        compact_min_bytes: int = SESSION_COMPACT_MIN_BYTES,
+        compact_ratio: float = SESSION_COMPACT_RATIO,
+        idle_close: float = SESSION_IDLE_CLOSE,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self.idle_close = idle_close
+        self._logs: Dict[str, _SessionLog] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._flusher: Optional[threading.Thread] = None
+        self.compactions = 0
+
+    # ---------- 路径与会话 ----------
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    def _path(self, session_id: str) -> Path:
+        # 会话 ID 可能来自 URL 参数，只允许字母数字、下划线和连字符
+        if not _SESSION_ID_RE.match(session_id or ""):
+            raise ValueError(f"非法的会话 ID: {session_id!r}")
+        return self.root / f"{session_id}{_SUFFIX}"
+
+    def exists(self, session_id: str) -> bool:
+        return self._path(session_id).exists()
+
+    def list_sessions(self) -> List[str]:
+        """按最近修改时间从新到旧列出会话 ID。"""
+        paths = sorted(self.root.glob(f"*{_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [p.stem for p in paths]
+
+    def delete(self, session_id: str) -> None:
+        path = self._path(session_id)
+        with self._lock:
+            log = self._logs.pop(session_id, None)
+            if log is not None:
+                log.close()
+            path.unlink(missing_ok=True)
+
+    # ---------- 写入 ----------
+    def _log_locked(self, session_id: str) -> _SessionLog:
+        log = self._logs.get(session_id)
+        if log is None:
+            log = self._logs[session_id] = _SessionLog(self._path(session_id))
+        return log
+
+    def append(self, session_id: str, records: Iterable[Dict[str, Any]]) -> None:
+        """追加若干条记录（每条需带 type），只写缓冲区，由后台线程批量刷盘。"""
+        now = time.time()
+        with self._lock:
+            log = self._log_locked(session_id)
+            for record in records:
+                log.write({"ts": now, **record})
+            pending = log.pending
+            needs_compaction = self._needs_compaction(log)
+        self._ensure_flusher()
+        if pending >= self.fsync_batch:
+            self._wake.set()
+        if needs_compaction:
+            self.compact(session_id)
+
+    def append_messages(self, session_id: str, messages: Iterable[Dict[str, str]]) -> None:
+        self.append(session_id, (
+            {"type": MESSAGE, "role": m.get("role", ""), "content": m.get("content", "")}
+            for m in messages
+        ))
+
+    def append_rag(self, session_id: str, item: Dict[str, Any]) -> None:
+        self.append(session_id, [{"type": RAG, "item": item}])
+
+    def append_eval(self, session_id: str, evaluation: Dict[str, Any]) -> None:
+        self.append(session_id, [{"type": EVAL, "evaluation": evaluation}])
+
+    def set_meta(self, session_id: str, **meta: Any) -> None:
+        """记录会话设置；只保存变化的部分，回放时逐条合并。"""
+        self.append(session_id, [{"type": META, "meta": meta}])
+
+    def set_report(self, session_id: str, report: str) -> None:
+        self.append(session_id, [{"type": REPORT, "report": report}])
+
+    # ---------- 刷盘 ----------
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None or self._stopped:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="session-store-fsync", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self._close_idle()
+            except OSError as e:
+                print(f"⚠️ 会话日志刷盘失败: {e}")
+
+    def _close_idle(self) -> None:
+        if self.idle_close <= 0:
+            return
+        deadline = time.monotonic() - self.idle_close
+        with self._lock:
+            for session_id, log in list(self._logs.items()):
+                if log.last_write < deadline:
+                    del self._logs[session_id]
+                    log.close()
+
+    def flush(self, session_id: Optional[str] = None, fsync: bool = True) -> None:
+        """把缓冲区写入文件；fsync=True 时同时落盘。session_id 为 None 表示全部会话。"""
+        with self._lock:
+            logs = [self._logs[session_id]] if session_id in self._logs else (
+                list(self._logs.values()) if session_id is None else []
+            )
+            for log in logs:
+                log.flush(fsync)
+
+    def close(self, session_id: Optional[str] = None) -> None:
+        """刷盘并关闭文件句柄；之后再写入会重新打开。session_id 为 None 时关闭全部并停止刷盘线程。"""
+        with self._lock:
+            if session_id is None:
+                logs, self._logs = list(self._logs.values()), {}
+            else:
+                log = self._logs.pop(session_id, None)
+                logs = [log] if log is not None else []
+            for log in logs:
+                log.close()
+        if session_id is None:
+            self._stopped = True
+            self._wake.set()
+
+    # ---------- 读取 ----------
+    def iter_records(self, session_id: str, types: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """按写入顺序逐条产出记录；types 用于筛选记录类型。末尾不完整的行被跳过。"""
+        path = self._path(session_id)
+        # 先把本进程缓冲区里的记录写进文件，读到的才是最新内容
+        self.flush(session_id, fsync=False)
+        if not path.exists():
+            return
+        wanted = set(types) if types is not None else None
+        with open(path, "rb") as f:
+            for raw in f:
+                record = _parse_line(raw)
+                if record is None:
+                    if raw.strip():
+                        print(f"⚠️ 跳过会话 {session_id} 中损坏的一行")
+                    continue
+                if wanted is None or record.get("type") in wanted:
+                    yield record
+
+    def iter_history(self, session_id: str) -> Iterator[Dict[str, str]]:
+        """逐条产出对话消息 {"role", "content"}，可直接传给 ai_report。"""
+        for record in self.iter_records(session_id, (MESSAGE,)):
+            yield {"role": record["role"], "content": record["content"]}
+
+    def load(self, session_id: str) -> Optional[SessionSnapshot]:
+        """回放整个日志恢复会话；会话不存在时返回 None。"""
+        if not self.exists(session_id):
+            return None
+        snapshot = SessionSnapshot(session_id)
+        for record in self.iter_records(session_id):
+            record_type = record.get("type")
+            if record_type == MESSAGE:
+                snapshot.history.append({"role": record["role"], "content": record["content"]})
+            elif record_type == RAG:
+                snapshot.rag_history.append(record["item"])
+            elif record_type == EVAL:
+                snapshot.evaluations.append(record["evaluation"])
+            elif record_type == META:
+                snapshot.meta.update(record["meta"])
+            elif record_type == REPORT:
+                snapshot.report = record["report"]
+            ts = record.get("ts")
+            if ts is not None:
+                snapshot.created = snapshot.created if snapshot.created is not None else ts
+                snapshot.updated = ts
+        return snapshot
+
+    # ---------- 压缩 ----------
+    def _needs_compaction(self, log: _SessionLog) -> bool:
+        return (
+            log.garbage_bytes >= self.compact_min_bytes
+            and log.garbage_bytes >= log.total_bytes * self.compact_ratio
+        )
+
+    def compact(self, session_id: str) -> bool:
+        """
+        去掉被覆盖的设置与报告、损坏的行，写入临时文件后原子替换原日志。
+        设置合并为一条，放在最前面；消息与检索记录保持原顺序。会话不存在时返回 False。
+        """
+        path = self._path(session_id)
+        with self._lock:
+            if not path.exists():
+                return False
+            log = self._logs.pop(session_id, None)
+            if log is not None:
+                log.close()
+            meta: Dict[str, Any] = {}
+            latest: Dict[str, Dict[str, Any]] = {}
+            # 合并后的设置排在最前，沿用整份日志最早的时间戳，回放时 created 仍是会话开始的时间
+            first_ts: Optional[float] = None
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as out:
+                    # 第一遍：合并设置、找出最后一份报告
+                    with open(path, "rb") as f:
+                        for raw in f:
+                            record = _parse_line(raw)
+                            if record is None:
+                                continue
+                            if first_ts is None and record.get("ts") is not None:
+                                first_ts = record["ts"]
+                            if record.get("type") == META:
+                                meta.update(record.get("meta", {}))
+                                latest[META] = record
+                            elif record.get("type") == REPORT:
+                                latest[REPORT] = record
+                    if META in latest:
+                        merged = {**latest[META], "meta": meta}
+                        if first_ts is not None:
+                            merged["ts"] = first_ts
+                        out.write(json.dumps(merged, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    # 第二遍：逐行拷贝消息与检索记录，不在内存中保留整段记录
+                    with open(path, "rb") as f:
+                        for raw in f:
+                            record = _parse_line(raw)
+                            if record is None or record.get("type") in _SUPERSEDED_TYPES:
+                                continue
+                            out.write(raw.decode("utf-8").rstrip("\n") + "\n")
+                    if REPORT in latest:
+                        out.write(json.dumps(latest[REPORT], ensure_ascii=False, separators=(",", ":")) + "\n")
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+            self.compactions += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_sessions": len(self._logs),
+                "pending_records": sum(log.pending for log in self._logs.values()),
+                "garbage_bytes": sum(log.garbage_bytes for log in self._logs.values()),
+                "compactions": self.compactions,
+            }
+
+
+_stores: Dict[str, SessionStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_session_store(root: Union[str, Path] = SESSION_STORE_DIR) -> Optional[SessionStore]:
+    """同一目录在进程内只建一个 SessionStore（同一会话只有一个写入端）；未启用持久化时返回 None。"""
+    if not SESSION_STORE_ENABLED:
+        return None
+    key = os.path.abspath(root)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SessionStore(root)
+            # 正常退出时把缓冲区里的记录落盘
+            atexit.register(store.close)
+        return store
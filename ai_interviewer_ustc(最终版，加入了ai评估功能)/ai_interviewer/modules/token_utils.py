@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Token 数估算
+不引入分词器依赖，按 Qwen 系列分词的经验比例估算：中日韩字符约 1 字 1 token，
+其余字符（英文、数字、标点、空白）约 4 个字符 1 token。用于检索片段打包、历史裁剪等预算控制，只需量级准确。
+"""
+
+import re
+from typing import Dict, Iterable
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+# 每条 chat 消息的固定开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def estimate_messages_tokens(messages: Iterable[Dict[str, str]]) -> int:
+    """估算一组 {"role", "content"} 消息的总 token 数。"""
+    return sum(
+        MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+        for message in messages
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """截断到大约 max_tokens 个 token 以内；未超出时原样返回。"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(suffix)
+    used, other = 0, 0
+    for i, ch in enumerate(text):
+        if _CJK_RE.match(ch):
+            used += 1
+        else:
+            other += 1
+            if other % 4 == 1:
+                used += 1
+        if used > budget:
+            return text[:i] + suffix
+    return text
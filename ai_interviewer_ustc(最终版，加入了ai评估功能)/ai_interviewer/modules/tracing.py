@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+轻量级耗时追踪
+span("名称") 上下文管理器 / @traced("名称") 装饰器记录一段代码的耗时：
+- 每个 span 的耗时进入进程内直方图（保留最近若干个样本），随时可查 p50 / p95 / p99
+- 流式函数（生成器）额外记录首个输出的耗时（TTFT）和之后的输出速率（tokens/s）
+- 一轮对话用 turn() 包起来，轮内的所有 span 组成这一轮的耗时分解，供界面展示；
+  当前轮次随 contextvars 传递，提交到线程池的任务用 submit_in_context 带上，拿不到上下文的 span 不归入任何一轮
+- 结束的 span 可逐行追加到 JSONL 文件；直方图可导出为 Prometheus 文本格式，也可以开一个 /metrics 端点
+只用标准库；TRACING_ENABLED = False 时装饰器只多一次布尔判断。
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config import TRACE_EXPORT_PATH, TRACE_MAX_SAMPLES, TRACING_ENABLED
+
+# 指标类型：span 耗时、流式首个输出耗时、输出速率
+DURATION = "duration_seconds"
+TTFT = "ttft_seconds"
+TOKENS_PER_SECOND = "tokens_per_second"
+
+QUANTILES = (0.5, 0.95, 0.99)
+PROMETHEUS_PREFIX = "ai_interviewer_span_"
+
+TokenCounter = Callable[[Any], int]
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start: float                      # 开始时间（time.time()）
+    duration: float = 0.0             # 秒
+    offset: float = 0.0               # 距所在轮开始的秒数；不在任何轮内时为 0
+    turn_id: Optional[str] = None
+    error: Optional[str] = None       # 抛出的异常类型名
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+
+class LatencyHistogram:
+    """保留最近 max_samples 个样本计算分位数，count / sum 为累计值。"""
+
+    def __init__(self, max_samples: int = TRACE_MAX_SAMPLES):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        # 最近秩法：不插值，取第 ceil(q * n) 个样本
+        index = min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.999999) - 1))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        stats = {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+        }
+        for q in QUANTILES:
+            stats[f"p{int(q * 100)}"] = round(self.percentile(q), 6)
+        return stats
+
+
+class TurnTrace:
+    """一轮对话内的全部 span，按结束顺序记录。"""
+
+    def __init__(self, turn_id: Optional[str] = None):
+        self.turn_id = turn_id or uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self._started_perf = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[SpanRecord] = []
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """按开始时间排序的耗时分解：[{name, offset, duration, error, attrs}]"""
+        return [
+            {
+                "name": record.name,
+                "offset": round(record.offset, 4),
+                "duration": round(record.duration, 4),
+                "error": record.error,
+                "attrs": record.attrs,
+            }
+            for record in sorted(self.spans, key=lambda r: r.offset)
+        ]
+
+
+_current_turn: contextvars.ContextVar = contextvars.ContextVar("trace_turn", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+class Tracer:
+    """
+    enabled:     关闭时 span / traced 不做任何记录
+    export_path: 每个结束的 span 追加一行 JSON 到该文件；为空时不写文件
+    max_samples: 每个指标保留的最近样本数
+    max_turns:   保留最近多少轮的耗时分解
+    """
+
+    def __init__(
+        self,
+        enabled: bool = TRACING_ENABLED,
+        export_path: Optional[str] = TRACE_EXPORT_PATH,
+        max_samples: int = TRACE_MAX_SAMPLES,
+        max_turns: int = 20,
+    ):
+        self.enabled = enabled
+        self.export_path = Path(export_path) if export_path else None
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        # (指标类型, span 名) -> 直方图
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._errors: Dict[str, int] = {}
+        self._turns: Deque[TurnTrace] = deque(maxlen=max_turns)
+
+    # ---------- 记录 ----------
+    def observe(self, metric: str, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get((metric, name))
+            if histogram is None:
+                histogram = self._histograms[(metric, name)] = LatencyHistogram(self.max_samples)
+            histogram.observe(value)
+
+    def _finish(self, record: SpanRecord, started_perf: float) -> None:
+        record.duration = time.perf_counter() - started_perf
+        turn = _current_turn.get()
+        if turn is not None:
+            record.turn_id = turn.turn_id
+            record.offset = started_perf - turn._started_perf
+        self.observe(DURATION, record.name, record.duration)
+        with self._lock:
+            if record.error:
+                self._errors[record.name] = self._errors.get(record.name, 0) + 1
+            if turn is not None:
+                turn.spans.append(record)
+        self._export(record)
+
+    def _export(self, record: SpanRecord) -> None:
+        if self.export_path is None:
+            return
+        line = json.dumps(asdict(record), ensure_ascii=False, default=str)
+        try:
+            with self._export_lock:
+                self.export_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ 追踪记录写入失败，已停止写文件: {e}")
+            self.export_path = None
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Optional[SpanRecord]]:
+        """
+        记录一段代码的耗时。with 语句拿到的 SpanRecord 可以补充属性：
+            with span("rag.retrieve", mode=mode) as s:
+                hits = ...
+                s.attrs["hits"] = len(hits)
+        追踪关闭时得到 None。
+        """
+        if not self.enabled:
+            yield None
+            return
+        record = SpanRecord(name, time.time(), attrs=attrs)
+        started = time.perf_counter()
+        token = _current_span.set(record)
+        try:
+            yield record
+        except BaseException as e:
+            _mark_exit(record, e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(record, started)
+
+    def start_turn(self, turn_id: Optional[str] = None) -> TurnTrace:
+        """
+        开始一轮并设为当前上下文的轮次；之后在这个上下文里（以及由它创建的 asyncio 任务、
+        经 submit_in_context 提交的线程池任务中）结束的 span 都归入这一轮，直到 end_turn。
+        一轮的各阶段不在同一个代码块里时（如 Streamlit 脚本中先识别语音、后生成回复）使用。
+        """
+        trace = TurnTrace(turn_id)
+        _current_turn.set(trace)
+        return trace
+
+    def end_turn(self, trace: TurnTrace) -> None:
+        if trace.duration is not None:
+            return
+        trace.duration = time.perf_counter() - trace._started_perf
+        if _current_turn.get() is trace:
+            _current_turn.set(None)
+        with self._lock:
+            self._turns.append(trace)
+        if self.enabled:
+            self.observe(DURATION, "turn", trace.duration)
+
+    @contextmanager
+    def turn(self, turn_id: Optional[str] = None) -> Iterator[TurnTrace]:
+        """一轮对话的范围；其中（包括由此创建的 asyncio 任务中）结束的 span 都归入这一轮。"""
+        trace = TurnTrace(turn_id)
+        token = _current_turn.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_turn.reset(token)
+            self.end_turn(trace)
+
+    # ---------- 装饰器 ----------
+    def traced(self, name: Optional[str] = None, tokens: Optional[TokenCounter] = None):
+        """
+        装饰同步/异步函数或（异步）生成器，记录每次调用的耗时；name 默认为 模块.函数名。
+        生成器从开始迭代算起，到耗尽、被关闭或出错为止；另记首个输出的耗时（TTFT）。
+        tokens: 生成器每个输出对应的 token 数（如只统计增量文本事件），提供时 TTFT 从第一个
+                token 数大于 0 的输出算起，并记录之后的输出速率（tokens/s）。
+        """
+
+        def decorator(func):
+            span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+            if inspect.isasyncgenfunction(func):
+                @functools.wraps(func)
+                async def async_gen_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        async for item in func(*args, **kwargs):
+                            yield item
+                        return
+                    stream = _StreamStats(self, span_name, tokens)
+                    try:
+                        async for item in func(*args, **kwargs):
+                            stream.item(item)
+                            yield item
+                    except BaseException as e:
+                        _mark_exit(stream.record, e)
+                        raise
+                    finally:
+                        stream.finish()
+                return async_gen_wrapper
+
+            if inspect.isgeneratorfunction(func):
+                @functools.wraps(func)
+                def gen_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        yield from func(*args, **kwargs)
+                        return
+                    stream = _StreamStats(self, span_name, tokens)
+                    try:
+                        for item in func(*args, **kwargs):
+                            stream.item(item)
+                            yield item
+                    except BaseException as e:
+                        _mark_exit(stream.record, e)
+                        raise
+                    finally:
+                        stream.finish()
+                return gen_wrapper
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    # ---------- 查询与导出 ----------
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """{span 名: {指标类型: {count, sum, mean, max, p50, p95, p99}}}"""
+        with self._lock:
+            result: Dict[str, Dict[str, Dict[str, float]]] = {}
+            for (metric, name), histogram in sorted(self._histograms.items(), key=lambda item: item[0][1]):
+                result.setdefault(name, {})[metric] = histogram.snapshot()
+            for name, errors in self._errors.items():
+                result.setdefault(name, {})["errors"] = {"count": errors}
+            return result
+
+    def last_turn(self) -> Optional[TurnTrace]:
+        with self._lock:
+            return self._turns[-1] if self._turns else None
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（summary 类型，分位数为最近样本窗口内的值）。"""
+        with self._lock:
+            by_metric: Dict[str, List[Tuple[str, LatencyHistogram]]] = {}
+            for (metric, name), histogram in sorted(self._histograms.items()):
+                by_metric.setdefault(metric, []).append((name, histogram))
+            errors = sorted(self._errors.items())
+
+            lines = []
+            for metric, series in by_metric.items():
+                family = PROMETHEUS_PREFIX + metric
+                lines.append(f"# TYPE {family} summary")
+                for name, histogram in series:
+                    label = _escape_label(name)
+                    for q in QUANTILES:
+                        lines.append(f'{family}{{span="{label}",quantile="{q}"}} {histogram.percentile(q):.6f}')
+                    lines.append(f'{family}_sum{{span="{label}"}} {histogram.total:.6f}')
+                    lines.append(f'{family}_count{{span="{label}"}} {histogram.count}')
+            if errors:
+                family = PROMETHEUS_PREFIX + "errors_total"
+                lines.append(f"# TYPE {family} counter")
+                for name, count in errors:
+                    lines.append(f'{family}{{span="{_escape_label(name)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+            self._turns.clear()
+
+
+class _StreamStats:
+    """生成器 span 的统计：首个输出耗时、token 数、输出速率。"""
+
+    def __init__(self, tracer: Tracer, name: str, tokens: Optional[TokenCounter]):
+        self.tracer = tracer
+        self.tokens = tokens
+        self.record = SpanRecord(name, time.time())
+        self.started = time.perf_counter()
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self.first_count = 0
+        self.token_count = 0
+
+    def item(self, item: Any) -> None:
+        count = self.tokens(item) if self.tokens is not None else 1
+        if count <= 0:
+            return
+        self.last = time.perf_counter()
+        if self.first is None:
+            self.first, self.first_count = self.last, count
+        self.token_count += count
+
+    def finish(self) -> None:
+        attrs = self.record.attrs
+        if self.first is not None:
+            ttft = self.first - self.started
+            attrs["ttft"] = round(ttft, 4)
+            self.tracer.observe(TTFT, self.record.name, ttft)
+            if self.tokens is not None:
+                attrs["tokens"] = self.token_count
+                # 输出速率只看首个 token 之后：第一个输出之后的 token 数 / 第一个到最后一个输出的间隔
+                generating = self.last - self.first
+                if generating > 0:
+                    rate = (self.token_count - self.first_count) / generating
+                    attrs["tokens_per_sec"] = round(rate, 1)
+                    self.tracer.observe(TOKENS_PER_SECOND, self.record.name, rate)
+        self.tracer._finish(self.record, self.started)
+
+
+def _mark_exit(record: SpanRecord, exc: BaseException) -> None:
+    # 消费方提前停止迭代、任务被取消（如候选人打断）不算错误
+    if isinstance(exc, GeneratorExit):
+        record.attrs["closed"] = True
+    elif isinstance(exc, asyncio.CancelledError):
+        record.attrs["cancelled"] = True
+    else:
+        record.error = type(exc).__name__
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# ==================== 默认追踪器 ====================
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **attrs):
+    return _tracer.span(name, **attrs)
+
+
+def traced(name: Optional[str] = None, tokens: Optional[TokenCounter] = None):
+    return _tracer.traced(name, tokens=tokens)
+
+
+def annotate(**attrs) -> None:
+    """给当前 span（最内层的 with span / 被 traced 的普通函数）补充属性；不在 span 内时忽略。"""
+    record = _current_span.get()
+    if record is not None:
+        record.attrs.update(attrs)
+
+
+def turn(turn_id: Optional[str] = None):
+    return _tracer.turn(turn_id)
+
+
+def submit_in_context(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """executor.submit 的替代：任务在提交方 contextvars 的副本中运行，其中的 span 归入提交方所在的轮次。"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# ==================== Prometheus 端点 ====================
+_servers: Dict[int, ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", tracer: Optional[Tracer] = None) -> ThreadingHTTPServer:
+    """在后台线程中提供 GET /metrics（Prometheus 文本格式）；同一端口重复调用返回已有的服务。"""
+    tracer = tracer or _tracer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = tracer.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            server = _servers[port] = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
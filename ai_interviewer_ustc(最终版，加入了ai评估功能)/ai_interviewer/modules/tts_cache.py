@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+TTS 音频缓存
+按 (归一化文本, 模型, 音色, 音量) 的哈希做内容寻址，把合成好的 mp3 存在磁盘上。
+面试官反复说的开场白、过渡句（"回答得很好。"、"没关系…"）命中缓存后不再请求 StepFun。
+总大小超过上限时按最近使用时间淘汰；写入先落临时文件再原子替换，读到的永远是完整文件。
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_SUFFIX = ".mp3"
+
+
+def normalize_tts_text(text: str) -> str:
+    """全半角统一（NFKC）+ 合并连续空白，朗读效果相同的文本共用一条缓存。"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class TTSAudioCache:
+    """
+    cache_dir: 缓存目录
+    max_bytes: 缓存总大小上限，超过后淘汰最久未使用的文件
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 200 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> 文件大小，按最近使用时间从旧到新排列
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    @staticmethod
+    def make_key(text: str, model: str, voice: str, volume: float = 1.0) -> str:
+        payload = json.dumps(
+            [normalize_tts_text(text), model, voice, float(volume)], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{_SUFFIX}"
+
+    def _load_index(self) -> None:
+        # 启动时按修改时间恢复 LRU 顺序（命中时会 touch 文件）
+        entries = []
+        for path in self.cache_dir.glob(f"*{_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # 其他进程写入的文件
+                self._index[key] = len(data)
+                self._total_bytes += len(data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not data:
+            return
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"⚠️ TTS 缓存写入失败: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+            }
+
+
+_shared_caches: Dict[str, TTSAudioCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_tts_cache(cache_dir: Union[str, Path], max_bytes: int) -> TTSAudioCache:
+    """同一缓存目录在进程内只建一个索引。"""
+    key = os.path.abspath(cache_dir)
+    with _shared_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = _shared_caches[key] = TTSAudioCache(cache_dir, max_bytes)
+        return cache
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+逐轮面试评分
+每轮结束后在后台给候选人的这次回答打分：各评价维度 0~10 分 + 一句话评语、亮点、不足。
+结果按 (问题, 回答) 的哈希缓存，同一轮不会重复评分；面试结束时报告只需汇总这些紧凑的逐轮结果
+（见 ai_report.ai_report_from_evaluations_stream_events），不必把整段对话交给思考模式重新阅读。
+"""
+
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import (
+    DASHSCOPE_API_KEY,
+    REPORT_EVAL_WAIT_TIMEOUT,
+    REPORT_TURN_EVAL_MAX_TOKENS,
+    REPORT_TURN_EVAL_MODEL,
+    REPORT_TURN_EVAL_WORKERS,
+)
+from modules.llm_client import create_chat_completion
+from modules.token_utils import truncate_to_tokens
+from modules.tracing import submit_in_context, traced
+
+# 评价维度与权重（满分 100），与 ai_report.REPORT_SYSTEM_PROMPT 一致
+REPORT_DIMENSIONS: List[Tuple[str, int]] = [
+    ("技术能力", 30),
+    ("问题解决能力", 25),
+    ("沟通表达能力", 20),
+    ("学习潜力与思维深度", 15),
+    ("综合素养", 10),
+]
+
+TURN_EVAL_SYSTEM_PROMPT = """你是一位资深的技术面试评审专家。下面是一场技术面试中的一轮：面试官的问题和候选人的回答。
+只评价这一轮回答，按以下维度各给 0~10 分，本轮回答没有体现的维度给 null：
+{dimensions}
+
+只输出一个 JSON 对象，不要输出其他内容：
+{{"scores": {{"维度名": 分数, ...}}, "notes": "本轮要点，答对/答错了什么，不超过 60 字", "highlight": "亮点，没有则为空字符串", "weakness": "不足，没有则为空字符串"}}"""
+
+# 逐轮结果里每段文字的长度上限（token），保证汇总时每轮只占很小的篇幅
+_NOTE_MAX_TOKENS = 80
+_JSON_RE = re.compile(r"\{.*\}", re.S)
+
+_executor = ThreadPoolExecutor(max_workers=REPORT_TURN_EVAL_WORKERS, thread_name_prefix="turn-eval")
+
+Scorer = Callable[[str, str], str]
+
+
+@dataclass
+class TurnEvaluation:
+    turn: int                                   # 第几轮（从 1 开始）
+    question: str                               # 面试官的问题；第一轮可能为空
+    answer: str                                 # 候选人的回答
+    scores: Dict[str, Optional[float]] = field(default_factory=dict)  # 维度 -> 0~10 分，None 表示未体现
+    notes: str = ""
+    highlight: str = ""
+    weakness: str = ""
+    error: Optional[str] = None                 # 评分失败的原因；失败的轮次不计入得分
+    key: str = ""                               # (问题, 回答) 的哈希，用作缓存 key
+
+
+def turn_key(question: str, answer: str) -> str:
+    return hashlib.sha1(f"{question}\0{answer}".encode("utf-8")).hexdigest()
+
+
+def iter_turns(history: Iterable[Dict[str, str]]) -> Iterator[Tuple[int, str, str]]:
+    """逐个产出 (轮次, 面试官问题, 候选人回答)；问题取该回答之前最近的一条面试官消息。"""
+    question = ""
+    turn = 0
+    for message in history:
+        content = (message.get("content") or "").strip()
+        if message.get("role") == "assistant":
+            question = content
+        elif message.get("role") == "user" and content:
+            turn += 1
+            yield turn, question, content
+
+
+def llm_score_turn(question: str, answer: str) -> str:
+    """默认评分器：调用 LLM 给一轮回答打分，返回模型输出的 JSON 文本。"""
+    dimensions = "\n".join(f"- {name}" for name, _ in REPORT_DIMENSIONS)
+    response = create_chat_completion(
+        api_key=DASHSCOPE_API_KEY,
+        model=REPORT_TURN_EVAL_MODEL,
+        messages=[
+            {"role": "system", "content": TURN_EVAL_SYSTEM_PROMPT.format(dimensions=dimensions)},
+            {"role": "user", "content": f"面试官：{question or '（开场）'}\n候选人：{answer}"},
+        ],
+        max_tokens=REPORT_TURN_EVAL_MAX_TOKENS,
+        temperature=0.2,
+        response_format={"type": "json_object"},
+    )
+    return response.choices[0].message.content or ""
+
+
+def _clamp_score(value: Any) -> Optional[float]:
+    try:
+        return max(0.0, min(10.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_evaluation(text: str) -> Dict[str, Any]:
+    """解析评分器输出的 JSON（允许前后夹杂文字或代码块标记），分数截断到 0~10。解析失败抛 ValueError。"""
+    match = _JSON_RE.search(text or "")
+    if match is None:
+        raise ValueError(f"评分结果不是 JSON: {text[:80]!r}")
+    data = json.loads(match.group(0))
+    raw_scores = data.get("scores") or {}
+    return {
+        "scores": {name: _clamp_score(raw_scores.get(name)) for name, _ in REPORT_DIMENSIONS},
+        "notes": truncate_to_tokens(str(data.get("notes") or "").strip(), _NOTE_MAX_TOKENS),
+        "highlight": truncate_to_tokens(str(data.get("highlight") or "").strip(), _NOTE_MAX_TOKENS),
+        "weakness": truncate_to_tokens(str(data.get("weakness") or "").strip(), _NOTE_MAX_TOKENS),
+    }
+
+
+def aggregate_scores(evaluations: Iterable[TurnEvaluation]) -> Dict[str, Any]:
+    """
+    按权重把逐轮分数换算成百分制参考分：每个维度取各轮平均分（0~10）乘以 权重/10。
+    所有轮次都没有体现的维度，按其他维度的平均水平计。
+    """
+    totals: Dict[str, List[float]] = {name: [] for name, _ in REPORT_DIMENSIONS}
+    scored_turns = 0
+    for evaluation in evaluations:
+        if evaluation.error:
+            continue
+        scored_turns += 1
+        for name, value in evaluation.scores.items():
+            if value is not None and name in totals:
+                totals[name].append(value)
+    means = {name: sum(values) / len(values) for name, values in totals.items() if values}
+    fallback = sum(means.values()) / len(means) if means else 0.0
+    dimensions = {
+        name: round(means.get(name, fallback) * weight / 10, 1) for name, weight in REPORT_DIMENSIONS
+    }
+    return {
+        "scored_turns": scored_turns,
+        "dimensions": dimensions,
+        "overall": round(sum(dimensions.values())),
+    }
+
+
+class IncrementalEvaluator:
+    """
+    scorer:  (面试官问题, 候选人回答) -> 评分 JSON 文本；默认调用 LLM
+    每轮结束后调用 submit(history)，只有还没评过的轮次会提交到后台；生成报告前调用 results(history)。
+    """
+
+    def __init__(self, scorer: Optional[Scorer] = None):
+        self.scorer = scorer or llm_score_turn
+        self._cache: Dict[str, TurnEvaluation] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        # reset 后仍在运行的旧任务按代数丢弃结果
+        self._generation = 0
+
+    def _evaluate(self, turn: int, question: str, answer: str, key: str, generation: int,
+                  on_result: Optional[Callable[[TurnEvaluation], None]]) -> TurnEvaluation:
+        evaluation = TurnEvaluation(turn, question, answer, key=key)
+        try:
+            parsed = parse_evaluation(self._score(question, answer))
+            evaluation.scores = parsed["scores"]
+            evaluation.notes = parsed["notes"]
+            evaluation.highlight = parsed["highlight"]
+            evaluation.weakness = parsed["weakness"]
+        except Exception as e:
+            print(f"⚠️ 第 {turn} 轮评分失败: {e}")
+            evaluation.error = str(e)
+        with self._lock:
+            if generation != self._generation:
+                return evaluation
+            self._pending.pop(key, None)
+            # 失败的轮次不进缓存，下次 submit 时重试
+            if evaluation.error is None:
+                self._cache[key] = evaluation
+        if on_result is not None and evaluation.error is None:
+            try:
+                on_result(evaluation)
+            except Exception as e:
+                print(f"⚠️ 保存第 {turn} 轮评分失败: {e}")
+        return evaluation
+
+    @traced("report.score_turn")
+    def _score(self, question: str, answer: str) -> str:
+        return self.scorer(question, answer)
+
+    def submit(self, history: Iterable[Dict[str, str]],
+               on_result: Optional[Callable[[TurnEvaluation], None]] = None) -> int:
+        """
+        把还没有评分的轮次提交到后台，返回新提交的轮次数。on_result(evaluation) 在评分成功后于后台线程调用，
+        可用于持久化。
+        """
+        return self._submit_turns(iter_turns(history), on_result)
+
+    def _submit_turns(self, turns: Iterable[Tuple[int, str, str]],
+                      on_result: Optional[Callable[[TurnEvaluation], None]]) -> int:
+        submitted = 0
+        with self._lock:
+            for turn, question, answer in turns:
+                key = turn_key(question, answer)
+                if key in self._cache or key in self._pending:
+                    continue
+                self._pending[key] = submit_in_context(
+                    _executor, self._evaluate, turn, question, answer, key, self._generation, on_result
+                )
+                submitted += 1
+        return submitted
+
+    def results(self, history: Iterable[Dict[str, str]], timeout: Optional[float] = REPORT_EVAL_WAIT_TIMEOUT,
+                on_result: Optional[Callable[[TurnEvaluation], None]] = None) -> List[TurnEvaluation]:
+        """
+        返回每一轮的评分（按轮次排序）。漏评或上次失败的轮次先补交，再最多等待 timeout 秒；
+        仍未完成或失败的轮次以带 error 的 TurnEvaluation 返回。
+        """
+        turns = list(iter_turns(history))
+        self._submit_turns(turns, on_result)
+        with self._lock:
+            pending = [self._pending[k] for k in (turn_key(q, a) for _, q, a in turns) if k in self._pending]
+        if pending:
+            wait(pending, timeout=timeout)
+        evaluations = []
+        with self._lock:
+            for turn, question, answer in turns:
+                key = turn_key(question, answer)
+                cached = self._cache.get(key)
+                if cached is not None:
+                    # 同样的问答出现在不同轮次时，轮次号以当前历史为准
+                    evaluations.append(cached if cached.turn == turn else TurnEvaluation(**{**asdict(cached), "turn": turn}))
+                else:
+                    reason = "评分超时" if key in self._pending else "评分失败"
+                    evaluations.append(TurnEvaluation(turn, question, answer, error=reason, key=key))
+        return evaluations
+
+    def load(self, evaluations: Iterable[Dict[str, Any]]) -> None:
+        """恢复已保存的逐轮评分（asdict(TurnEvaluation) 的列表），恢复后的轮次不再重新评分。"""
+        with self._lock:
+            for data in evaluations:
+                evaluation = TurnEvaluation(**data)
+                if evaluation.error is None:
+                    self._cache[evaluation.key or turn_key(evaluation.question, evaluation.answer)] = evaluation
+
+    def reset(self) -> None:
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._cache.clear()
+            self._pending.clear()
+            self._generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"scored": len(self._cache), "pending": len(self._pending)}
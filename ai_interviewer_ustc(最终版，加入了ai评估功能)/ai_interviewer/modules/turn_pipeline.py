@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+单轮面试流水线（与界面无关）
+一轮 = 语音识别 -> 知识库检索 -> LLM 生成 -> 语音合成。各阶段在 asyncio 中按数据依赖尽量并行：
+- 提供了推测检索词（上一轮面试官的问题）时，检索与 ASR 同时进行，识别结果出来后再核对是否可复用
+- LLM 每生成完一句就提交 TTS，合成与生成重叠；音频按句子顺序推送
+- 每个阶段的中间结果（识别文本、检索结果、增量文本、整句、音频）实时推送给订阅方
+- 候选人打断时可随时取消，进行中的 LLM 流与 TTS 任务一并取消
+- 记录每个阶段的耗时（相对本轮开始的秒数）
+
+Streamlit / Gradio / CLI 都可以复用：异步代码直接 await；同步代码用 iter_turn_events 在后台事件循环中运行并逐个取事件。
+"""
+
+import asyncio
+import queue
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from config import LLM_API_KEY, LLM_MODEL, RAG_PREFETCH_MIN_OVERLAP, STEPFUN_API_KEY
+from modules.async_runtime import get_background_loop
+from modules.audio_processor import IncrementalSentenceSegmenter, audio_bytes_to_text
+from modules.llm_client import acreate_chat_completion
+from modules.llm_stream import DELTA, ERROR, USAGE, StreamEvent, aiter_completion_events, event_tokens
+from modules.prompt_builder import build_chat_messages
+from modules.rag_engine import RetrievalHit, format_hits_for_prompt
+from modules.rag_prefetch import answer_coverage
+from modules.tracing import traced
+from modules.tracing import turn as trace_turn
+
+# 事件类型
+TRANSCRIPT = "transcript"   # data: 识别出的文本
+CONTEXT = "context"         # data: List[RetrievalHit]
+TEXT_DELTA = "delta"        # data: LLM 增量文本
+SENTENCE = "sentence"       # data: (句子序号, 句子)
+AUDIO = "audio"             # data: (句子序号, mp3 字节或 None)
+WARNING = "warning"         # data: 非致命错误说明（检索失败等）
+DONE = "done"               # data: TurnResult，每轮最后一个事件（包括出错和取消）
+
+AsrFn = Callable[[bytes, str], Awaitable[Optional[str]]]
+RetrieveFn = Callable[[str], List[RetrievalHit]]
+LlmFn = Callable[[List[Dict[str, str]]], AsyncIterator[StreamEvent]]
+
+
+@dataclass
+class TurnEvent:
+    type: str
+    data: Any = None
+    elapsed: float = 0.0  # 距本轮开始的秒数
+
+
+@dataclass
+class TurnRequest:
+    history: List[Dict[str, str]]             # 原文发送的历史消息
+    persona: str = ""                         # 面试官人设
+    text: Optional[str] = None                # 文字输入；与 audio 二选一
+    audio: Optional[bytes] = None             # 录音字节
+    audio_filename: str = "audio.wav"
+    summary: str = ""                         # 较早轮次的滚动摘要
+    speculative_query: Optional[str] = None   # 推测检索词，通常是上一轮面试官的问题
+
+
+@dataclass
+class TurnResult:
+    transcript: str = ""
+    reply: str = ""
+    hits: List[RetrievalHit] = field(default_factory=list)
+    audio: List[Optional[bytes]] = field(default_factory=list)
+    usage: Optional[Dict[str, Any]] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    speculative: Optional[str] = None         # 推测检索结果：hit / miss / None（未使用）
+    cancelled: bool = False
+    error: Optional[str] = None
+
+
+@traced("llm.chat", tokens=event_tokens)
+async def default_llm(messages: List[Dict[str, str]]) -> AsyncIterator[StreamEvent]:
+    stream = await acreate_chat_completion(
+        api_key=LLM_API_KEY,
+        model=LLM_MODEL,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        async for event in aiter_completion_events(stream):
+            yield event
+    finally:
+        # 提前停止迭代（打断）时立即关闭连接、归还并发名额，不等垃圾回收
+        await stream.close()
+
+
+async def default_asr(audio: bytes, filename: str) -> Optional[str]:
+    return await audio_bytes_to_text(audio, STEPFUN_API_KEY, filename=filename)
+
+
+class TurnHandle:
+    """一轮的运行句柄：events() 订阅事件，cancel() 打断，result() 等待最终结果。"""
+
+    def __init__(self):
+        self._queues: List[asyncio.Queue] = []
+        self._history: List[TurnEvent] = []
+        self._closed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def _emit(self, event: TurnEvent) -> None:
+        self._history.append(event)
+        for q in self._queues:
+            q.put_nowait(event)
+        if event.type == DONE:
+            self._closed = True
+
+    async def events(self) -> AsyncIterator[TurnEvent]:
+        """订阅本轮事件；晚订阅的一方也会先收到之前已发生的事件，直到 DONE 为止。"""
+        q: asyncio.Queue = asyncio.Queue()
+        for event in self._history:
+            q.put_nowait(event)
+        if not self._closed:
+            self._queues.append(q)
+        try:
+            while True:
+                event = await q.get()
+                yield event
+                if event.type == DONE:
+                    return
+        finally:
+            if q in self._queues:
+                self._queues.remove(q)
+
+    def cancel(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    async def result(self) -> TurnResult:
+        return await self.task
+
+
+class InterviewTurnPipeline:
+    """
+    asr:             async (音频字节, 文件名) -> 文本；默认 StepFun ASR
+    retrieve:        同步 (检索词) -> List[RetrievalHit]，在线程池中执行；为 None 时不检索
+    llm:             async (messages) -> StreamEvent 异步迭代器；默认共享 LLM 客户端
+    tts:             带 async synthesize(text) -> bytes 的对象（如 TTS_async）；为 None 时不合成语音
+    format_context:  检索结果 -> 拼入 prompt 的文本
+    tts_concurrency: 同时进行的 TTS 请求数
+    speculative_min_overlap: 推测检索结果覆盖回答关键词的比例不低于该值时复用
+    """
+
+    def __init__(
+        self,
+        asr: Optional[AsrFn] = None,
+        retrieve: Optional[RetrieveFn] = None,
+        llm: Optional[LlmFn] = None,
+        tts=None,
+        format_context: Callable[[List[RetrievalHit]], str] = format_hits_for_prompt,
+        tts_concurrency: int = 3,
+        speculative_min_overlap: float = RAG_PREFETCH_MIN_OVERLAP,
+    ):
+        self.asr = asr or default_asr
+        self.retrieve = retrieve
+        self.llm = llm or default_llm
+        self.tts = tts
+        self.format_context = format_context
+        self.tts_concurrency = tts_concurrency
+        self.speculative_min_overlap = speculative_min_overlap
+
+    def start(self, request: TurnRequest) -> TurnHandle:
+        """在当前事件循环中启动一轮，立即返回句柄。"""
+        handle = TurnHandle()
+        handle.task = asyncio.get_running_loop().create_task(self._run(request, handle))
+        return handle
+
+    async def run(self, request: TurnRequest) -> TurnResult:
+        return await self.start(request).result()
+
+    async def _run(self, request: TurnRequest, handle: TurnHandle) -> TurnResult:
+        # 本轮各阶段的 span（ASR、检索、LLM、TTS）归入同一轮的耗时分解
+        with trace_turn():
+            return await self._run_turn(request, handle)
+
+    async def _run_turn(self, request: TurnRequest, handle: TurnHandle) -> TurnResult:
+        started = time.perf_counter()
+        result = TurnResult()
+
+        def now() -> float:
+            return round(time.perf_counter() - started, 4)
+
+        def emit(event_type: str, data: Any = None) -> None:
+            handle._emit(TurnEvent(event_type, data, now()))
+
+        speculative_task = None
+        deliver_task = None
+        tts_tasks: List[asyncio.Task] = []
+        parts: List[str] = []
+        try:
+            # 1. ASR 与推测检索并行
+            if self.retrieve is not None and request.speculative_query:
+                speculative_task = asyncio.create_task(asyncio.to_thread(self.retrieve, request.speculative_query))
+
+            if request.audio is not None:
+                transcript = await self.asr(request.audio, request.audio_filename)
+                result.timings["asr"] = now()
+                if not transcript:
+                    raise RuntimeError("语音识别失败或没有识别到内容")
+            else:
+                transcript = (request.text or "").strip()
+            result.transcript = transcript
+            emit(TRANSCRIPT, transcript)
+
+            # 2. 检索：推测结果与回答相关则直接复用，否则用回答重新检索
+            result.hits = await self._resolve_hits(transcript, speculative_task, result, emit)
+            speculative_task = None
+            result.timings["retrieval"] = now()
+            if result.hits:
+                emit(CONTEXT, result.hits)
+            context = self.format_context(result.hits) if result.hits else ""
+
+            # 3. LLM 流式生成，整句交给 TTS 并发合成
+            messages = build_chat_messages(
+                request.persona, request.history, transcript, context=context, summary=request.summary
+            )
+            segmenter = IncrementalSentenceSegmenter()
+            tts_slots = asyncio.Semaphore(self.tts_concurrency)
+            # 按提交顺序排队的合成任务，None 表示没有更多句子
+            pending_audio: asyncio.Queue = asyncio.Queue()
+
+            def submit_sentence(sentence: str) -> None:
+                emit(SENTENCE, (len(tts_tasks), sentence))
+                task = asyncio.create_task(self._synthesize(sentence, tts_slots)) if self.tts is not None else None
+                tts_tasks.append(task)
+                pending_audio.put_nowait(task)
+
+            async def deliver_audio():
+                # 按句子顺序推送：第 i 句合成完、且前面的句子都已推送后立即推送
+                index = 0
+                while True:
+                    task = await pending_audio.get()
+                    if task is None:
+                        return
+                    audio = await task
+                    if index == 0:
+                        result.timings["tts_first_audio"] = now()
+                    result.audio.append(audio)
+                    emit(AUDIO, (index, audio))
+                    index += 1
+
+            if self.tts is not None:
+                deliver_task = asyncio.create_task(deliver_audio())
+
+            async for event in self.llm(messages):
+                if event.type == DELTA:
+                    if not parts:
+                        result.timings["llm_first_token"] = now()
+                    parts.append(event.text)
+                    emit(TEXT_DELTA, event.text)
+                    for sentence in segmenter.feed(event.text):
+                        submit_sentence(sentence)
+                elif event.type == USAGE:
+                    result.usage = event.usage
+                elif event.type == ERROR:
+                    raise RuntimeError(event.text)
+            for sentence in segmenter.flush():
+                submit_sentence(sentence)
+            result.reply = "".join(parts)
+            result.timings["llm"] = now()
+
+            # 4. 等待剩余句子合成完毕
+            if deliver_task is not None:
+                pending_audio.put_nowait(None)
+                await deliver_task
+                result.timings["tts"] = now()
+        except asyncio.CancelledError:
+            result.cancelled = True
+            result.reply = "".join(parts)
+        except Exception as e:
+            result.error = str(e)
+            result.reply = "".join(parts)
+        finally:
+            for task in [speculative_task, deliver_task, *tts_tasks]:
+                if task is not None and not task.done():
+                    task.cancel()
+            result.timings["total"] = now()
+            handle._emit(TurnEvent(DONE, result, result.timings["total"]))
+        return result
+
+    async def _resolve_hits(self, transcript, speculative_task, result, emit) -> List[RetrievalHit]:
+        if self.retrieve is None or not transcript:
+            return []
+        if speculative_task is not None:
+            try:
+                hits = await speculative_task
+            except Exception as e:
+                emit(WARNING, f"推测检索失败: {e}")
+                hits = []
+            if hits and answer_coverage(transcript, hits) >= self.speculative_min_overlap:
+                result.speculative = "hit"
+                return hits
+            result.speculative = "miss"
+        try:
+            return await asyncio.to_thread(self.retrieve, transcript) or []
+        except Exception as e:
+            emit(WARNING, f"知识库检索失败: {e}")
+            return []
+
+    async def _synthesize(self, sentence: str, slots: asyncio.Semaphore) -> Optional[bytes]:
+        async with slots:
+            try:
+                return await self.tts.synthesize(sentence)
+            except Exception as e:
+                print(f"⚠️ 句子合成失败: {e}")
+                return None
+
+
+def iter_turn_events(
+    pipeline: InterviewTurnPipeline,
+    request: TurnRequest,
+    timeout: Optional[float] = None,
+) -> Iterator[TurnEvent]:
+    """
+    同步接口：在共享后台事件循环中运行一轮，在调用线程中逐个产出事件，最后一个是 DONE。
+    调用方提前停止迭代（break / 关闭生成器）视为打断，本轮会被取消。
+    """
+    events: "queue.Queue[TurnEvent]" = queue.Queue()
+    handles: List[TurnHandle] = []
+
+    async def _drive():
+        handle = pipeline.start(request)
+        handles.append(handle)
+        async for event in handle.events():
+            events.put(event)
+
+    loop = get_background_loop()
+    future = loop.submit(_drive())
+    try:
+        while True:
+            event = events.get(timeout=timeout)
+            yield event
+            if event.type == DONE:
+                return
+    finally:
+        if not future.done():
+            if handles:
+                loop.loop.call_soon_threadsafe(handles[0].cancel)
+            future.cancel()
@@ -0,0 +1,328 @@
+"""
+批量生成面试评价报告：对一个目录下导出的 interview_history_*.json（「面试报告」页下载的 JSON）逐个调用 ai_report，
+用于离线重新校准和定时重评。
+
+- 有界的并发线程池：同时处理的文件数不超过 --workers，待处理的文件按需读取，目录再大也不会一次性载入
+- 限速：所有 LLM 请求共用一个令牌桶（--rate 次/秒），避免批量任务把 API 配额打满
+- 断点续跑：每处理完一个文件往输出目录的 checkpoint.jsonl 追加一行；再次运行时跳过已成功的文件，
+  失败的文件重新处理。跳过依据是 对话内容 + 评价模式/模型/提示词 的哈希，对话或评价方式变了会重新生成
+- 输出：每个文件一份 Markdown 报告，以及一份吞吐与延迟分位数的汇总 JSON
+
+用法：
+    python scripts/batch_report.py output/exports --workers 4 --rate 2
+    python scripts/batch_report.py output/exports --mode incremental --output output/reports/nightly
+    python scripts/batch_report.py output/exports --fake-services   # 用本地替身服务离线试跑
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+MODES = ("full", "incremental")
+CHECKPOINT_NAME = "checkpoint.jsonl"
+
+
+class RateLimiter:
+    """令牌桶：平均每秒 rate 个请求，最多攒 burst 个；rate <= 0 表示不限速。"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class Checkpoint:
+    """只追加的处理记录，每行 {"file", "hash", "status", ...}；同一文件以最后一行为准。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.latest: Dict[str, Dict] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 上次中断时写了一半的行
+                    self.latest[record["file"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def is_done(self, name: str, digest: str, report_path: Path) -> bool:
+        record = self.latest.get(name)
+        return bool(record and record["status"] == "done" and record["hash"] == digest and report_path.exists())
+
+    def record(self, **entry) -> None:
+        entry["ts"] = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.latest[entry["file"]] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            # 每个文件的报告都要花十几秒生成，逐条落盘的开销可以忽略
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def iter_history_files(input_dir: Path, pattern: str) -> Iterator[Path]:
+    # 只按文件名排序，文件内容在处理时才读取
+    names = sorted(entry.name for entry in os.scandir(input_dir) if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
+    for name in names:
+        yield input_dir / name
+
+
+def load_history(path: Path) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("history")
+    if not isinstance(data, list) or not all(isinstance(m, dict) and "role" in m for m in data):
+        raise ValueError("不是导出的对话记录（应为 [{role, content}, ...]）")
+    return data
+
+
+def settings_fingerprint(args) -> str:
+    """评价方式的指纹：模式、模型或提示词变化后，已有报告需要重新生成。"""
+    from config import REPORT_TURN_EVAL_MODEL
+    from modules.ai_report import AGGREGATE_SYSTEM_PROMPT, REPORT_SYSTEM_PROMPT
+    from modules.turn_evaluator import TURN_EVAL_SYSTEM_PROMPT
+
+    if args.mode == "full":
+        parts = [args.mode, args.model, str(not args.no_thinking), REPORT_SYSTEM_PROMPT]
+    else:
+        # 逐轮评分模型不走 --model，同样要计入指纹
+        parts = [args.mode, args.model, REPORT_TURN_EVAL_MODEL, TURN_EVAL_SYSTEM_PROMPT, AGGREGATE_SYSTEM_PROMPT]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def history_digest(history: List[Dict[str, str]], fingerprint: str) -> str:
+    payload = json.dumps(history, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{fingerprint}\0{payload}".encode("utf-8")).hexdigest()
+
+
+def make_evaluator(limiter: RateLimiter):
+    from modules.turn_evaluator import IncrementalEvaluator, llm_score_turn
+
+    def scorer(question: str, answer: str) -> str:
+        limiter.acquire()
+        return llm_score_turn(question, answer)
+
+    return IncrementalEvaluator(scorer)
+
+
+def generate_report(history: List[Dict[str, str]], args, limiter: RateLimiter, evaluator=None) -> str:
+    """full 模式直接生成报告；incremental 模式先逐轮评分再汇总，evaluator 在重试间复用，已评过的轮次不再重评。"""
+    from modules.ai_report import ai_report, ai_report_from_evaluations_stream_events
+    from modules.llm_stream import join_stream_text
+
+    if args.mode == "full":
+        limiter.acquire()
+        return ai_report(history, model=args.model, enable_thinking=not args.no_thinking)
+
+    evaluations = evaluator.results(history, timeout=None)
+    failed = [e.turn for e in evaluations if e.error]
+    if failed:
+        # 缺轮次的汇总报告不如整份重试
+        raise RuntimeError(f"第 {failed} 轮评分失败")
+    limiter.acquire()
+    return join_stream_text(ai_report_from_evaluations_stream_events(evaluations, model=args.model))
+
+
+def process_file(path: Path, args, limiter: RateLimiter, checkpoint: Checkpoint, fingerprint: str) -> Dict:
+    report_path = args.output / f"{path.stem}.md"
+    try:
+        history = load_history(path)
+    except (OSError, ValueError) as e:
+        error = f"读取失败: {e}"
+        checkpoint.record(file=path.name, hash="", status="failed", error=error)
+        return {"file": path.name, "status": "failed", "error": error}
+    digest = history_digest(history, fingerprint)
+    if not args.force and checkpoint.is_done(path.name, digest, report_path):
+        return {"file": path.name, "status": "skipped"}
+
+    evaluator = make_evaluator(limiter) if args.mode == "incremental" else None
+    error = None
+    for attempt in range(args.retries + 1):
+        started = time.perf_counter()
+        try:
+            report = generate_report(history, args, limiter, evaluator)
+            if report.startswith("⚠️"):
+                raise RuntimeError(report)
+        except Exception as e:
+            error = str(e)
+            if attempt < args.retries:
+                time.sleep(args.backoff * 2 ** attempt)
+            continue
+        seconds = time.perf_counter() - started
+        tmp_path = report_path.with_suffix(".md.tmp")
+        tmp_path.write_text(report, encoding="utf-8")
+        os.replace(tmp_path, report_path)
+        checkpoint.record(
+            file=path.name, hash=digest, status="done", report=report_path.name,
+            seconds=round(seconds, 3), attempts=attempt + 1, messages=len(history),
+        )
+        return {"file": path.name, "status": "done", "seconds": seconds, "attempts": attempt + 1}
+
+    checkpoint.record(file=path.name, hash=digest, status="failed", error=error, attempts=args.retries + 1)
+    return {"file": path.name, "status": "failed", "error": error}
+
+
+def run(args) -> Dict:
+    from modules.tracing import LatencyHistogram
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    checkpoint = Checkpoint(args.output / CHECKPOINT_NAME)
+    limiter = RateLimiter(args.rate, burst=args.workers)
+    fingerprint = settings_fingerprint(args)
+    files = iter_history_files(args.input_dir, args.pattern)
+    if args.limit:
+        files = (path for i, path in zip(range(args.limit), files))
+
+    results: List[Dict] = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            in_flight = set()
+            # 提交数与并发数挂钩，而不是一次把整个目录提交进线程池
+            for path in files:
+                if len(in_flight) >= args.workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(_report_progress(f.result()) for f in done)
+                in_flight.add(executor.submit(process_file, path, args, limiter, checkpoint, fingerprint))
+            for future in in_flight:
+                results.append(_report_progress(future.result()))
+    finally:
+        checkpoint.close()
+    total = time.perf_counter() - started
+
+    durations = [r["seconds"] for r in results if r["status"] == "done"]
+    histogram = LatencyHistogram(max_samples=max(1, len(durations)))
+    for value in durations:
+        histogram.observe(value)
+    latency = histogram.snapshot() if durations else {}
+    latency.pop("sum", None)
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("done", "skipped", "failed")}
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "input_dir": str(args.input_dir),
+            "mode": args.mode,
+            "model": args.model,
+            "workers": args.workers,
+            "rate": args.rate,
+        },
+        "counts": counts,
+        "throughput": {
+            "seconds": round(total, 3),
+            "reports_per_min": round(counts["done"] * 60 / total, 2) if total > 0 else 0.0,
+        },
+        "latency": latency,
+        "failed": [{"file": r["file"], "error": r.get("error")} for r in results if r["status"] == "failed"],
+    }
+
+
+_progress_lock = threading.Lock()
+
+
+def _report_progress(result: Dict) -> Dict:
+    with _progress_lock:
+        suffix = f" ({result['seconds']:.1f}s)" if "seconds" in result else ""
+        print(f"[{result['status']}] {result['file']}{suffix}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate interview reports for a directory of exported transcripts")
+    parser.add_argument("input_dir", type=Path, help="directory containing exported interview_history_*.json files")
+    parser.add_argument("--pattern", default="interview_history_*.json", help="file name glob")
+    parser.add_argument("--output", type=Path, help="report directory (default output/reports/batch)")
+    parser.add_argument("--mode", choices=MODES, default="full",
+                        help="full: one deep report per transcript; incremental: per-turn scores + aggregation")
+    parser.add_argument("--model", help="report model (default qwen-max for full, REPORT_AGGREGATE_MODEL for incremental)")
+    parser.add_argument("--no-thinking", action="store_true", help="disable thinking mode in full mode")
+    parser.add_argument("--workers", type=int, help="transcripts processed concurrently (default BATCH_REPORT_WORKERS)")
+    parser.add_argument("--rate", type=float, help="max LLM requests per second, 0 = unlimited (default BATCH_REPORT_RATE)")
+    parser.add_argument("--retries", type=int, help="retries per transcript (default BATCH_REPORT_MAX_RETRIES)")
+    parser.add_argument("--backoff", type=float, default=2.0, help="seconds before the first retry, doubled each time")
+    parser.add_argument("--limit", type=int, help="process at most this many files")
+    parser.add_argument("--force", action="store_true", help="regenerate reports even if already done")
+    parser.add_argument("--summary", type=Path, help="summary JSON path (default <output>/summary_<time>.json)")
+    parser.add_argument("--fake-services", action="store_true", help="run against local stand-ins (scripts/fake_services.py)")
+    args = parser.parse_args()
+
+    if not args.input_dir.is_dir():
+        raise SystemExit(f"Not a directory: {args.input_dir}")
+
+    services = None
+    if args.fake_services:
+        from scripts.benchmark import _point_at_fake_services
+        from scripts.fake_services import FakeServices
+
+        services = FakeServices().start()
+        # config 在导入时读取环境变量，必须在导入项目模块之前设置
+        _point_at_fake_services(services.base_url)
+
+    from config import (
+        BATCH_REPORT_MAX_RETRIES,
+        BATCH_REPORT_RATE,
+        BATCH_REPORT_WORKERS,
+        REPORT_AGGREGATE_MODEL,
+        REPORTS_DIR,
+    )
+
+    args.workers = max(1, args.workers if args.workers is not None else BATCH_REPORT_WORKERS)
+    args.rate = args.rate if args.rate is not None else BATCH_REPORT_RATE
+    args.retries = max(0, args.retries if args.retries is not None else BATCH_REPORT_MAX_RETRIES)
+    args.output = args.output or REPORTS_DIR / "batch"
+    args.model = args.model or ("qwen-max" if args.mode == "full" else REPORT_AGGREGATE_MODEL)
+    try:
+        summary = run(args)
+    finally:
+        if services is not None:
+            services.stop()
+
+    summary_path = args.summary or args.output / f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    summary_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    counts, latency = summary["counts"], summary["latency"]
+    print(
+        f"done: {counts['done']}, skipped: {counts['skipped']}, failed: {counts['failed']}, "
+        f"{summary['throughput']['reports_per_min']} reports/min"
+    )
+    if latency:
+        print(f"latency p50 {latency['p50']:.2f}s  p95 {latency['p95']:.2f}s  p99 {latency['p99']:.2f}s")
+    print(f"Summary saved to {summary_path}")
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
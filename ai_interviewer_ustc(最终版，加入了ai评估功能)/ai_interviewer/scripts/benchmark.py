@@ -0,0 +1,445 @@
+"""
+离线性能基准：在本地替身服务（scripts/fake_services.py）上跑端到端场景，记录各阶段延迟分位数与吞吐，
+结果写成 JSON，两次运行可以用 --compare 对比。不访问任何真实 API，也不需要 API Key。
+
+场景：
+- vector_build  用本地确定性 embedding（哈希 n-gram）对 data/cs 建 flat 索引 + BM25，并压测检索延迟
+- interview     与 Streamlit 相同的同步链路跑一场多轮面试：ASR -> RAG（含预取）-> LLM 流式 -> 逐句 TTS
+- pipeline      同一场面试改用 asyncio 流水线（InterviewTurnPipeline），各阶段重叠执行
+- report        用面试记录流式生成评价报告，可并发多份测吞吐
+- report_incremental  逐轮评分（面试过程中后台完成）+ 结束时汇总成报告，记录每轮评分耗时与报告等待时间
+
+用法：
+    python scripts/benchmark.py --turns 20 --ttft 0.3 --tokens-per-sec 40
+    python scripts/benchmark.py --scenarios interview,report --compare output/benchmarks/bench_xxx.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from scripts.fake_services import FakeServiceConfig, FakeServices
+
+SCENARIOS = ("vector_build", "interview", "pipeline", "report", "report_incremental")
+PERSONA = "你是一位专业、友善的技术面试官。你会根据候选人的回答进行追问，并给予简洁的反馈。每次回复保持简洁，2～4句话为宜。"
+DOMAIN = "cs"
+
+
+def _point_at_fake_services(base_url: str) -> None:
+    # config 在导入时读取环境变量，必须在导入项目模块之前设置
+    os.environ.update({
+        "LLM_BASE_URL": base_url,
+        "STEPFUN_BASE_URL": base_url,
+        "LLM_API_KEY": "bench",
+        "DASHSCOPE_API_KEY": "bench",
+        "STEPFUN_API_KEY": "bench",
+        "EMBEDDING_BACKEND": "local",
+        "QUERY_EMBEDDING_CACHE_PATH": "",
+        "TRACE_EXPORT_PATH": "",
+    })
+
+
+def _stats(values: List[float]) -> Dict[str, float]:
+    from modules.tracing import LatencyHistogram
+
+    histogram = LatencyHistogram(max_samples=max(1, len(values)))
+    for value in values:
+        histogram.observe(value)
+    stats = histogram.snapshot()
+    stats.pop("sum", None)
+    return stats
+
+
+def _summarize(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {name: _stats(values) for name, values in samples.items() if values}
+
+
+def _qa_pairs() -> List[Dict[str, str]]:
+    from scripts.build_cs_vector_store import DATA_DIR
+
+    pairs = []
+    for path in sorted(DATA_DIR.glob("qa_*.jsonl")):
+        with open(path, "r", encoding="utf-8") as f:
+            pairs.extend(json.loads(line) for line in f if line.strip())
+    return pairs
+
+
+def _interleave(pairs: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # 各主题轮流出题，模拟面试中话题的切换
+    by_topic: Dict[str, List[Dict[str, str]]] = {}
+    for pair in pairs:
+        by_topic.setdefault(pair.get("topic", ""), []).append(pair)
+    queues = list(by_topic.values())
+    mixed = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                mixed.append(queue.pop(0))
+    return mixed
+
+
+# ==================== 场景 ====================
+def run_vector_build(persist_dir: str, queries: List[str], args) -> Dict:
+    from modules.rag_engine import build_flat_index, retrieve
+    from scripts.build_cs_vector_store import CHUNK_OVERLAP, CHUNK_SIZE, iter_docs
+
+    started = time.perf_counter()
+    built = build_flat_index(iter_docs(), domain=DOMAIN, persist_dir=persist_dir,
+                             chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, backend="local")
+    build_seconds = time.perf_counter() - started
+
+    samples: Dict[str, List[float]] = {}
+    for mode in ("lexical", "vector", "hybrid"):
+        latencies = samples.setdefault(f"query_{mode}", [])
+        for query in queries[:args.queries]:
+            started = time.perf_counter()
+            retrieve(query, domain=DOMAIN, persist_dir=persist_dir, mode=mode, backend="local")
+            latencies.append(time.perf_counter() - started)
+
+    return {
+        "latency": _summarize(samples),
+        "throughput": {
+            "chunks": built["total"],
+            "build_seconds": round(build_seconds, 4),
+            "chunks_per_sec": round(built["total"] / build_seconds, 1) if build_seconds else 0.0,
+        },
+    }
+
+
+def run_interview(answers: List[str], rag_options: Dict, args) -> Dict:
+    from config import STEPFUN_API_KEY
+    from modules.async_runtime import run_in_background
+    from modules.audio_processor import StreamingSpeechPipeline, TTS_no_stream, audio_bytes_to_text
+    from modules.history_manager import ConversationMemory
+    from modules.llm_agent import llm_stream_events
+    from modules.llm_stream import DELTA, ERROR, USAGE
+    from modules.prompt_builder import PromptCacheStats
+    from modules.rag_engine import format_hits_for_prompt
+    from modules.rag_prefetch import RetrievalPrefetcher
+    from modules.tracing import get_tracer
+
+    tracer = get_tracer()
+    memory = ConversationMemory()
+    prefetcher = RetrievalPrefetcher()
+    cache_stats = PromptCacheStats()
+    tts = TTS_no_stream(STEPFUN_API_KEY, use_cache=False)
+    history: List[Dict[str, str]] = []
+    samples: Dict[str, List[float]] = {
+        "asr": [], "retrieval": [], "llm_ttft": [], "llm": [], "tts_tail": [], "turn": [],
+    }
+    errors = 0
+
+    started_all = time.perf_counter()
+    for turn in range(args.turns):
+        answer = answers[turn % len(answers)]
+        with tracer.turn():
+            started = time.perf_counter()
+            # 候选人的回答以 UTF-8 字节作为"录音"上传，替身 ASR 原样返回
+            transcript = run_in_background(audio_bytes_to_text(answer.encode("utf-8"), STEPFUN_API_KEY)) or answer
+            t_asr = time.perf_counter()
+
+            hits, _ = prefetcher.resolve(transcript, **rag_options)
+            context = format_hits_for_prompt(hits)
+            summary, recent = memory.build_context(history)
+            t_retrieval = time.perf_counter()
+
+            speech = StreamingSpeechPipeline(tts)
+            parts, t_first = [], None
+            for event in llm_stream_events(recent, transcript, system_prompt=PERSONA, context=context, summary=summary):
+                if event.type == DELTA:
+                    if t_first is None:
+                        t_first = time.perf_counter()
+                    parts.append(event.text)
+                    speech.feed_delta(event.text)
+                elif event.type == USAGE:
+                    cache_stats.record(event.usage)
+                elif event.type == ERROR:
+                    errors += 1
+            t_llm = time.perf_counter()
+            speech.finish()
+            speech.collect()
+            t_done = time.perf_counter()
+
+        reply = "".join(parts)
+        history += [{"role": "user", "content": transcript}, {"role": "assistant", "content": reply}]
+        memory.maybe_fold(history)
+        prefetcher.prefetch(reply, **rag_options)
+
+        samples["asr"].append(t_asr - started)
+        samples["retrieval"].append(t_retrieval - t_asr)
+        if t_first is not None:
+            samples["llm_ttft"].append(t_first - t_retrieval)
+        samples["llm"].append(t_llm - t_retrieval)
+        samples["tts_tail"].append(t_done - t_llm)
+        samples["turn"].append(t_done - started)
+    total = time.perf_counter() - started_all
+    memory.wait(timeout=30)
+
+    return {
+        "latency": _summarize(samples),
+        "throughput": {"turns": args.turns, "seconds": round(total, 3), "turns_per_min": round(args.turns * 60 / total, 2)},
+        "prefetch": prefetcher.stats(),
+        "prompt_cache": cache_stats.summary(),
+        "memory": memory.stats(history),
+        "errors": errors,
+        "history": history,
+    }
+
+
+def run_pipeline(answers: List[str], rag_options: Dict, args) -> Dict:
+    from config import STEPFUN_API_KEY
+    from modules.audio_processor import TTS_async
+    from modules.rag_engine import retrieve
+    from modules.rag_prefetch import extract_question
+    from modules.turn_pipeline import DONE, InterviewTurnPipeline, TurnRequest, iter_turn_events
+
+    pipeline = InterviewTurnPipeline(
+        retrieve=partial(retrieve, **rag_options),
+        tts=TTS_async(STEPFUN_API_KEY, use_cache=False),
+    )
+    history: List[Dict[str, str]] = []
+    samples: Dict[str, List[float]] = {}
+    speculative = {"hit": 0, "miss": 0}
+    errors, question = 0, None
+
+    started_all = time.perf_counter()
+    for turn in range(args.turns):
+        request = TurnRequest(
+            history=list(history),
+            persona=PERSONA,
+            audio=answers[turn % len(answers)].encode("utf-8"),
+            speculative_query=question,
+        )
+        result = None
+        for event in iter_turn_events(pipeline, request, timeout=120):
+            if event.type == DONE:
+                result = event.data
+        if result.error:
+            errors += 1
+        # 流水线的 timings 是各阶段完成时距本轮开始的秒数（阶段之间有重叠，不能相加）
+        for stage, seconds in result.timings.items():
+            samples.setdefault(stage, []).append(seconds)
+        if result.speculative:
+            speculative[result.speculative] += 1
+        history += [{"role": "user", "content": result.transcript}, {"role": "assistant", "content": result.reply}]
+        question = extract_question(result.reply)
+    total = time.perf_counter() - started_all
+
+    return {
+        "latency": _summarize(samples),
+        "throughput": {"turns": args.turns, "seconds": round(total, 3), "turns_per_min": round(args.turns * 60 / total, 2)},
+        "speculative": speculative,
+        "errors": errors,
+    }
+
+
+def run_report(history: List[Dict[str, str]], args) -> Dict:
+    from modules.ai_report import ai_report_stream_events
+    from modules.llm_stream import DELTA, ERROR, USAGE
+
+    def one_report(_):
+        started = time.perf_counter()
+        t_first, tokens, failed = None, 0, False
+        for event in ai_report_stream_events(history):
+            if event.type == DELTA and t_first is None:
+                t_first = time.perf_counter()
+            elif event.type == USAGE:
+                tokens = event.usage.get("completion_tokens") or 0
+            elif event.type == ERROR:
+                failed = True
+        done = time.perf_counter()
+        return started, t_first, done, tokens, failed
+
+    started_all = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.report_concurrency) as executor:
+        results = list(executor.map(one_report, range(args.reports)))
+    total = time.perf_counter() - started_all
+
+    samples: Dict[str, List[float]] = {"ttft": [], "total": [], "tokens_per_sec": []}
+    for started, t_first, done, tokens, _ in results:
+        samples["total"].append(done - started)
+        if t_first is not None:
+            samples["ttft"].append(t_first - started)
+            if tokens and done > t_first:
+                samples["tokens_per_sec"].append(tokens / (done - t_first))
+    return {
+        "latency": _summarize(samples),
+        "throughput": {
+            "reports": args.reports,
+            "concurrency": args.report_concurrency,
+            "seconds": round(total, 3),
+            "reports_per_min": round(args.reports * 60 / total, 2),
+        },
+        "errors": sum(1 for *_, failed in results if failed),
+    }
+
+
+def run_report_incremental(history: List[Dict[str, str]], args) -> Dict:
+    from modules.ai_report import ai_report_from_evaluations_stream_events
+    from modules.llm_stream import DELTA, ERROR
+    from modules.turn_evaluator import IncrementalEvaluator, iter_turns
+
+    samples: Dict[str, List[float]] = {"score_per_turn": [], "wait_scores": [], "ttft": [], "total": []}
+    errors = 0
+    for _ in range(args.reports):
+        evaluator = IncrementalEvaluator()
+        # 面试过程中每轮结束后提交评分；这部分在候选人思考、作答期间完成，不计入报告等待时间
+        # score_per_turn 为全部轮次并发评完的总耗时均摊到每轮
+        started = time.perf_counter()
+        evaluator.submit(history)
+        evaluator.results(history)
+        samples["score_per_turn"].append((time.perf_counter() - started) / max(1, len(list(iter_turns(history)))))
+
+        started = time.perf_counter()
+        evaluations = evaluator.results(history)
+        samples["wait_scores"].append(time.perf_counter() - started)
+        t_first = None
+        for event in ai_report_from_evaluations_stream_events(evaluations):
+            if event.type == DELTA and t_first is None:
+                t_first = time.perf_counter()
+            elif event.type == ERROR:
+                errors += 1
+        done = time.perf_counter()
+        if t_first is not None:
+            samples["ttft"].append(t_first - started)
+        samples["total"].append(done - started)
+    return {
+        "latency": _summarize(samples),
+        "turns": len(list(iter_turns(history))),
+        "failed_turns": sum(1 for e in evaluations if e.error),
+        "errors": errors,
+    }
+
+
+def warm_up() -> None:
+    # 首次请求包含客户端初始化、建连等一次性开销，不计入各场景
+    from modules.llm_agent import llm_stream_events
+    from modules.llm_stream import join_stream_text
+    from modules.tracing import get_tracer
+
+    join_stream_text(llm_stream_events([], "你好"))
+    get_tracer().reset()
+
+
+# ==================== 对比 ====================
+def compare(previous: Dict, current: Dict) -> None:
+    print(f"\n=== Compare with {previous['meta']['timestamp']} ===")
+    for scenario, result in current["scenarios"].items():
+        old = previous.get("scenarios", {}).get(scenario)
+        if not old:
+            continue
+        print(f"[{scenario}]")
+        for metric, stats in result.get("latency", {}).items():
+            old_stats = old.get("latency", {}).get(metric)
+            if not old_stats:
+                continue
+            cells = []
+            for q in ("p50", "p95"):
+                before, after = old_stats[q], stats[q]
+                change = f"{(after - before) / before:+.0%}" if before else "n/a"
+                cells.append(f"{q} {before:.4f} -> {after:.4f} ({change})")
+            print(f"  {metric:<16} " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against local stand-ins for the LLM and StepFun APIs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated, from {SCENARIOS}")
+    parser.add_argument("--turns", type=int, default=20, help="interview turns per run")
+    parser.add_argument("--queries", type=int, default=100, help="retrieval queries per mode in vector_build")
+    parser.add_argument("--reports", type=int, default=3, help="reports to generate")
+    parser.add_argument("--report-concurrency", type=int, default=1)
+    parser.add_argument("--output", help="result JSON path (default output/benchmarks/bench_<time>.json)")
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    defaults = FakeServiceConfig()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value, help="fake service setting")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {sorted(unknown)}")
+
+    fake_config = FakeServiceConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    with FakeServices(fake_config) as services, tempfile.TemporaryDirectory(prefix="bench_") as persist_dir:
+        _point_at_fake_services(services.base_url)
+        from config import OUTPUT_DIR
+        from modules.tracing import get_tracer
+
+        pairs = _interleave(_qa_pairs())
+        if not pairs:
+            raise SystemExit("No docs found in data/cs")
+        answers = [pair["answer"] for pair in pairs]
+        rag_options = {"domain": DOMAIN, "k": 6, "persist_dir": persist_dir, "mode": "hybrid", "backend": "local"}
+
+        warm_up()
+        results: Dict[str, Dict] = {}
+        # 其他场景都要用到检索，索引总是先建
+        print("Running vector_build ...")
+        vector_result = run_vector_build(persist_dir, [pair["question"] for pair in pairs], args)
+        if "vector_build" in scenarios:
+            results["vector_build"] = vector_result
+
+        history: Optional[List[Dict[str, str]]] = None
+        if "interview" in scenarios:
+            print(f"Running interview ({args.turns} turns) ...")
+            results["interview"] = run_interview(answers, rag_options, args)
+            history = results["interview"].pop("history")
+        if "pipeline" in scenarios:
+            print(f"Running pipeline ({args.turns} turns) ...")
+            results["pipeline"] = run_pipeline(answers, rag_options, args)
+        if history is None and ("report" in scenarios or "report_incremental" in scenarios):
+            history = []
+            for pair in pairs[:args.turns]:
+                history += [{"role": "assistant", "content": pair["question"]}, {"role": "user", "content": pair["answer"]}]
+        if "report" in scenarios:
+            print(f"Running report ({args.reports} reports) ...")
+            results["report"] = run_report(history, args)
+        if "report_incremental" in scenarios:
+            print(f"Running report_incremental ({args.reports} reports) ...")
+            results["report_incremental"] = run_report_incremental(history, args)
+
+        output = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+                "fake_requests": dict(services.counts),
+            },
+            "scenarios": results,
+            "spans": get_tracer().snapshot(),
+        }
+
+    output_path = Path(args.output) if args.output else (
+        OUTPUT_DIR / "benchmarks" / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(output, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    for scenario, result in results.items():
+        print(f"[{scenario}] " + json.dumps(result.get("throughput", {}), ensure_ascii=False))
+        for metric, stats in result.get("latency", {}).items():
+            print(f"  {metric:<16} p50 {stats['p50']:.4f}  p95 {stats['p95']:.4f}  p99 {stats['p99']:.4f}  (n={stats['count']})")
+    print(f"Saved to {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,33 @@
+import argparse
 import glob
 import json
 import os
 import shutil
 import stat
 from pathlib import Path
+from typing import Iterator
 
-from modules.rag_engine import build_vector_store
+from config import EMBEDDING_BACKEND
+from modules.rag_engine import (
+    EMBEDDING_BACKENDS,
+    build_flat_index,
+    build_vector_store,
+    invalidate_vector_store,
+    iter_chunks,
+    sync_vector_store,
+)
 
 ROOT = Path(__file__).resolve().parent.parent
 DATA_DIR = ROOT / "data" / "cs"
 PERSIST_DIR = ROOT / "vector_db"
 DOMAIN = "cs"
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 50
 
 
-def load_docs() -> list[dict]:
-    docs = []
-    for path in glob.glob(str(DATA_DIR / "qa_*.jsonl")):
+def iter_docs() -> Iterator[dict]:
+    # 逐行惰性读取，语料再大也不会一次性载入内存
+    for path in sorted(glob.glob(str(DATA_DIR / "qa_*.jsonl"))):
         with open(path, "r", encoding="utf-8") as f:
             for line in f:
                 line = line.strip()
@@ -27,8 +39,7 @@ def load_docs() -> list[dict]:
                     "topic": obj.get("topic", ""),
                     "difficulty": obj.get("difficulty", ""),
                 }
-                docs.append({"content": content, "metadata": metadata})
-    return docs
+                yield {"content": content, "metadata": metadata}
 
 
 def _on_rm_error(func, path, exc_info):
@@ -41,18 +52,76 @@ def _on_rm_error(func, path, exc_info):
 
 
 def main():
-    docs = load_docs()
-    if not docs:
+    parser = argparse.ArgumentParser(description="Build or incrementally update the cs vector store")
+    parser.add_argument("--dry-run", action="store_true", help="only report added/removed/unchanged chunks")
+    parser.add_argument("--full", action="store_true", help="delete the existing store and rebuild from scratch")
+    parser.add_argument("--batch-size", type=int, help="texts per embedding request")
+    parser.add_argument("--workers", type=int, help="concurrent embedding requests")
+    parser.add_argument(
+        "--backend",
+        choices=sorted(EMBEDDING_BACKENDS),
+        default=EMBEDDING_BACKEND,
+        help="embedding backend; non-dashscope backends build an offline NumPy flat index",
+    )
+    args = parser.parse_args()
+
+    if not glob.glob(str(DATA_DIR / "qa_*.jsonl")):
         raise SystemExit("No docs found in data/cs")
+    docs = iter_docs()
     target_dir = PERSIST_DIR / DOMAIN
+
+    if args.backend != "dashscope":
+        # 本地向量化很快，flat 索引总是全量重建
+        if args.dry_run:
+            count = sum(1 for _ in iter_chunks(docs, CHUNK_SIZE, CHUNK_OVERLAP))
+            print(f"[dry-run] {args.backend} backend would index {count} chunks")
+            return
+        result = build_flat_index(
+            docs=docs,
+            domain=DOMAIN,
+            persist_dir=str(PERSIST_DIR),
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            backend=args.backend,
+        )
+        print(f"Flat index built at: {target_dir} ({result['total']} chunks, dim {result['dim']})")
+        return
+
+    if not args.full:
+        delta = sync_vector_store(
+            docs=docs,
+            domain=DOMAIN,
+            persist_dir=str(PERSIST_DIR),
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            dry_run=args.dry_run,
+            batch_size=args.batch_size,
+            max_workers=args.workers,
+        )
+        prefix = "[dry-run] " if args.dry_run else ""
+        print(
+            f"{prefix}added: {delta['added']}, removed: {delta['removed']}, "
+            f"unchanged: {delta['unchanged']}, total: {delta['total']}"
+        )
+        if not args.dry_run:
+            print(f"Vector store synced at: {target_dir}")
+        return
+
+    if args.dry_run:
+        print("[dry-run] --full would re-embed all chunks")
+        return
     if target_dir.exists():
+        # 先丢弃缓存句柄，再删除目录，避免同进程内继续使用已删除的库
+        invalidate_vector_store(domain=DOMAIN, persist_dir=str(PERSIST_DIR))
         shutil.rmtree(target_dir, onerror=_on_rm_error)
     db_path = build_vector_store(
         docs=docs,
         domain=DOMAIN,
         persist_dir=str(PERSIST_DIR),
-        chunk_size=800,
-        chunk_overlap=50,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
     )
     print(f"Vector store built at: {db_path}")
 
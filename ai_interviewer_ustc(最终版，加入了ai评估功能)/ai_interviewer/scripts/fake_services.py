@@ -0,0 +1,324 @@
+"""
+本地替身服务：不访问任何真实 API 的情况下跑通整条链路，用于压测和性能回归。
+
+- POST /v1/chat/completions    OpenAI 兼容的对话接口（流式 SSE / 非流式），可配置首 token 延迟和输出速率，
+                               模拟服务端前缀缓存：与之前请求相同的消息前缀计入 prompt_tokens_details.cached_tokens；
+                               response_format 为 json_object 时返回逐轮评分格式的 JSON
+- POST /v1/audio/speech        StepFun TTS：按文本长度延迟后返回确定性的假音频字节
+- POST /v1/audio/transcriptions StepFun ASR：上传的"音频"若是 UTF-8 文本则原样作为识别结果返回
+
+只用标准库（ThreadingHTTPServer + HTTP/1.1 chunked），客户端的连接池、keep-alive 与线上行为一致。
+回复内容由请求内容的哈希决定，同样的输入每次得到同样的输出。
+
+单独启动：
+    python scripts/fake_services.py --port 8765 --ttft 0.3 --tokens-per-sec 40
+然后设置 LLM_BASE_URL / STEPFUN_BASE_URL=http://127.0.0.1:8765/v1 启动应用。
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from modules.token_utils import estimate_messages_tokens, estimate_tokens
+
+# 拼接回复用的句子池；面试官回复总以问句结尾，便于 RAG 预取取出问题
+_REPLY_SENTENCES = [
+    "你的回答思路比较清晰。",
+    "这里的关键在于理解底层的实现机制。",
+    "可以结合具体的项目经历展开说明。",
+    "这个点在高并发场景下尤其重要。",
+    "我们再从性能和可靠性的角度看一下。",
+    "整体方向是对的，但细节还可以更准确。",
+    "这也是面试中经常被追问的地方。",
+]
+_REPLY_QUESTIONS = [
+    "TCP 三次握手为什么不是两次？",
+    "MySQL 的索引为什么使用 B+ 树？",
+    "Redis 持久化有哪些方式，各自的优缺点是什么？",
+    "进程和线程的区别是什么？",
+    "如何设计一个短链接系统？",
+    "HashMap 扩容时会发生什么？",
+]
+_SCORE_DIMENSIONS = ["技术能力", "问题解决能力", "沟通表达能力", "学习潜力与思维深度", "综合素养"]
+
+
+@dataclass
+class FakeServiceConfig:
+    ttft: float = 0.3               # LLM 首 token 延迟（秒）
+    tokens_per_sec: float = 40.0    # LLM 输出速率（1 个中文字符约 1 token）
+    chunk_chars: int = 2            # 每个 SSE chunk 的字符数
+    reply_chars: int = 120          # 回复长度；请求带 max_tokens 时取两者较小值
+    tts_latency: float = 0.2        # TTS 固定延迟（秒）
+    tts_per_char: float = 0.005     # TTS 每个字符的额外延迟（秒）
+    asr_latency: float = 0.3        # ASR 固定延迟（秒）
+    asr_per_kb: float = 0.002       # ASR 每 KB 音频的额外延迟（秒）
+    jitter: float = 0.1             # 所有延迟的随机浮动比例（±）
+    seed: int = 42
+
+
+class _PrefixCache:
+    """模拟服务端前缀缓存：记住见过的消息前缀，返回本次请求命中的最长前缀的 token 数。"""
+
+    def __init__(self, max_entries: int = 4096):
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+
+    def lookup_and_store(self, messages: List[Dict[str, str]]) -> int:
+        digests, running = [], hashlib.sha1()
+        for message in messages:
+            running.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            digests.append(running.hexdigest())
+        cached = 0
+        with self._lock:
+            for i, digest in enumerate(digests):
+                if digest in self._seen:
+                    cached = i + 1
+                self._seen[digest] = None
+                self._seen.move_to_end(digest)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return estimate_messages_tokens(messages[:cached])
+
+
+class FakeServices:
+    """
+    用法：
+        with FakeServices(FakeServiceConfig(ttft=0.2)) as services:
+            os.environ["LLM_BASE_URL"] = services.base_url
+            ...
+        services.counts  # 各接口的请求数
+    """
+
+    def __init__(self, config: Optional[FakeServiceConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServiceConfig()
+        self._random = random.Random(self.config.seed)
+        self._random_lock = threading.Lock()
+        self.prefix_cache = _PrefixCache()
+        self.counts: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeServices":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeServices":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ---------- 行为 ----------
+    def delay(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        with self._random_lock:
+            factor = 1 + self._random.uniform(-self.config.jitter, self.config.jitter)
+        time.sleep(seconds * factor)
+
+    def count(self, endpoint: str) -> None:
+        with self._counts_lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def json_reply(self, messages: List[Dict[str, str]]) -> str:
+        # 目前只有逐轮评分（turn_evaluator）请求 JSON 输出，按它的格式返回确定性的分数
+        last = messages[-1].get("content", "") if messages else ""
+        rng = random.Random(zlib.crc32(last.encode("utf-8")))
+        return json.dumps({
+            "scores": {name: rng.randint(4, 9) for name in _SCORE_DIMENSIONS},
+            "notes": rng.choice(_REPLY_SENTENCES),
+            "highlight": rng.choice(_REPLY_SENTENCES),
+            "weakness": "",
+        }, ensure_ascii=False)
+
+    def reply_text(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> str:
+        last = messages[-1].get("content", "") if messages else ""
+        rng = random.Random(zlib.crc32(last.encode("utf-8")))
+        limit = min(self.config.reply_chars, max_tokens) if max_tokens else self.config.reply_chars
+        question = rng.choice(_REPLY_QUESTIONS)
+        parts, budget = [], limit - len(question)
+        while budget > 0:
+            sentence = rng.choice(_REPLY_SENTENCES)
+            if len(sentence) > budget:
+                break
+            parts.append(sentence)
+            budget -= len(sentence)
+        return ("".join(parts) + question)[:max(limit, 1)]
+
+
+def _make_handler(services: FakeServices):
+    config = services.config
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive，与线上客户端的连接复用一致
+        disable_nagle_algorithm = True  # SSE 小包立即发出，否则 Nagle + 延迟确认会给每个 chunk 叠加约 40ms
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send_json(self, payload: Dict, status: int = 200) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path.endswith("/chat/completions"):
+                self._chat(json.loads(self._read_body() or b"{}"))
+            elif path.endswith("/audio/speech"):
+                self._speech(json.loads(self._read_body() or b"{}"))
+            elif path.endswith("/audio/transcriptions"):
+                self._transcribe(self._read_body())
+            else:
+                self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+        # ---------- LLM ----------
+        def _chat(self, request: Dict) -> None:
+            services.count("chat")
+            messages = request.get("messages") or []
+            if (request.get("response_format") or {}).get("type") == "json_object":
+                text = services.json_reply(messages)
+            else:
+                text = services.reply_text(messages, request.get("max_tokens"))
+            prompt_tokens = estimate_messages_tokens(messages)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": estimate_tokens(text),
+                "total_tokens": prompt_tokens + estimate_tokens(text),
+                "prompt_tokens_details": {"cached_tokens": services.prefix_cache.lookup_and_store(messages)},
+            }
+            base = {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+            }
+            services.delay(config.ttft)
+
+            if not request.get("stream"):
+                # 非流式：等价于生成完整回复所需的时间
+                services.delay(len(text) / config.tokens_per_sec)
+                self._send_json(dict(
+                    base,
+                    object="chat.completion",
+                    choices=[{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    usage=usage,
+                ))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(choices, **extra):
+                payload = dict(base, object="chat.completion.chunk", choices=choices, **extra)
+                self._send_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            step = max(1, config.chunk_chars)
+            interval = step / config.tokens_per_sec
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i in range(0, len(text), step):
+                if i:
+                    services.delay(interval)
+                event([{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event([], usage=usage)
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+
+        # ---------- TTS / ASR ----------
+        def _speech(self, request: Dict) -> None:
+            services.count("tts")
+            text = request.get("input", "")
+            services.delay(config.tts_latency + config.tts_per_char * len(text))
+            # 确定性的假音频：文本哈希重复到与文本长度成比例的大小
+            body = b"ID3" + hashlib.sha256(text.encode("utf-8")).digest() * max(1, len(text) // 4)
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _transcribe(self, body: bytes) -> None:
+            services.count("asr")
+            content_type = self.headers.get("Content-Type", "")
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+            )
+            audio = b""
+            for part in message.iter_parts() if message.is_multipart() else []:
+                if part.get_filename():
+                    audio = part.get_payload(decode=True) or b""
+            services.delay(config.asr_latency + config.asr_per_kb * len(audio) / 1024)
+            try:
+                text = audio.decode("utf-8")
+            except UnicodeDecodeError:
+                text = "这是一段测试语音的识别结果。"
+            self._send_json({"text": text})
+
+    return _Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the LLM (OpenAI-compatible) and StepFun TTS/ASR APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    defaults = FakeServiceConfig()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    config = FakeServiceConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    services = FakeServices(config, host=args.host, port=args.port).start()
+    print(f"Fake services listening on {services.base_url}")
+    print(f"export LLM_BASE_URL={services.base_url} STEPFUN_BASE_URL={services.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,11 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT))
 
-from config import DASHSCOPE_API_KEY
-from modules.rag_engine import get_retrieved_context
+from config import DASHSCOPE_API_KEY, RAG_RETRIEVAL_MODE
+from modules.rag_engine import RETRIEVAL_MODES, format_hits_for_prompt, get_query_cache_stats, retrieve
 
 
-def run_query(query: str, difficulty: str | None, topic: str | None, k: int, domain: str, persist_dir: str) -> None:
+def run_query(query: str, difficulty: str | None, topic: str | None, k: int, domain: str, persist_dir: str, mode: str = RAG_RETRIEVAL_MODE) -> None:
     if DASHSCOPE_API_KEY:
         os.environ["DASHSCOPE_API_KEY"] = DASHSCOPE_API_KEY
 
@@ -21,21 +21,29 @@ def run_query(query: str, difficulty: str | None, topic: str | None, k: int, dom
     if topic:
         filt["topic"] = topic
 
-    ctx = get_retrieved_context(
+    hits = retrieve(
         query=query,
         domain=domain,
         k=k,
         persist_dir=persist_dir,
         search_filter=filt or None,
+        mode=mode,
     )
 
     print("=== Query ===")
     print(query)
+    print("=== Mode ===")
+    print(mode)
     print("=== Filter ===")
     print(filt or "None")
-    print("=== Result ===")
+    print("=== Hits ===")
+    for hit in hits:
+        print(f"{hit.score:.4f} [{hit.source}] {hit.id[:8]} {hit.metadata} {hit.text[:60]!r}")
+    ctx = format_hits_for_prompt(hits)
+    print("=== Prompt context ===")
     print(ctx)
     print(f"\nlen: {len(ctx)}")
+    print(f"query embedding cache: {get_query_cache_stats()}")
 
 
 def main():
@@ -45,6 +53,7 @@ def main():
     parser.add_argument("--topic", help="metadata topic filter")
     parser.add_argument("--k", type=int, default=5, help="top-k to retrieve")
     parser.add_argument("--domain", default="cs", help="domain name (vector dir)")
+    parser.add_argument("--mode", choices=RETRIEVAL_MODES, default=RAG_RETRIEVAL_MODE, help="retrieval mode")
     parser.add_argument("--persist-dir", default=str(ROOT / "vector_db"), help="vector db root dir")
     args = parser.parse_args()
 
@@ -68,7 +77,7 @@ def main():
         domain = args.domain
         persist_dir = args.persist_dir
 
-    run_query(query, difficulty, topic, k, domain, persist_dir)
+    run_query(query, difficulty, topic, k, domain, persist_dir, args.mode)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+测试 embedding_cache 模块：用假的向量化函数验证内存 LRU、SQLite 持久层、namespace 隔离与条数上限。
+不访问网络，直接运行 python test_embedding_cache.py 或用 pytest 收集均可。
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 确保项目根目录在 sys.path 中
+sys.path.insert(0, str(Path(__file__).parent))
+
+from modules.embedding_cache import QueryEmbeddingCache
+
+
+class FakeEmbed:
+    """记录调用次数的假向量化函数：向量由文本长度和字符编码和算出，保证不同文本不同向量。"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return [float(len(text)), sum(map(ord, text)) / 7.0, 0.1]
+
+
+def test_lru_hit_after_normalization():
+    """全角字符、多余空白经 NFKC 归一化后命中同一条缓存"""
+    embed = FakeEmbed()
+    cache = QueryEmbeddingCache(embed, max_entries=2)
+    first = cache.get("ＴＣＰ  三次握手")
+    assert cache.get(" TCP 三次握手 ") == first
+    assert embed.calls == ["TCP 三次握手"]
+    assert cache.stats()["hits"] == 1
+
+    # 超过 max_entries 后最久未用的条目被淘汰，再查询要重新向量化
+    cache.get("进程与线程")
+    cache.get("Redis 持久化")
+    cache.get("TCP 三次握手")
+    assert len(embed.calls) == 4
+    assert cache.stats()["size"] == 2
+
+
+def test_disk_hit_after_reopen():
+    """重新打开同一个缓存文件：内存为空时从磁盘读回，向量与首次计算的完全一致"""
+    embed = FakeEmbed()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "query_cache.sqlite3"
+        vector = QueryEmbeddingCache(embed, persist_path=path, namespace="m1").get("自我介绍")
+
+        reopened = QueryEmbeddingCache(embed, persist_path=path, namespace="m1")
+        assert reopened.get("自我介绍") == vector
+        assert len(embed.calls) == 1
+        assert reopened.stats()["disk_hits"] == 1
+
+
+def test_namespace_isolation():
+    """不同 embedding 模型（namespace）共用一个文件时互不命中"""
+    embed = FakeEmbed()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "query_cache.sqlite3"
+        QueryEmbeddingCache(embed, persist_path=path, namespace="m1").get("哈希冲突")
+        other = QueryEmbeddingCache(embed, persist_path=path, namespace="m2")
+        other.get("哈希冲突")
+        assert len(embed.calls) == 2
+        assert other.stats()["disk_hits"] == 0
+
+
+def test_max_disk_entries_pruning():
+    """持久层超过 max_disk_entries 后淘汰最久没用的条目"""
+    embed = FakeEmbed()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "query_cache.sqlite3"
+        cache = QueryEmbeddingCache(embed, max_entries=1, persist_path=path, max_disk_entries=10)
+        for i in range(25):
+            cache.get(f"问题 {i}")
+        count = cache._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        assert count <= 10
+
+        # 最早的问题已被淘汰，需要重新向量化；最近的问题仍能从磁盘读回
+        calls = len(embed.calls)
+        cache.get("问题 24")
+        assert len(embed.calls) == calls
+        cache.get("问题 0")
+        assert len(embed.calls) == calls + 1
+
+
+if __name__ == "__main__":
+    for test in (
+        test_lru_hit_after_normalization,
+        test_disk_hit_after_reopen,
+        test_namespace_isolation,
+        test_max_disk_entries_pruning,
+    ):
+        test()
+        print(f"✅ {test.__doc__.strip()}")
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+测试 IncrementalSentenceSegmenter：同一段文本无论按什么粒度喂入，切出的句子都一样。
+不访问网络，直接运行 python test_sentence_segmenter.py 或用 pytest 收集均可。
+"""
+
+import sys
+from pathlib import Path
+
+# 确保项目根目录在 sys.path 中
+sys.path.insert(0, str(Path(__file__).parent))
+
+from modules.audio_processor import IncrementalSentenceSegmenter
+
+CASES = [
+    ("你好！我是今天的面试官。请问你准备好了吗？我们开始面", ["你好！", "我是今天的面试官。", "请问你准备好了吗？", "我们开始面"]),
+    ("他说：“好的。”然后走了", ["他说：“好的。”", "然后走了"]),
+    ("Pi is 3.14. Use e.g. node.js. Done", ["Pi is 3.14.", "Use e.g. node.js.", "Done"]),
+    ("列表：1. 第一项 2. 第二项。然后呢？", ["列表：1. 第一项 2. 第二项。", "然后呢？"]),
+    ("1. first\n2. second", ["1. first", "2. second"]),
+    ("I said no. Then left.", ["I said no.", "Then left."]),
+    ("See No. 5 for details. Ok.", ["See No. 5 for details.", "Ok."]),
+]
+
+
+def segment(text, step):
+    segmenter = IncrementalSentenceSegmenter()
+    sentences = []
+    for i in range(0, len(text), step):
+        sentences.extend(segmenter.feed(text[i:i + step]))
+    return sentences + segmenter.flush()
+
+
+def test_segmentation():
+    """按 1、2、3 个字符和整段喂入，结果都与预期一致"""
+    for text, expected in CASES:
+        for step in (1, 2, 3, len(text)):
+            assert segment(text, step) == expected, (text, step)
+
+
+if __name__ == "__main__":
+    test_segmentation()
+    print(f"✅ {test_segmentation.__doc__.strip()}")
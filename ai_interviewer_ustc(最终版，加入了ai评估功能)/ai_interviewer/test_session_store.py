@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+测试 session_store 模块：模拟崩溃留下的半行、压缩后的回放结果。
+只读写临时目录，直接运行 python test_session_store.py 或用 pytest 收集均可。
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 确保项目根目录在 sys.path 中
+sys.path.insert(0, str(Path(__file__).parent))
+
+from modules.session_store import SessionStore
+
+MOCK_HISTORY = [
+    {"role": "assistant", "content": "请介绍一下 TCP 三次握手。"},
+    {"role": "user", "content": "客户端发 SYN，服务端回 SYN+ACK，客户端再发 ACK。"},
+]
+
+
+def test_crash_recovery():
+    """进程崩溃留下的半行在回放时被跳过，重新打开写入时被截掉"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp, idle_close=0)
+        sid = store.new_session_id()
+        store.set_meta(sid, persona="技术面试官")
+        store.append_messages(sid, MOCK_HISTORY)
+        store.close()
+
+        # 模拟写到一半崩溃：文件末尾是一条没有换行的残缺记录
+        path = Path(tmp) / f"{sid}.jsonl"
+        with open(path, "ab") as f:
+            f.write(b'{"type":"message","role":"user","cont')
+
+        store = SessionStore(tmp, idle_close=0)
+        snapshot = store.load(sid)
+        assert snapshot.history == MOCK_HISTORY
+        assert snapshot.meta == {"persona": "技术面试官"}
+
+        store.append_messages(sid, [{"role": "assistant", "content": "很好。"}])
+        assert store.load(sid).history == MOCK_HISTORY + [{"role": "assistant", "content": "很好。"}]
+        assert b"cont{" not in path.read_bytes()
+        store.close()
+
+
+def test_compaction():
+    """压缩丢掉被覆盖的设置与报告，回放结果和会话开始时间不变"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp, compact_min_bytes=1 << 30, idle_close=0)
+        sid = store.new_session_id()
+        store.set_meta(sid, persona="A", rag_top_k=6)
+        store.append_messages(sid, MOCK_HISTORY)
+        store.append_rag(sid, {"query": "TCP", "hits": 3})
+        for i in range(5):
+            store.set_meta(sid, rag_top_k=i)
+            store.set_report(sid, f"第 {i} 版报告")
+        before = store.load(sid)
+        size = (Path(tmp) / f"{sid}.jsonl").stat().st_size
+
+        assert store.compact(sid)
+        after = store.load(sid)
+        assert (Path(tmp) / f"{sid}.jsonl").stat().st_size < size
+        assert after.meta == before.meta == {"persona": "A", "rag_top_k": 4}
+        assert after.history == before.history
+        assert after.rag_history == before.rag_history
+        assert after.report == "第 4 版报告"
+        assert after.created == before.created
+
+        # 压缩后继续追加
+        store.append_messages(sid, [{"role": "user", "content": "好的"}])
+        assert len(store.load(sid).history) == len(MOCK_HISTORY) + 1
+        store.close()
+
+
+if __name__ == "__main__":
+    for test in (test_crash_recovery, test_compaction):
+        test()
+        print(f"✅ {test.__doc__.strip()}")